@@ -6,21 +6,29 @@ Usage:
     from gp3_auth import get_gp3_user, require_app, set_auth_cookies, clear_auth_cookies
 
     @app.get("/protected")
-    def protected(user = Depends(get_gp3_user)):
+    async def protected(user = Depends(get_gp3_user)):
         return {"email": user["email"], "company": user["company_name"]}
 
     @app.get("/cal-only")
-    def cal_only(user = Depends(require_app("cal"))):
+    async def cal_only(user = Depends(require_app("cal"))):
         return {"company_id": user["company_id"]}
+
+Tokens are verified locally (SUPABASE_JWT_SECRET for HS256, the project JWKS
+for asymmetric keys) and the resulting profile is cached until the token
+expires or GP3_AUTH_CACHE_TTL passes, whichever is first. Supabase is only
+called on a cache miss. All Supabase calls go through one shared
+httpx.AsyncClient; call close_gp3_client() on shutdown.
 """
 import os
 import math
+import time
+import hashlib
 import logging
+from collections import Counter, OrderedDict, deque
 from typing import Optional
-from functools import lru_cache
 from fastapi import Request, HTTPException, Depends
 from fastapi.responses import Response
-from supabase import create_client, Client
+from jose import jwt, JWTError
 import httpx
 
 logger = logging.getLogger("gp3_auth")
@@ -33,15 +41,44 @@ COOKIE_DOMAIN = os.getenv("GP3_COOKIE_DOMAIN", ".gp3.app")
 COOKIE_PREFIX = "gp3_auth"
 COOKIE_CHUNK_SIZE = 3800  # Keep under 4KB per cookie
 COOKIE_MAX_AGE = 60 * 60 * 24 * 7  # 7 days
+HTTP_TIMEOUT = 5.0
+
+# Local JWT verification. Without a secret (HS256) or a reachable JWKS
+# (RS256/ES256) tokens are checked against /auth/v1/user instead.
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+JWKS_TTL = int(os.getenv("GP3_JWKS_TTL", "3600"))
+JWKS_MIN_REFRESH = 60  # seconds between refetches triggered by an unknown kid
+
+# token -> profile cache
+AUTH_CACHE_SIZE = int(os.getenv("GP3_AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = int(os.getenv("GP3_AUTH_CACHE_TTL", "300"))  # also how long profile edits take to apply
+AUTH_NEGATIVE_TTL = int(os.getenv("GP3_AUTH_NEGATIVE_TTL", "60"))  # invalid token / missing profile
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Shared connection pool for Supabase auth and PostgREST calls."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=SUPABASE_URL,
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+    return _client
 
-_supabase: Optional[Client] = None
 
+async def close_gp3_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
 
-def _get_supabase() -> Client:
-    global _supabase
-    if _supabase is None:
-        _supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-    return _supabase
+
+def _service_headers() -> dict:
+    return {"apikey": SUPABASE_SERVICE_KEY, "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}"}
 
 
 # ── Cookie Chunking ──────────────────────────────────────────
@@ -126,64 +163,217 @@ def _chunk_string(s: str, size: int) -> list:
     return [s[i:i + size] for i in range(0, len(s), size)]
 
 
+# ── Metrics ──────────────────────────────────────────────────
+
+metrics: Counter = Counter()
+_upstream_ms: deque = deque(maxlen=1000)  # recent Supabase call latencies
+
+
+async def _upstream(method: str, path: str, **kwargs) -> httpx.Response:
+    """Supabase request through the shared client, timed for auth_cache_stats()."""
+    started = time.perf_counter()
+    try:
+        return await _get_client().request(method, path, **kwargs)
+    except Exception:
+        metrics["upstream_errors"] += 1
+        raise
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        metrics["upstream_calls"] += 1
+        _upstream_ms.append(elapsed)
+
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def auth_cache_stats() -> dict:
+    hits = metrics["cache_hits"] + metrics["negative_hits"]
+    lookups = hits + metrics["cache_misses"]
+    recent = list(_upstream_ms)
+    return {
+        "hits": metrics["cache_hits"],
+        "negative_hits": metrics["negative_hits"],
+        "misses": metrics["cache_misses"],
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        "entries": len(_token_cache),
+        "evictions": metrics["cache_evictions"],
+        "verified_local": metrics["verified_local"],
+        "verified_upstream": metrics["verified_upstream"],
+        "rejected": metrics["rejected"],
+        "jwks_fetches": metrics["jwks_fetches"],
+        "upstream_calls": metrics["upstream_calls"],
+        "upstream_errors": metrics["upstream_errors"],
+        "upstream_ms_p50": round(_percentile(recent, 50), 1),
+        "upstream_ms_p95": round(_percentile(recent, 95), 1),
+        "upstream_ms_max": round(max(recent), 1) if recent else 0.0,
+    }
+
+
 # ── Token Validation ─────────────────────────────────────────
 
-def _validate_token(token: str) -> Optional[dict]:
-    """Validate Supabase JWT and return user info."""
+class _Rejected(Exception):
+    """The token is definitely not usable (bad signature, expired, unknown user)."""
+
+
+class _Unavailable(Exception):
+    """Supabase could not answer; the outcome is not cached."""
+
+
+_jwks: dict = {"keys": {}, "fetched_at": 0.0}
+
+
+async def _jwks_key(kid: Optional[str]) -> Optional[dict]:
+    """Signing key for `kid` from the project JWKS, refetched hourly or when a new kid appears."""
+    now = time.time()
+    stale = now - _jwks["fetched_at"] > JWKS_TTL
+    unknown = kid not in _jwks["keys"] and now - _jwks["fetched_at"] > JWKS_MIN_REFRESH
+    if stale or unknown:
+        try:
+            resp = await _upstream("GET", "/auth/v1/.well-known/jwks.json")
+            resp.raise_for_status()
+            _jwks["keys"] = {k.get("kid"): k for k in resp.json().get("keys", [])}
+            metrics["jwks_fetches"] += 1
+        except Exception as e:
+            logger.warning(f"JWKS fetch failed: {e}")
+        _jwks["fetched_at"] = now
+    return _jwks["keys"].get(kid)
+
+
+async def _verify_locally(token: str) -> Optional[dict]:
+    """Verify signature and expiry without a network call (JWKS aside).
+    Returns {"id", "email", "exp"}, None when no local key is available, or raises _Rejected."""
+    try:
+        header = jwt.get_unverified_header(token)
+    except JWTError:
+        raise _Rejected("Malformed token")
+
+    alg = header.get("alg", "")
+    if alg == "HS256":
+        key = SUPABASE_JWT_SECRET or None
+    elif alg in ("RS256", "ES256"):
+        key = await _jwks_key(header.get("kid"))
+    else:
+        raise _Rejected(f"Unsupported token algorithm {alg}")
+    if key is None:
+        return None
+
+    try:
+        claims = jwt.decode(token, key, algorithms=[alg], audience=SUPABASE_JWT_AUDIENCE)
+    except JWTError as e:
+        raise _Rejected(str(e))
+    metrics["verified_local"] += 1
+    return {"id": claims.get("sub"), "email": claims.get("email"), "exp": claims.get("exp")}
+
+
+async def _validate_token(token: str) -> Optional[dict]:
+    """Validate Supabase JWT and return user info.
+    Raises _Rejected when the token is bad, _Unavailable when Supabase could not be asked."""
+    user = await _verify_locally(token)
+    if user is not None:
+        return user
+
+    # Use Supabase's auth.getUser() which validates the JWT server-side
     try:
-        # Use Supabase's auth.getUser() which validates the JWT server-side
         headers = {
             "apikey": SUPABASE_SERVICE_KEY,
             "Authorization": f"Bearer {token}",
         }
-        resp = httpx.get(f"{SUPABASE_URL}/auth/v1/user", headers=headers, timeout=5.0)
-        if resp.status_code == 200:
-            return resp.json()
-        return None
+        resp = await _upstream("GET", "/auth/v1/user", headers=headers)
     except Exception as e:
         logger.warning(f"Token validation failed: {e}")
-        return None
+        raise _Unavailable(str(e))
+    if resp.status_code in (401, 403):
+        raise _Rejected("Rejected by Supabase")
+    if resp.status_code != 200:
+        logger.warning(f"Token validation failed: HTTP {resp.status_code}")
+        raise _Unavailable(f"HTTP {resp.status_code}")
+
+    metrics["verified_upstream"] += 1
+    user = resp.json()
+    try:
+        user["exp"] = jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        user["exp"] = None
+    return user
 
 
-def _get_profile(auth_id: str = None, email: str = None) -> Optional[dict]:
-    """Fetch gp3_profiles row by auth_id or email."""
-    sb = _get_supabase()
+async def _get_profile(auth_id: str = None, email: str = None) -> Optional[dict]:
+    """Fetch gp3_profiles row by auth_id or email (PostgREST, service key).
+    None means no such profile; lookup failures raise _Unavailable."""
     try:
-        if auth_id:
-            r = sb.table("gp3_profiles").select("*").eq("auth_id", auth_id).limit(1).execute()
-            if r.data:
-                return r.data[0]
-        if email:
-            r = sb.table("gp3_profiles").select("*").eq("email", email).limit(1).execute()
-            if r.data:
-                return r.data[0]
+        for column, value in (("auth_id", auth_id), ("email", email)):
+            if not value:
+                continue
+            resp = await _upstream(
+                "GET", "/rest/v1/gp3_profiles",
+                params={"select": "*", column: f"eq.{value}", "limit": "1"},
+                headers=_service_headers(),
+            )
+            resp.raise_for_status()
+            rows = resp.json()
+            if rows:
+                return rows[0]
     except Exception as e:
         logger.warning(f"Profile lookup failed: {e}")
+        raise _Unavailable(str(e))
     return None
 
 
-# ── FastAPI Dependencies ─────────────────────────────────────
+# ── Token Cache ──────────────────────────────────────────────
+
+# sha256(token) -> (expires_at, profile dict | HTTPException to re-raise)
+_token_cache: OrderedDict = OrderedDict()
+
+
+def _cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _cache_get(key: str):
+    entry = _token_cache.get(key)
+    if entry is None:
+        return None
+    if entry[0] <= time.time():
+        del _token_cache[key]
+        return None
+    _token_cache.move_to_end(key)
+    return entry[1]
+
+
+def _cache_put(key: str, value, ttl: float, token_exp: Optional[float] = None):
+    expires_at = time.time() + ttl
+    if token_exp:
+        expires_at = min(expires_at, float(token_exp))
+    _token_cache[key] = (expires_at, value)
+    _token_cache.move_to_end(key)
+    while len(_token_cache) > AUTH_CACHE_SIZE:
+        _token_cache.popitem(last=False)
+        metrics["cache_evictions"] += 1
 
-def get_gp3_user(request: Request) -> dict:
-    """
-    FastAPI dependency: extract and validate user from cookies or Authorization header.
-    Returns profile dict with company_id, tenant_id, allowed_apps, etc.
-    """
-    # Try cookie first, then header
-    token = _get_token_from_cookies(request) or _get_token_from_header(request)
-    if not token:
-        raise HTTPException(status_code=401, detail="Not authenticated — no token found")
 
-    # Validate with Supabase
-    auth_user = _validate_token(token)
-    if not auth_user:
+def clear_auth_cache():
+    """Drop cached tokens, e.g. after changing a profile's apps or deactivating a user."""
+    _token_cache.clear()
+
+
+async def _resolve_profile(token: str) -> dict:
+    """Validate a token and load its profile.
+    Raises HTTPException for unusable tokens (cached) and _Unavailable (not cached)."""
+    try:
+        auth_user = await _validate_token(token)
+    except _Rejected as e:
+        logger.debug(f"Token rejected: {e}")
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
     auth_id = auth_user.get("id")
     email = auth_user.get("email")
 
     # Fetch profile
-    profile = _get_profile(auth_id=auth_id, email=email)
+    profile = await _get_profile(auth_id=auth_id, email=email)
     if not profile:
         raise HTTPException(status_code=403, detail=f"No GP3 profile found for {email}. Contact admin.")
 
@@ -193,19 +383,57 @@ def get_gp3_user(request: Request) -> dict:
     # Auto-link auth_id if not yet linked
     if profile.get("auth_id") is None and auth_id:
         try:
-            sb = _get_supabase()
-            sb.table("gp3_profiles").update({
-                "auth_id": auth_id,
-                "last_login": "now()",
-            }).eq("id", profile["id"]).execute()
+            resp = await _upstream(
+                "PATCH", "/rest/v1/gp3_profiles",
+                params={"id": f"eq.{profile['id']}"},
+                json={"auth_id": auth_id, "last_login": "now()"},
+                headers=_service_headers(),
+            )
+            resp.raise_for_status()
             profile["auth_id"] = auth_id
         except Exception:
             pass
 
-    # Attach raw token for downstream use
-    profile["_token"] = token
     profile["_auth_id"] = auth_id
+    profile["_exp"] = auth_user.get("exp")
+    return profile
+
+
+# ── FastAPI Dependencies ─────────────────────────────────────
+
+async def get_gp3_user(request: Request) -> dict:
+    """
+    FastAPI dependency: extract and validate user from cookies or Authorization header.
+    Returns profile dict with company_id, tenant_id, allowed_apps, etc.
+    """
+    # Try cookie first, then header
+    token = _get_token_from_cookies(request) or _get_token_from_header(request)
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated — no token found")
 
+    key = _cache_key(token)
+    cached = _cache_get(key)
+    if isinstance(cached, HTTPException):
+        metrics["negative_hits"] += 1
+        raise cached
+    if cached is not None:
+        metrics["cache_hits"] += 1
+        profile = cached
+    else:
+        metrics["cache_misses"] += 1
+        try:
+            profile = await _resolve_profile(token)
+        except _Unavailable:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+        except HTTPException as e:
+            metrics["rejected"] += 1
+            _cache_put(key, e, AUTH_NEGATIVE_TTL)
+            raise
+        _cache_put(key, profile, AUTH_CACHE_TTL, profile.get("_exp"))
+
+    # Copy so callers can't mutate the cached entry; attach raw token for downstream use
+    profile = dict(profile)
+    profile["_token"] = token
     return profile
 
 
@@ -215,10 +443,10 @@ def require_app(app_name: str):
 
     Usage:
         @app.get("/endpoint")
-        def endpoint(user = Depends(require_app("cal"))):
+        async def endpoint(user = Depends(require_app("cal"))):
             ...
     """
-    def _check(user: dict = Depends(get_gp3_user)) -> dict:
+    async def _check(user: dict = Depends(get_gp3_user)) -> dict:
         allowed = user.get("allowed_apps") or []
         if app_name not in allowed and user.get("role") != "admin":
             raise HTTPException(
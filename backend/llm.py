@@ -0,0 +1,486 @@
+"""
+Model provider layer for the SDS agent.
+
+call_agent / stream_agent in main.py go through one LLMClient, whose provider
+is chosen by LLM_PROVIDER:
+
+    gemini   Google Gemini (default). One GenerativeModel per system prompt, reused.
+    openai   Any OpenAI-compatible /chat/completions server (vLLM, llama.cpp,
+             Ollama, LM Studio) at LLM_BASE_URL, over one shared httpx client.
+    stub     No network. Deterministic canned responses after LLM_STUB_LATENCY
+             seconds (+ LLM_STUB_TOKEN_MS per output token), for load tests.
+             Extraction prompts get JSON filled in from the requested schema.
+
+Around every call the client adds a per-tenant concurrency limit (separate
+lanes for interactive requests and background extraction, so a bulk import
+cannot starve a tenant's Q&A), a timeout,
+retries with exponential backoff for transient errors (timeouts, connection
+errors, 429/5xx) and a circuit breaker: after LLM_BREAKER_FAILURES transient
+failures in a row, calls fail fast with LLMUnavailable for LLM_BREAKER_COOLDOWN
+seconds, then a single probe call decides whether it closes again.
+
+Usage:
+    from llm import get_llm, LLMUnavailable, close_llm, llm_stats
+
+    result = await get_llm().generate(system, prompt, tenant_id=tid)
+    # {"text": ..., "input_tokens": ..., "output_tokens": ...}
+"""
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from collections import Counter, OrderedDict, deque
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger("sds-agent.llm")
+
+# ── Config ───────────────────────────────────────────────────
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")  # gemini | openai | stub
+LLM_MODEL = os.getenv("LLM_MODEL", "")  # default depends on the provider
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "http://localhost:8080/v1")  # openai provider
+LLM_API_KEY = os.getenv("LLM_API_KEY", "")
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # per attempt; per chunk when streaming
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BACKOFF = float(os.getenv("LLM_BACKOFF", "0.5"))  # first retry delay, doubled each attempt (with jitter)
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_TENANT_CONCURRENCY = int(os.getenv("LLM_TENANT_CONCURRENCY", "8"))  # model calls in flight per tenant and lane
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+LLM_STUB_LATENCY = float(os.getenv("LLM_STUB_LATENCY", "0.5"))
+LLM_STUB_TOKEN_MS = float(os.getenv("LLM_STUB_TOKEN_MS", "0"))
+LLM_STUB_ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", "0"))  # fraction of calls failing with a 503
+
+DEFAULT_MODELS = {"gemini": "gemini-2.0-flash", "openai": "local-model", "stub": "stub"}
+MODEL_CACHE_SIZE = 32  # Gemini model objects kept, keyed by system prompt
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class LLMUnavailable(Exception):
+    """The model provider is down, timing out or rate limiting us (HTTP 503)."""
+
+    def __init__(self, message: str, retry_after: float = LLM_BREAKER_COOLDOWN):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class StubError(Exception):
+    code = 503
+
+
+def is_transient(exc: Exception) -> bool:
+    """Worth retrying: timeouts, connection problems, 429 and 5xx from any provider."""
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in TRANSIENT_STATUS
+    return getattr(exc, "code", None) in TRANSIENT_STATUS  # google.api_core exceptions
+
+
+def usage_dict(text: str, input_tokens: int, output_tokens: int) -> dict:
+    return {"text": text, "input_tokens": input_tokens or 0, "output_tokens": output_tokens or 0}
+
+
+# ── Providers ────────────────────────────────────────────────
+
+class Provider:
+    """generate() returns usage_dict(...); stream() yields text and fills `usage` at the end."""
+    name = "base"
+
+    def __init__(self, model: str):
+        self.model = model
+
+    async def generate(self, system: str, prompt: str, max_output_tokens: int, temperature: float) -> dict:
+        raise NotImplementedError
+
+    async def stream(self, system: str, prompt: str, max_output_tokens: int, temperature: float, usage: dict):
+        raise NotImplementedError
+        yield  # pragma: no cover
+
+    async def close(self):
+        pass
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+
+    def __init__(self, model: str):
+        super().__init__(model)
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        self._genai = genai
+        self._models: OrderedDict = OrderedDict()
+
+    def _model(self, system: str):
+        """Reuse the GenerativeModel for a system prompt instead of building one per call."""
+        key = hashlib.sha256(system.encode()).hexdigest()
+        model = self._models.get(key)
+        if model is None:
+            model = self._genai.GenerativeModel(model_name=self.model, system_instruction=system)
+            self._models[key] = model
+            if len(self._models) > MODEL_CACHE_SIZE:
+                self._models.popitem(last=False)
+        else:
+            self._models.move_to_end(key)
+        return model
+
+    def _config(self, max_output_tokens: int, temperature: float):
+        return self._genai.types.GenerationConfig(max_output_tokens=max_output_tokens, temperature=temperature)
+
+    async def generate(self, system, prompt, max_output_tokens, temperature):
+        response = await self._model(system).generate_content_async(
+            prompt, generation_config=self._config(max_output_tokens, temperature),
+        )
+        meta = response.usage_metadata
+        return usage_dict(
+            response.text,
+            getattr(meta, "prompt_token_count", 0) if meta else 0,
+            getattr(meta, "candidates_token_count", 0) if meta else 0,
+        )
+
+    async def stream(self, system, prompt, max_output_tokens, temperature, usage):
+        response = await self._model(system).generate_content_async(
+            prompt, generation_config=self._config(max_output_tokens, temperature), stream=True,
+        )
+        parts = []
+        async for chunk in response:
+            try:
+                piece = chunk.text
+            except ValueError:  # chunk without text parts (e.g. the final finish_reason chunk)
+                continue
+            if piece:
+                parts.append(piece)
+                yield piece
+        meta = response.usage_metadata
+        usage.update(usage_dict(
+            "".join(parts),
+            getattr(meta, "prompt_token_count", 0) if meta else 0,
+            getattr(meta, "candidates_token_count", 0) if meta else 0,
+        ))
+
+
+class OpenAICompatProvider(Provider):
+    """OpenAI-style chat completions, e.g. a local vLLM / llama.cpp / Ollama server."""
+    name = "openai"
+
+    def __init__(self, model: str):
+        super().__init__(model)
+        headers = {"Authorization": f"Bearer {LLM_API_KEY}"} if LLM_API_KEY else {}
+        self._client = httpx.AsyncClient(
+            base_url=LLM_BASE_URL.rstrip("/"), headers=headers, timeout=None,  # LLMClient enforces timeouts
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+
+    def _body(self, system, prompt, max_output_tokens, temperature, stream: bool) -> dict:
+        body = {
+            "model": self.model,
+            "messages": [{"role": "system", "content": system}, {"role": "user", "content": prompt}],
+            "max_tokens": max_output_tokens,
+            "temperature": temperature,
+        }
+        if stream:
+            body.update(stream=True, stream_options={"include_usage": True})
+        return body
+
+    async def generate(self, system, prompt, max_output_tokens, temperature):
+        r = await self._client.post("/chat/completions", json=self._body(system, prompt, max_output_tokens, temperature, False))
+        r.raise_for_status()
+        data = r.json()
+        usage = data.get("usage") or {}
+        return usage_dict(data["choices"][0]["message"]["content"] or "",
+                          usage.get("prompt_tokens"), usage.get("completion_tokens"))
+
+    async def stream(self, system, prompt, max_output_tokens, temperature, usage):
+        body = self._body(system, prompt, max_output_tokens, temperature, True)
+        parts, counts = [], {}
+        async with self._client.stream("POST", "/chat/completions", json=body) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == "[DONE]":
+                    break
+                chunk = json.loads(payload)
+                counts = chunk.get("usage") or counts
+                for choice in chunk.get("choices") or []:
+                    piece = (choice.get("delta") or {}).get("content")
+                    if piece:
+                        parts.append(piece)
+                        yield piece
+        text = "".join(parts)
+        # Servers without include_usage support: estimate at ~4 characters per token
+        usage.update(usage_dict(text, counts.get("prompt_tokens", (len(system) + len(prompt)) // 4),
+                                counts.get("completion_tokens", len(text) // 4)))
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class StubProvider(Provider):
+    """Offline stand-in with realistic timing. Responses depend only on the prompt."""
+    name = "stub"
+    ANSWER_WORDS = ("Wear splash goggles, nitrile gloves and a lab coat; keep the container closed, store away "
+                    "from ignition sources and oxidizers, and see SDS sections 4, 7 and 8 for details.").split()
+
+    def _respond(self, prompt: str) -> str:
+        if "with this structure:" in prompt:
+            skeleton = prompt.split("with this structure:", 1)[1].strip()
+            end = _json_object_end(skeleton)
+            try:
+                return json.dumps(_fill_schema(json.loads(skeleton[:end]), _stub_product(prompt)))
+            except ValueError:
+                pass
+        seed = int(hashlib.sha256(prompt.encode()).hexdigest()[:8], 16)
+        words = 40 + seed % 80
+        return " ".join(self.ANSWER_WORDS[i % len(self.ANSWER_WORDS)] for i in range(words))
+
+    async def _wait(self, output_tokens: int):
+        if LLM_STUB_ERROR_RATE and random.random() < LLM_STUB_ERROR_RATE:
+            await asyncio.sleep(LLM_STUB_LATENCY / 2)
+            raise StubError("stub provider: simulated 503")
+        await asyncio.sleep(LLM_STUB_LATENCY + output_tokens * LLM_STUB_TOKEN_MS / 1000)
+
+    async def generate(self, system, prompt, max_output_tokens, temperature):
+        text = self._respond(prompt)
+        result = usage_dict(text, (len(system) + len(prompt)) // 4, len(text) // 4)
+        await self._wait(result["output_tokens"])
+        return result
+
+    async def stream(self, system, prompt, max_output_tokens, temperature, usage):
+        text = self._respond(prompt)
+        result = usage_dict(text, (len(system) + len(prompt)) // 4, len(text) // 4)
+        await self._wait(0)
+        pieces = re.findall(r"\S+\s*", text)
+        for i in range(0, len(pieces), 8):
+            await asyncio.sleep(8 * 1.3 * LLM_STUB_TOKEN_MS / 1000)
+            yield "".join(pieces[i:i + 8])
+        usage.update(result)
+
+
+def _json_object_end(s: str) -> int:
+    """Index just past the first balanced {...} in s (strings ignored)."""
+    depth, in_str, escape = 0, False, False
+    for i, ch in enumerate(s):
+        if in_str:
+            escape = ch == "\\" and not escape
+            if ch == '"' and not escape:
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return len(s)
+
+
+def _stub_product(prompt: str) -> str:
+    m = re.search(r"^Filename: (.+?)(?:\.\w+)?$", prompt, re.M)
+    return m.group(1).replace("_", " ").title() if m else "Stub Chemical"
+
+
+def _fill_schema(shape, product: str, key: str = ""):
+    """Plausible values for an extraction schema skeleton."""
+    fixed = {"product_name": product, "cas_number": None, "signal_word": "Warning",
+             "revision_date": "2024-01-01", "pictogram_codes": ["GHS07"], "hazard_class": "general"}
+    if key in fixed:
+        return fixed[key]
+    if isinstance(shape, dict):
+        return {k: (v if k == "title" else _fill_schema(v, product, k)) for k, v in shape.items()}
+    if isinstance(shape, list):
+        return [f"stub {key.replace('_', ' ')}"]
+    return f"stub {key.replace('_', ' ')}".strip()
+
+
+PROVIDERS = {"gemini": GeminiProvider, "openai": OpenAICompatProvider, "stub": StubProvider}
+
+
+# ── Client: concurrency, timeout, retries, circuit breaker ───
+
+class LLMClient:
+    def __init__(self, provider: Provider):
+        self.provider = provider
+        self._tenant_slots: dict = {}
+        self._failures = 0
+        self._open_until = 0.0
+        self._probing = False
+        self._in_flight = 0
+        self.metrics: Counter = Counter()
+        self._latency_ms: deque = deque(maxlen=1000)
+
+    @property
+    def label(self) -> str:
+        """provider:model, e.g. part of the extraction cache key."""
+        return f"{self.provider.name}:{self.provider.model}"
+
+    def _slots(self, tenant_id: Optional[str], lane: str) -> asyncio.Semaphore:
+        key = (tenant_id or "-", lane)
+        if key not in self._tenant_slots:
+            self._tenant_slots[key] = asyncio.Semaphore(LLM_TENANT_CONCURRENCY)
+        return self._tenant_slots[key]
+
+    def _admit(self) -> bool:
+        """Circuit breaker gate: closed -> pass; open -> LLMUnavailable; cooled down -> one probe.
+        Returns True when this call is the probe."""
+        if not self._open_until:
+            return False
+        now = time.monotonic()
+        if now < self._open_until or self._probing:
+            self.metrics["breaker_rejected"] += 1
+            raise LLMUnavailable(f"Model provider unavailable ({self.label})",
+                                 retry_after=max(1.0, self._open_until - now))
+        self._probing = True
+        return True
+
+    def _abandoned(self, probe: bool):
+        """The call ended without an outcome (cancelled, or the stream's consumer went away).
+        If it was the probe, stay open for another cooldown so a later call can probe again."""
+        if probe and self._probing:
+            self.metrics["probes_abandoned"] += 1
+            self._open_until = time.monotonic() + LLM_BREAKER_COOLDOWN
+            self._probing = False
+
+    def _succeeded(self, started: float):
+        self._latency_ms.append((time.perf_counter() - started) * 1000)
+        if self._open_until:
+            logger.info(f"LLM circuit closed ({self.label})")
+        self._failures, self._open_until, self._probing = 0, 0.0, False
+
+    def _failed(self, exc: Exception):
+        self._failures += 1
+        self.metrics["timeouts" if isinstance(exc, asyncio.TimeoutError) else "transient_errors"] += 1
+        if self._probing or self._failures >= LLM_BREAKER_FAILURES:
+            if not self._open_until or self._probing:
+                self.metrics["breaker_opened"] += 1
+                logger.warning(f"LLM circuit open for {LLM_BREAKER_COOLDOWN:.0f}s after {self._failures} failures "
+                               f"({self.label}): {exc!r}")
+            self._open_until = time.monotonic() + LLM_BREAKER_COOLDOWN
+            self._probing = False
+
+    async def _backoff(self, attempt: int):
+        self.metrics["retries"] += 1
+        await asyncio.sleep(random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF * 2 ** attempt)))
+
+    async def generate(self, system: str, prompt: str, tenant_id: Optional[str] = None, lane: str = "interactive",
+                       max_output_tokens: int = 6000, temperature: float = 0.2) -> dict:
+        async with self._slots(tenant_id, lane):
+            for attempt in range(LLM_RETRIES + 1):
+                probe = self._admit()
+                started = time.perf_counter()
+                self.metrics["calls"] += 1
+                self._in_flight += 1
+                try:
+                    result = await asyncio.wait_for(
+                        self.provider.generate(system, prompt, max_output_tokens, temperature), LLM_TIMEOUT)
+                except Exception as e:
+                    if not is_transient(e):
+                        self._probing = False
+                        self.metrics["errors"] += 1
+                        raise
+                    self._failed(e)
+                    if attempt == LLM_RETRIES:
+                        raise LLMUnavailable(f"Model call failed after {attempt + 1} attempts: {e!r}") from e
+                    await self._backoff(attempt)
+                    continue
+                except BaseException:
+                    self._abandoned(probe)
+                    raise
+                finally:
+                    self._in_flight -= 1
+                self._succeeded(started)
+                self.metrics["input_tokens"] += result["input_tokens"]
+                self.metrics["output_tokens"] += result["output_tokens"]
+                return result
+
+    async def stream(self, system: str, prompt: str, usage: dict, tenant_id: Optional[str] = None,
+                     lane: str = "interactive", max_output_tokens: int = 6000, temperature: float = 0.2):
+        """Yields text chunks. Retries only until the first chunk has been sent;
+        LLM_TIMEOUT applies to the wait for each chunk."""
+        async with self._slots(tenant_id, lane):
+            for attempt in range(LLM_RETRIES + 1):
+                probe = self._admit()
+                started = time.perf_counter()
+                self.metrics["calls"] += 1
+                chunks = self.provider.stream(system, prompt, max_output_tokens, temperature, usage)
+                sent = False
+                self._in_flight += 1
+                try:
+                    while True:
+                        try:
+                            piece = await asyncio.wait_for(chunks.__anext__(), LLM_TIMEOUT)
+                        except StopAsyncIteration:
+                            break
+                        sent = True
+                        yield piece
+                except Exception as e:
+                    if not is_transient(e):
+                        self._probing = False
+                        self.metrics["errors"] += 1
+                        raise
+                    self._failed(e)
+                    if sent or attempt == LLM_RETRIES:
+                        raise LLMUnavailable(f"Streaming model call failed: {e!r}") from e
+                    await self._backoff(attempt)
+                    continue
+                except BaseException:
+                    # CancelledError, or GeneratorExit at the yield when the client disconnects
+                    self._abandoned(probe)
+                    raise
+                finally:
+                    self._in_flight -= 1
+                    await chunks.aclose()
+                self._succeeded(started)
+                self.metrics["input_tokens"] += usage.get("input_tokens", 0)
+                self.metrics["output_tokens"] += usage.get("output_tokens", 0)
+                return
+
+    def stats(self) -> dict:
+        lat = sorted(self._latency_ms)
+        now = time.monotonic()
+        return {
+            "provider": self.label,
+            **{k: self.metrics[k] for k in ("calls", "retries", "timeouts", "transient_errors", "errors",
+                                            "breaker_opened", "breaker_rejected", "probes_abandoned",
+                                            "input_tokens", "output_tokens")},
+            "breaker": "open" if self._open_until > now else ("half-open" if self._open_until else "closed"),
+            "in_flight": self._in_flight,
+            "latency_p50_ms": round(lat[len(lat) // 2], 1) if lat else None,
+            "latency_p95_ms": round(lat[int(len(lat) * 0.95)], 1) if lat else None,
+        }
+
+
+_llm: Optional[LLMClient] = None
+
+
+def get_llm() -> LLMClient:
+    """Process-wide client for the configured provider, built on first use."""
+    global _llm
+    if _llm is None:
+        if LLM_PROVIDER not in PROVIDERS:
+            raise ValueError(f"Unknown LLM_PROVIDER {LLM_PROVIDER!r} (choose from {', '.join(PROVIDERS)})")
+        _llm = LLMClient(PROVIDERS[LLM_PROVIDER](LLM_MODEL or DEFAULT_MODELS[LLM_PROVIDER]))
+        logger.info(f"LLM provider: {_llm.label}")
+    return _llm
+
+
+async def close_llm():
+    global _llm
+    if _llm is not None:
+        await _llm.provider.close()
+        _llm = None
+
+
+def llm_stats() -> dict:
+    return get_llm().stats()
@@ -1,28 +1,43 @@
 from fastapi import FastAPI, Depends, HTTPException, Request, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import Response, FileResponse
+from fastapi.responses import Response, FileResponse, StreamingResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker, Session
-import google.generativeai as genai
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from retrieval import RegistryIndex, flatten_json, tokenize
+from sds_parser import ParsedSDS, PARSER_VERSION, parse_sds_pdf, parse_date, section_excerpts, valid_cas
+from llm import LLMUnavailable, get_llm, close_llm, llm_stats
+from zpl import (BASE_DPI, SUPPORTED_DPI, TemplateNotFound, graphic_downloads, render_label, set_quantity,
+                 template_stats, template_version)
+from pdf_render import (LabelLayoutError, close_pdf_pool, pdf_stats, render_evidence_pdf, render_labels_pdf,
+                        resolve_layout, run_pdf, start_pdf_pool)
+from spooler import (PrintJob, PrintQueueFull, close_spoolers, get_print_job, printer_status, spooler_stats,
+                     submit_print_job)
 from pydantic import BaseModel
 from passlib.context import CryptContext
 from jose import jwt, JWTError
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 import os
 import re
-import io
 import uuid
 import json
-import socket
+import base64
+import hashlib
+import asyncio
+import zipfile
 import logging
+from collections import Counter, OrderedDict
+from contextlib import aclosing
 
 # SSO middleware
 try:
-    from gp3_auth import get_gp3_user
+    from gp3_auth import get_gp3_user, close_gp3_client, auth_cache_stats
     SSO_AVAILABLE = True
 except ImportError:
     SSO_AVAILABLE = False
@@ -47,22 +62,107 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.exception_handler(LLMUnavailable)
+async def llm_unavailable(request: Request, exc: LLMUnavailable):
+    """Provider down, timing out or circuit open: tell clients to come back later."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "AI model temporarily unavailable, try again shortly"},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
 # ============================================================
 # CONFIG
 # ============================================================
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 SECRET_KEY = os.getenv("SECRET_KEY")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 ENVIRONMENT = os.getenv("ENVIRONMENT", "production")
 ALGORITHM = "HS256"
 TOKEN_EXPIRE_DAYS = 7
-
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_size=10)
-SessionLocal = sessionmaker(bind=engine)
+SDS_BLOB_DIR = Path(os.getenv("SDS_BLOB_DIR", "/app/uploads/blobs"))  # content-addressed SDS files
+
+# SDS ingestion job queue
+SDS_WORKERS = int(os.getenv("SDS_WORKERS", "4"))
+SDS_JOB_MAX_ATTEMPTS = int(os.getenv("SDS_JOB_MAX_ATTEMPTS", "3"))
+SDS_JOB_STALE_SECONDS = int(os.getenv("SDS_JOB_STALE_SECONDS", "600"))  # reclaim 'running' jobs older than this
+SDS_JOB_POLL_SECONDS = float(os.getenv("SDS_JOB_POLL_SECONDS", "5"))
+
+# SDS expiry: advance_sds_statuses() only touches rows whose transition date has come,
+# so checking hourly is cheap and picks up the new day (or missed days) promptly
+SDS_EXPIRY_INTERVAL = float(os.getenv("SDS_EXPIRY_INTERVAL", "3600"))  # seconds between runs; 0 = off
+SDS_EXPIRY_LOCK = 0x5D5E0001  # pg advisory lock: one replica advances statuses at a time
+
+# Bulk SDS import
+SDS_BULK_CONCURRENCY = int(os.getenv("SDS_BULK_CONCURRENCY", "4"))  # model calls in flight per batch
+SDS_BULK_WRITE_BATCH = int(os.getenv("SDS_BULK_WRITE_BATCH", "20"))  # files per insert transaction
+SDS_BULK_EST_TOKENS = int(os.getenv("SDS_BULK_EST_TOKENS", "8000"))  # budget reserved per file
+SDS_BULK_MAX_FILES = int(os.getenv("SDS_BULK_MAX_FILES", "1000"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+SDS_UPLOAD_MAX_BYTES = int(os.getenv("SDS_UPLOAD_MAX_MB", "50")) * 1024 * 1024  # one SDS file
+SDS_ARCHIVE_MAX_BYTES = int(os.getenv("SDS_ARCHIVE_MAX_MB", "1024")) * 1024 * 1024  # one bulk ZIP, packed and unpacked
+LOGO_UPLOAD_MAX_BYTES = int(os.getenv("LOGO_UPLOAD_MAX_MB", "5")) * 1024 * 1024
+
+# Local SDS text extraction (sds_parser.py) ahead of the model call
+SDS_PARSE_MAX_PAGES = int(os.getenv("SDS_PARSE_MAX_PAGES", "50"))
+SDS_SECTION_CHARS = int(os.getenv("SDS_SECTION_CHARS", "1500"))  # per-section text sent to the model
+SDS_BRIEF_SECTION_CHARS = int(os.getenv("SDS_BRIEF_SECTION_CHARS", "400"))  # long sections we only summarise
+SDS_BRIEF_SECTIONS = ("11", "12", "13", "15", "16")  # toxicology, ecology, disposal, regulatory, other
+
+# Extraction runs as one model call per section group, concurrently
+SDS_SECTION_GROUPS = (("1", "2", "3"), ("4", "5", "6"), ("7", "8"), ("9", "10"), ("11", "12", "13"), ("14", "15", "16"))
+SDS_SECTION_CONCURRENCY = int(os.getenv("SDS_SECTION_CONCURRENCY", "6"))  # model calls in flight per SDS
+SDS_SECTION_RETRIES = int(os.getenv("SDS_SECTION_RETRIES", "2"))  # extra rounds for sections that fail validation
+SDS_SECTION_MAX_TOKENS = int(os.getenv("SDS_SECTION_MAX_TOKENS", "2000"))  # output cap per group call
+
+# Q&A retrieval
+QA_TOP_K = int(os.getenv("QA_TOP_K", "8"))  # chemicals sent with each question
+QA_EXCERPTS = int(os.getenv("QA_EXCERPTS", "6"))  # SDS section excerpts sent with each question
+QA_EXCERPT_CHARS = int(os.getenv("QA_EXCERPT_CHARS", "700"))
+QA_ATTENTION_LIMIT = int(os.getenv("QA_ATTENTION_LIMIT", "25"))  # expired/missing chemicals always listed
+
+# Q&A answer cache (per tenant, in-process)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))  # entries per tenant
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))  # seconds
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.85"))  # Jaccard over question terms; 1 = exact only
+
+# Dashboard responses (per tenant, in-process); wall screens poll every ~30 s
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "15"))  # seconds; 0 = no caching
+
+# Kernel cache
+KERNEL_STAT_SECONDS = float(os.getenv("KERNEL_STAT_SECONDS", "2"))  # min interval between kernel file stat checks
+KERNEL_TENANT_TTL = int(os.getenv("KERNEL_TENANT_TTL", "300"))  # re-read tenant name/slug after this
+
+# CPU-bound work (bcrypt, SDS parsing, index builds) runs here, off the event loop; PDFs use pdf_render's process pool
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "4"))
+LABEL_BATCH_MAX = int(os.getenv("LABEL_BATCH_MAX", "1000"))  # chemicals per /sds/labels/batch call
+LABEL_PDF_MAX = int(os.getenv("LABEL_PDF_MAX", "3000"))  # labels (chemicals x copies) per /sds/labels/pdf
+
+# Per-tenant token limits: a token bucket for rate, tenants.token_budget_monthly for the month
+TENANT_TOKENS_PER_MINUTE = int(os.getenv("TENANT_TOKENS_PER_MINUTE", "120000"))  # bucket refill; 0 = no rate limit
+TENANT_TOKEN_BURST = int(os.getenv("TENANT_TOKEN_BURST", "240000"))  # bucket size
+TOKEN_INTERACTIVE_RESERVE = float(os.getenv("TOKEN_INTERACTIVE_RESERVE", "0.25"))  # share of the bucket extraction cannot take
+TOKEN_QUEUE_SECONDS = float(os.getenv("TOKEN_QUEUE_SECONDS", "10"))  # Q&A/evidence wait this long for tokens, then 429
+TOKEN_EXTRACTION_QUEUE_SECONDS = float(os.getenv("TOKEN_EXTRACTION_QUEUE_SECONDS", "300"))
+TOKEN_BUDGET_REFRESH_SECONDS = int(os.getenv("TOKEN_BUDGET_REFRESH_SECONDS", "60"))  # re-read budget + month usage
+
+# Write-behind event pipeline (compliance_events, token_usage)
+EVENT_FLUSH_SECONDS = float(os.getenv("EVENT_FLUSH_SECONDS", "2"))
+EVENT_FLUSH_ROWS = int(os.getenv("EVENT_FLUSH_ROWS", "500"))  # flush early once this many rows are buffered
+EVENT_QUEUE_MAX = int(os.getenv("EVENT_QUEUE_MAX", "20000"))  # beyond this, new events are dropped and counted
+
+
+def _async_database_url(url: str):
+    """DATABASE_URL stays a plain postgresql:// URL; the app talks to it through asyncpg."""
+    return make_url(url).set(drivername="postgresql+asyncpg")
+
+
+engine = create_async_engine(_async_database_url(DATABASE_URL), pool_pre_ping=True, pool_size=10)
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
-genai.configure(api_key=GEMINI_API_KEY)
 
 # ============================================================
 # MODELS
@@ -109,16 +209,36 @@ class PrintRequest(BaseModel):
     quantity: int = 2
     printer_ip: Optional[str] = None
 
+class LabelBatchRequest(BaseModel):
+    chemical_ids: list[str] = []  # explicit chemicals, or...
+    location: Optional[str] = None  # ...every chemical stored at this location
+    label_type: str = "ghs_primary"
+    label_size: str = "4x6"
+    quantity: int = 1
+    print: bool = False
+    printer_ip: Optional[str] = None
+
+class LabelPdfRequest(BaseModel):
+    chemical_ids: list[str] = []
+    location: Optional[str] = None
+    label_type: str = "ghs_primary"
+    label_size: str = "4x6"  # WxH inches: 4x6, 2x1, 8x1 (pipe markers)
+    layout: str = "auto"  # label (one per page), letter, a4, letter-30; auto picks by size
+    quantity: int = 1  # copies of each label
+    flow_direction: str = "right"  # pipe markers: right, left, both
+
 # ============================================================
 # DEPENDENCIES
 # ============================================================
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+async def run_cpu(fn, *args):
+    """Run a CPU-bound call on the bounded executor so it does not stall other requests."""
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor, fn, *args)
 
 def _legacy_verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Original JWT auth -- used as fallback when SSO is unavailable."""
@@ -138,7 +258,7 @@ async def verify_token(request: Request, credentials: Optional[HTTPAuthorization
     # 1. Try SSO
     if SSO_AVAILABLE:
         try:
-            profile = get_gp3_user(request)
+            profile = await get_gp3_user(request)
             allowed = profile.get("allowed_apps") or []
             if "sds" in allowed or profile.get("role") == "admin":
                 return {
@@ -168,203 +288,806 @@ async def verify_token(request: Request, credentials: Optional[HTTPAuthorization
 
     raise HTTPException(status_code=401, detail="Not authenticated")
 
-def set_tenant_context(db: Session, tenant_id: str):
-    db.execute(text("SET LOCAL app.current_tenant_id = :tid"), {"tid": tenant_id})
+async def set_tenant_context(db: AsyncSession, tenant_id: str):
+    # set_config(..., true) is SET LOCAL; asyncpg sends bind parameters, which SET cannot take
+    await db.execute(text("SELECT set_config('app.current_tenant_id', :tid, true)"), {"tid": str(tenant_id)})
+
+
+def _jsonb(value):
+    """JSONB columns arrive as text from asyncpg (decoded only by psycopg2)."""
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def _date(value) -> Optional[date]:
+    """Model-extracted 'YYYY-MM-DD' strings as dates; asyncpg will not cast text to DATE.
+    Anything unparseable is stored as NULL rather than failing the whole write."""
+    if isinstance(value, date) or value is None:
+        return value
+    try:
+        return date.fromisoformat(str(value).strip()[:10])
+    except ValueError:
+        return None
 
 # ============================================================
 # KERNEL LOADER (3-LAYER)
 # ============================================================
 
-def load_agent_kernel(db: Session, tenant_id: str) -> str:
-    """Load 3-layer kernel: agent + tool references + tenant config."""
+KERNEL_DIR = Path(os.getenv("KERNEL_DIR", "/app/kernels"))
+AGENT_KERNEL_PATH = KERNEL_DIR / "sds_v1.0.ttc.md"
+PRINTER_KERNEL_PATH = KERNEL_DIR / "tools" / "printerdrivers.ttc.md"  # ZPL label layouts (zpl.py)
+DEFAULT_AGENT_KERNEL = "You are an SDS management assistant."
 
-    # Layer 1: Agent kernel
-    agent_kernel_path = Path("/app/kernels/sds_v1.0.ttc.md")
-    if agent_kernel_path.exists():
-        agent_kernel = agent_kernel_path.read_text()
-    else:
-        agent_kernel = "You are an SDS management assistant."
+# Compiled kernels per tenant. Kernel files are re-stat'ed at most every
+# KERNEL_STAT_SECONDS; the tenant row is re-read every KERNEL_TENANT_TTL.
+_kernel_files: dict = {}  # path -> ((mtime_ns, size), content)
+_compiled_kernels: dict = {}  # tenant_id -> compiled entry
+
+
+def _file_stamp(path: Path):
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def read_kernel_file(path: Path) -> Optional[str]:
+    """Read a kernel file, reusing the previous read while mtime and size are unchanged."""
+    stamp = _file_stamp(path)
+    if stamp is None:
+        _kernel_files.pop(path, None)
+        return None
+    cached = _kernel_files.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    content = path.read_text()
+    _kernel_files[path] = (stamp, content)
+    return content
+
+
+def _parse_kernel_block(content: str, heading: str) -> dict:
+    """Parse the `key := value` lines of a fenced block under a tenant kernel heading."""
+    match = re.search(heading + r'.*?```(.*?)```', content, re.DOTALL)
+    if not match:
+        return {}
+    config = {}
+    for line in match.group(1).strip().split("\n"):
+        line = line.strip()
+        if ":=" not in line:
+            continue
+        key, val = line.split(":=", 1)
+        config[key.strip()] = val.strip().strip('"')
+    return config
 
-    # Get tenant info
-    result = db.execute(text(
+
+async def compile_tenant_kernel(db: AsyncSession, tenant_id: str) -> dict:
+    """Build the static parts of a tenant's kernel: everything except {CHEMICAL_LIST}."""
+    result = await db.execute(text(
         "SELECT company_name, tenant_slug FROM tenants WHERE id = :tid"
     ), {"tid": tenant_id})
     tenant = result.fetchone()
     tenant_name = tenant[0] if tenant else "Unknown"
     tenant_slug = tenant[1] if tenant else "unknown"
 
-    # Get chemical registry
-    result = db.execute(text("""
-        SELECT chemical_name, cas_number, storage_class, location, status, critical
-        FROM chemicals WHERE tenant_id = :tid ORDER BY chemical_name
-    """), {"tid": tenant_id})
-    chemicals = result.fetchall()
-
-    chemical_list = "\n".join([
-        f"  {ch[0]}: CAS={ch[1] or 'N/A'} | storage={ch[2]} | loc={ch[3] or 'unassigned'} | status={ch[4]} | critical={ch[5]}"
-        for ch in chemicals
-    ]) or "  No chemicals registered yet."
-
-    # Inject variables
-    kernel = agent_kernel.replace("{TENANT_NAME}", tenant_name)
-    kernel = kernel.replace("{CHEMICAL_LIST}", chemical_list)
-
-    # Layer 2: Resolve tool kernel references (§tools/...)
-    tool_refs = re.findall(r'§tools/(\S+\.ttc\.md)', kernel)
-    for tool_ref in set(tool_refs):
-        tool_path = Path(f"/app/kernels/tools/{tool_ref}")
-        if tool_path.exists():
-            tool_content = tool_path.read_text()
+    # Layer 1: Agent kernel
+    agent_kernel = read_kernel_file(AGENT_KERNEL_PATH) or DEFAULT_AGENT_KERNEL
+    agent_kernel = agent_kernel.replace("{TENANT_NAME}", tenant_name)
+    deps = [AGENT_KERNEL_PATH]
+
+    # Layer 2: Resolve tool kernel references (§tools/...), in a stable order
+    suffix = ""
+    for tool_ref in sorted(set(re.findall(r'§tools/(\S+\.ttc\.md)', agent_kernel))):
+        tool_path = KERNEL_DIR / "tools" / tool_ref
+        deps.append(tool_path)
+        tool_content = read_kernel_file(tool_path)
+        if tool_content is not None:
             # Append tool kernel as reference section
-            kernel += f"\n\n---\n\n<!-- Tool: {tool_ref} -->\n{tool_content}"
+            suffix += f"\n\n---\n\n<!-- Tool: {tool_ref} -->\n{tool_content}"
 
     # Layer 3: Tenant kernel
-    tenant_kernel_path = Path(f"/app/kernels/tenants/{tenant_slug}-sds.ttc.md")
-    if tenant_kernel_path.exists():
-        tenant_kernel = tenant_kernel_path.read_text()
-        tenant_kernel = tenant_kernel.replace("{TENANT_NAME}", tenant_name)
-        kernel += "\n\n---\n\n" + tenant_kernel
+    tenant_kernel_path = KERNEL_DIR / "tenants" / f"{tenant_slug}-sds.ttc.md"
+    deps.append(tenant_kernel_path)
+    tenant_kernel = read_kernel_file(tenant_kernel_path)
+    if tenant_kernel is not None:
+        suffix += "\n\n---\n\n" + tenant_kernel.replace("{TENANT_NAME}", tenant_name)
+
+    parts = agent_kernel.split("{CHEMICAL_LIST}")
+    now = datetime.utcnow().timestamp()
+    return {
+        "hash": hashlib.sha256("\0".join(parts + [suffix]).encode()).hexdigest()[:16],
+        "tenant_found": tenant is not None,
+        "tenant_name": tenant_name,
+        "tenant_slug": tenant_slug,
+        "parts": parts,
+        "suffix": suffix,
+        "branding": _parse_kernel_block(tenant_kernel or "", "### 品牌标识"),
+        "printer": _parse_kernel_block(tenant_kernel or "", "### 打印配置"),
+        "stamps": {path: _file_stamp(path) for path in deps},
+        "loaded_at": now,
+        "checked_at": now,
+    }
 
-    return kernel
 
+async def get_tenant_kernel(db: AsyncSession, tenant_id: str) -> dict:
+    """Return the compiled kernel for a tenant, recompiling when a kernel file changed."""
+    tenant_id = str(tenant_id)
+    entry = _compiled_kernels.get(tenant_id)
+    now = datetime.utcnow().timestamp()
+    if entry and now - entry["loaded_at"] < KERNEL_TENANT_TTL:
+        if now - entry["checked_at"] < KERNEL_STAT_SECONDS:
+            return entry
+        if all(_file_stamp(path) == stamp for path, stamp in entry["stamps"].items()):
+            entry["checked_at"] = now
+            return entry
+    entry = await compile_tenant_kernel(db, tenant_id)
+    _compiled_kernels[tenant_id] = entry
+    return entry
 
-def load_tenant_branding(db: Session, tenant_id: str) -> dict:
-    """Parse branding from tenant kernel."""
-    result = db.execute(text(
-        "SELECT tenant_slug, company_name FROM tenants WHERE id = :tid"
-    ), {"tid": tenant_id})
-    tenant = result.fetchone()
-    if not tenant:
+
+def invalidate_tenant_kernel(tenant_id: str):
+    _compiled_kernels.pop(str(tenant_id), None)
+
+
+async def load_agent_kernel(db: AsyncSession, tenant_id: str, chemical_list: Optional[str] = None) -> str:
+    """Load 3-layer kernel: agent + tool references + tenant config.
+    chemical_list replaces the full registry listing (Q&A passes only retrieved chemicals)."""
+    compiled = await get_tenant_kernel(db, tenant_id)
+    if chemical_list is None:
+        chemical_list = (await get_registry_snapshot(db, tenant_id))["kernel_list"]
+    return chemical_list.join(compiled["parts"]) + compiled["suffix"]
+
+
+async def load_tenant_branding(db: AsyncSession, tenant_id: str) -> dict:
+    """Branding from the tenant kernel's 品牌标识 block."""
+    compiled = await get_tenant_kernel(db, tenant_id)
+    if not compiled["tenant_found"]:
         return {"company_name": "Unknown", "slug": "unknown"}
 
-    slug = tenant[0]
+    name, slug = compiled["tenant_name"], compiled["tenant_slug"]
+    config = compiled["branding"]
     branding = {
-        "company_name": tenant[1], "slug": slug,
+        "company_name": name, "slug": slug,
         "logo_path": None, "primary_color": "#003366",
         "accent_color": "#CC0000", "font": "Helvetica",
-        "address_lines": [], "phone": "", "web": "",
-        "report_footer": f"Confidential — {tenant[1]}",
+        "address_lines": [config[k] for k in ("line1", "line2", "line3") if k in config],
+        "phone": "", "web": "",
+        "report_footer": f"Confidential — {name}",
     }
+    for key in ("primary_color", "accent_color", "font", "report_footer", "phone", "web"):
+        if key in config:
+            branding[key] = config[key]
+    if config.get("logo_file"):
+        p = Path(f"/app/uploads/tenants/{slug}/{config['logo_file']}")
+        if p.exists():
+            branding["logo_path"] = str(p)
 
-    kernel_path = Path(f"/app/kernels/tenants/{slug}-sds.ttc.md")
-    if not kernel_path.exists():
-        return branding
+    return branding
 
-    content = kernel_path.read_text()
-    brand_match = re.search(r'### 品牌标识.*?```(.*?)```', content, re.DOTALL)
-    if not brand_match:
-        return branding
 
-    for line in brand_match.group(1).strip().split("\n"):
-        line = line.strip()
-        if ":=" not in line:
-            continue
-        key, val = line.split(":=", 1)
-        key, val = key.strip(), val.strip().strip('"')
-        if key == "logo_file":
-            p = Path(f"/app/uploads/tenants/{slug}/{val}")
-            if p.exists():
-                branding["logo_path"] = str(p)
-        elif key == "primary_color": branding["primary_color"] = val
-        elif key == "accent_color": branding["accent_color"] = val
-        elif key == "font": branding["font"] = val
-        elif key == "report_footer": branding["report_footer"] = val
-        elif key == "phone": branding["phone"] = val
-        elif key == "web": branding["web"] = val
-        elif key in ("line1", "line2", "line3"):
-            branding["address_lines"].append(val)
+async def get_tenant_printer_config(tenant_id: str, db: AsyncSession) -> dict:
+    """Read printer config from tenant kernel."""
+    compiled = await get_tenant_kernel(db, tenant_id)
+    return dict(compiled["printer"]) if compiled["tenant_found"] else {}
 
-    return branding
 
+_PRINTER_HOST_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9.-]{0,252}")
 
-def get_tenant_printer_config(tenant_id: str, db: Session) -> dict:
-    """Read printer config from tenant kernel."""
-    result = db.execute(text(
-        "SELECT tenant_slug FROM tenants WHERE id = :tid"
+
+def choose_printer(requested: Optional[str], config: dict) -> Optional[str]:
+    """The printer a request talks to: the tenant's configured printer_ip ("host" or
+    "host:port", set in the tenant kernel) or a host named in the request. A requested
+    host is always reached on PRINTER_PORT; only the kernel config can name a port."""
+    configured = config.get("printer_ip")
+    if not requested or requested == configured:
+        return configured
+    if not _PRINTER_HOST_RE.fullmatch(requested):
+        raise HTTPException(status_code=400, detail="printer_ip must be a host name or IP address, without a port")
+    return requested
+
+
+# ============================================================
+# CHEMICAL REGISTRY SNAPSHOT
+# ============================================================
+
+# Column order of snapshot records; the first ten match the evidence PDF rows.
+REGISTRY_COLUMNS = (
+    "chemical_name", "cas_number", "signal_word", "hazard_class", "storage_class",
+    "location", "status", "critical", "has_sds", "sds_revision_date",
+    "latest_revision_date", "sections_complete", "id", "manufacturer",
+)
+
+_registry_snapshots: dict = {}  # tenant_id -> snapshot
+
+
+async def get_registry_version(db: AsyncSession, tenant_id: str) -> int:
+    """Bumped by triggers on chemicals and sds_documents (see tenant_registry_versions)."""
+    result = await db.execute(text(
+        "SELECT version FROM tenant_registry_versions WHERE tenant_id = :tid"
     ), {"tid": tenant_id})
-    tenant = result.fetchone()
-    if not tenant:
-        return {}
+    row = result.fetchone()
+    return row[0] if row else 0
 
-    kernel_path = Path(f"/app/kernels/tenants/{tenant[0]}-sds.ttc.md")
-    if not kernel_path.exists():
-        return {}
 
-    content = kernel_path.read_text()
-    print_match = re.search(r'### 打印配置.*?```(.*?)```', content, re.DOTALL)
-    if not print_match:
-        return {}
+def _kernel_line(c) -> str:
+    return f"  {c[0]}: CAS={c[1] or 'N/A'} | storage={c[4]} | loc={c[5] or 'unassigned'} | status={c[6]} | critical={c[7]}"
 
-    config = {}
-    for line in print_match.group(1).strip().split("\n"):
-        line = line.strip()
-        if ":=" not in line:
-            continue
-        key, val = line.split(":=", 1)
-        key, val = key.strip(), val.strip().strip('"')
-        config[key] = val
 
-    return config
+def _qa_line(c) -> str:
+    return (f"- {c[0]} (CAS: {c[1] or 'N/A'}, Signal: {c[2] or 'None'}, Class: {c[3] or 'N/A'}, "
+            f"Storage: {c[4]}, Location: {c[5] or 'unassigned'}, Status: {c[6]}, Critical: {c[7]}, "
+            f"SDS Rev: {c[10] or 'N/A'}, Sections: {c[11] or 0}/16)")
 
 
-def call_agent(kernel: str, user_message: str, context: str = "") -> dict:
-    """Call Gemini with the composed kernel."""
-    messages_content = f"{context}\n\n{user_message}" if context else user_message
+async def build_registry_snapshot(db: AsyncSession, tenant_id: str, version: int) -> dict:
+    """Load the tenant's registry once and pre-render the prompt text built from it."""
+    result = await db.execute(text("""
+        SELECT c.chemical_name, c.cas_number, c.signal_word, c.hazard_class,
+               c.storage_class, c.location, c.status, c.critical, c.has_sds,
+               c.sds_revision_date, sd.revision_date, sd.sections_complete,
+               c.id, c.manufacturer
+        FROM chemicals c
+        LEFT JOIN sds_documents sd ON sd.id = c.latest_sds_document_id
+        WHERE c.tenant_id = :tid
+        ORDER BY c.chemical_name
+    """), {"tid": tenant_id})
+    records = [tuple(r) for r in result.fetchall()]
 
-    model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash",
-        system_instruction=kernel,
-    )
+    kernel_list = "\n".join(_kernel_line(c) for c in records) or "  No chemicals registered yet."
 
-    response = model.generate_content(
-        messages_content,
-        generation_config=genai.types.GenerationConfig(
-            max_output_tokens=6000,
-            temperature=0.2,
-        ),
-    )
+    evidence_lines = [
+        f"- {r[0]} (CAS: {r[1] or 'N/A'}, Signal: {r[2] or 'None'}, Class: {r[3] or 'N/A'}, "
+        f"Storage: {r[4]}, Location: {r[5] or 'N/A'}, Status: {r[6]}, Critical: {r[7]}, "
+        f"Has SDS: {r[8]}, Rev Date: {r[9] or 'N/A'})"
+        for r in records
+    ]
+
+    return {
+        "version": version,
+        "records": records,
+        "kernel_list": kernel_list,
+        "evidence_lines": evidence_lines,
+    }
+
+
+async def get_registry_snapshot(db: AsyncSession, tenant_id: str) -> dict:
+    """Per-tenant registry snapshot, rebuilt only when the registry version moves.
+    The version is read before the rows, so a concurrent change leaves the
+    snapshot tagged with the older version and it is rebuilt on the next call."""
+    tenant_id = str(tenant_id)
+    version = await get_registry_version(db, tenant_id)
+    snapshot = _registry_snapshots.get(tenant_id)
+    if snapshot is None or snapshot["version"] != version:
+        snapshot = await build_registry_snapshot(db, tenant_id, version)
+        _registry_snapshots[tenant_id] = snapshot
+    return snapshot
+
+
+_qa_indexes: dict = {}  # tenant_id -> {"version", "index", "summary"}
 
-    # Gemini usage metadata
-    usage = response.usage_metadata
-    input_tokens = getattr(usage, 'prompt_token_count', 0) if usage else 0
-    output_tokens = getattr(usage, 'candidates_token_count', 0) if usage else 0
+
+async def build_qa_index(db: AsyncSession, tenant_id: str, snapshot: dict, previous: Optional[dict] = None) -> dict:
+    """BM25 index over the snapshot's chemicals and their latest SDS sections.
+    The section index is carried over from `previous` when no latest document changed."""
+    # Same latest document the labels, evidence and emergency views use
+    result = await db.execute(text("""
+        SELECT latest_sds_document_id FROM chemicals
+        WHERE tenant_id = :tid AND latest_sds_document_id IS NOT NULL
+    """), {"tid": tenant_id})
+    doc_ids = frozenset(str(r[0]) for r in result.fetchall())
+
+    records = snapshot["records"]
+    chemicals = [
+        (str(c[12]), " ".join(str(v) for v in (c[0], c[1], c[13], c[2], c[3], c[4], c[5], c[6]) if v))
+        for c in records
+    ]
+
+    by_status = Counter(c[6] for c in records)
+    by_storage = Counter(c[4] or "unassigned" for c in records)
+    summary = "\n".join([
+        f"Total chemicals: {len(records)}",
+        "By status: " + (", ".join(f"{k}={v}" for k, v in sorted(by_status.items(), key=lambda kv: str(kv[0]))) or "none"),
+        "By storage class: " + (", ".join(f"{k}={v}" for k, v in sorted(by_storage.items())) or "none"),
+        f"Critical: {sum(1 for c in records if c[7])} | Missing SDS: {sum(1 for c in records if not c[8])}",
+    ])
+    attention = [c for c in records if c[6] in ("expired", "expiring_soon", "missing_sds")]
+
+    if previous and previous["doc_ids"] == doc_ids:
+        index = await run_cpu(previous["index"].with_chemicals, chemicals)
+    else:
+        result = await db.execute(text("""
+            SELECT d.chemical_id, s.section_number, s.section_title, s.content
+            FROM sds_sections s JOIN sds_documents d ON s.sds_document_id = d.id
+            WHERE s.sds_document_id = ANY(CAST(:ids AS uuid[]))
+            ORDER BY d.chemical_id, s.section_number
+        """), {"ids": list(doc_ids)})
+        sections = [(str(r[0]), r[1], r[2], flatten_json(_jsonb(r[3]))) for r in result.fetchall()]
+        index = await run_cpu(RegistryIndex, chemicals, sections)
 
     return {
-        "text": response.text,
-        "input_tokens": input_tokens,
-        "output_tokens": output_tokens,
+        "version": snapshot["version"],
+        "doc_ids": doc_ids,
+        "index": index,
+        "by_id": {str(c[12]): c for c in records},
+        "summary": summary,
+        "attention": attention,
     }
 
 
-def log_tokens(db: Session, tenant_id: str, user_id: str, request_type: str, agent_response: dict):
+async def get_qa_index(db: AsyncSession, tenant_id: str) -> dict:
+    tenant_id = str(tenant_id)
+    snapshot = await get_registry_snapshot(db, tenant_id)
+    entry = _qa_indexes.get(tenant_id)
+    if entry is None or entry["version"] != snapshot["version"]:
+        entry = await build_qa_index(db, tenant_id, snapshot, entry)
+        _qa_indexes[tenant_id] = entry
+    return entry
+
+
+async def build_qa_context(db: AsyncSession, tenant_id: str, question: str) -> tuple:
+    """Retrieve the chemicals and SDS excerpts relevant to a question.
+    Returns (context, kernel chemical list) -- both bounded regardless of inventory size."""
+    qa = await get_qa_index(db, tenant_id)
+    hits = qa["index"].search(question, QA_TOP_K)
+    chems = [qa["by_id"][h.key] for h in hits]
+
+    context = "Chemical inventory summary:\n" + qa["summary"]
+    if qa["attention"]:
+        shown = qa["attention"][:QA_ATTENTION_LIMIT]
+        context += "\n\nNeeding attention (expired, expiring or missing SDS):\n" + "\n".join(
+            f"- {c[0]}: {c[6]}" for c in shown)
+        if len(qa["attention"]) > len(shown):
+            context += f"\n- ... and {len(qa['attention']) - len(shown)} more"
+
+    if chems:
+        context += f"\n\nMost relevant chemicals ({len(chems)} of {len(qa['by_id'])}):\n"
+        context += "\n".join(_qa_line(c) for c in chems)
+        excerpts = qa["index"].excerpts(question, [h.key for h in hits], QA_EXCERPTS, QA_EXCERPT_CHARS)
+        if excerpts:
+            context += "\n\nRelevant SDS excerpts:"
+            for key, number, title, excerpt in excerpts:
+                context += f"\n[{qa['by_id'][key][0]} — Section {number}: {title}]\n{excerpt}"
+    else:
+        context += "\n\nNo chemicals in the registry matched this question."
+
+    chemical_list = "\n".join(_kernel_line(c) for c in chems) or "  (see inventory summary in context)"
+    return context, chemical_list
+
+
+# ============================================================
+# EVENT LOG (WRITE-BEHIND)
+# ============================================================
+
+# Append-only tables fed by the event pipeline. Column types are used to unnest a whole
+# batch into one multi-row INSERT; the first column is always tenant_id.
+EVENT_TABLES = {
+    "compliance_events": (("tenant_id", "uuid"), ("chemical_id", "uuid"), ("event_type", "text"),
+                          ("event_data", "jsonb"), ("created_by", "uuid"), ("created_at", "timestamp")),
+    "token_usage": (("tenant_id", "uuid"), ("user_id", "uuid"), ("request_type", "text"), ("input_tokens", "int"),
+                    ("output_tokens", "int"), ("cost", "numeric"), ("timestamp", "timestamp")),
+}
+
+_event_buffer: list = []  # (table, row) waiting to be written
+_event_inflight: list = []  # the batch a flush is writing right now
+_event_flush_lock = asyncio.Lock()
+_event_wakeup: Optional[asyncio.Event] = None
+_event_task: Optional[asyncio.Task] = None
+
+
+def queue_event(table: str, row: tuple) -> bool:
+    """Buffer one row for `table`. The queue is bounded: when the database falls behind by
+    EVENT_QUEUE_MAX rows, new events are dropped (and counted) rather than growing memory."""
+    if len(_event_buffer) >= EVENT_QUEUE_MAX:
+        metrics["events_dropped"] += 1
+        if metrics["events_dropped"] % 1000 == 1:
+            logger.error(f"Event queue full ({EVENT_QUEUE_MAX}); dropped {metrics['events_dropped']} events so far")
+        return False
+    _event_buffer.append((table, row))
+    metrics["events_queued"] += 1
+    if len(_event_buffer) >= EVENT_FLUSH_ROWS and _event_wakeup is not None:
+        _event_wakeup.set()
+    return True
+
+
+def log_event(db: AsyncSession, tenant_id: str, chemical_id: Optional[str], event_type: str, event_data: dict,
+              user_id: Optional[str]):
+    """Stage a compliance event on this session's transaction. commit_with_events queues it once
+    the transaction commits, so rolled-back work never reaches the audit log."""
+    db.info.setdefault("compliance_events", []).append((
+        str(tenant_id), str(chemical_id) if chemical_id else None, event_type, json.dumps(event_data),
+        str(user_id) if user_id else None, datetime.utcnow(),
+    ))
+
+
+async def commit_with_events(db: AsyncSession):
+    await db.commit()
+    for row in db.info.pop("compliance_events", []):
+        queue_event("compliance_events", row)
+
+
+def pending_events(table: str, tenant_id: str) -> list:
+    """Rows for this tenant that are buffered or being written, i.e. not yet visible in Postgres."""
+    return [row for t, row in _event_inflight + _event_buffer if t == table and row[0] == tenant_id]
+
+
+def _event_insert(table: str, rows: list):
+    columns = EVENT_TABLES[table]
+    sql = (f"INSERT INTO {table} ({', '.join(name for name, _ in columns)}) SELECT * FROM unnest("
+           + ", ".join(f"CAST(:c{i} AS {kind}[])" for i, (_, kind) in enumerate(columns)) + ")")
+    return text(sql), {f"c{i}": list(values) for i, values in enumerate(zip(*rows))}
+
+
+async def _write_event_batch(db: AsyncSession, batch: list):
+    """One multi-row INSERT per (tenant, table); RLS context is switched per tenant."""
+    groups = {}
+    for table, row in batch:
+        groups.setdefault((row[0], table), []).append(row)
+    for (tenant_id, table), rows in groups.items():
+        await set_tenant_context(db, tenant_id)
+        await db.execute(*_event_insert(table, rows))
+    await db.commit()
+
+
+async def _write_events_one_by_one(db: AsyncSession, batch: list) -> int:
+    """Fallback when the batch was rejected: write rows in savepoints, dropping the ones
+    Postgres refuses (e.g. an event for a chemical deleted meanwhile). Returns rows dropped."""
+    rejected = 0
+    for table, row in batch:
+        try:
+            async with db.begin_nested():
+                await set_tenant_context(db, row[0])
+                await db.execute(*_event_insert(table, [row]))
+        except (IntegrityError, DataError) as e:
+            rejected += 1
+            logger.error(f"Dropped {table} event rejected by the database: {e.orig}")
+    await db.commit()
+    return rejected
+
+
+async def flush_events():
+    """Write everything buffered in one transaction. On connection/database outages the batch
+    goes back to the front of the queue and is retried on the next flush."""
+    global _event_buffer, _event_inflight
+    async with _event_flush_lock:
+        batch, _event_buffer = _event_buffer, []
+        if not batch:
+            return
+        _event_inflight = batch
+        started = datetime.utcnow().timestamp()
+        rejected = 0
+        try:
+            async with SessionLocal() as db:
+                try:
+                    await _write_event_batch(db, batch)
+                except (IntegrityError, DataError):
+                    await db.rollback()
+                    rejected = await _write_events_one_by_one(db, batch)
+        except Exception:
+            metrics["event_flush_failures"] += 1
+            logger.exception(f"Failed to write {len(batch)} events; retrying on next flush")
+            _event_buffer = batch + _event_buffer
+            return
+        except BaseException:
+            # Cancelled mid-write (shutdown): keep the batch for the final drain
+            _event_buffer = batch + _event_buffer
+            raise
+        finally:
+            _event_inflight = []
+        metrics["event_flushes"] += 1
+        metrics["events_written"] += len(batch) - rejected
+        metrics["events_rejected"] += rejected
+        metrics["event_flush_ms"] = round((datetime.utcnow().timestamp() - started) * 1000)
+
+
+async def run_event_writer():
+    while True:
+        try:
+            await asyncio.wait_for(_event_wakeup.wait(), timeout=EVENT_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _event_wakeup.clear()
+        await flush_events()
+
+
+@app.on_event("startup")
+async def start_event_writer():
+    global _event_wakeup, _event_task
+    _event_wakeup = asyncio.Event()
+    _event_task = asyncio.create_task(run_event_writer())
+
+
+async def stop_event_writer():
+    """Called from close_pools, before the engine goes away: drain the queue (a few attempts
+    if Postgres is briefly unavailable) so a clean shutdown loses nothing."""
+    if _event_task is not None:
+        _event_task.cancel()
+        try:
+            await _event_task
+        except asyncio.CancelledError:
+            pass
+    for attempt in range(3):
+        await flush_events()
+        if not _event_buffer:
+            return
+        await asyncio.sleep(1)
+    logger.error(f"Shutting down with {len(_event_buffer)} unwritten events")
+
+
+def event_stats() -> dict:
+    return {
+        "queue_depth": len(_event_buffer) + len(_event_inflight),
+        "queue_max": EVENT_QUEUE_MAX,
+        "queued": metrics["events_queued"],
+        "written": metrics["events_written"],
+        "dropped": metrics["events_dropped"],
+        "rejected": metrics["events_rejected"],
+        "flushes": metrics["event_flushes"],
+        "flush_failures": metrics["event_flush_failures"],
+        "last_flush_ms": metrics["event_flush_ms"],
+    }
+
+# ============================================================
+# TOKEN LIMITS
+# ============================================================
+
+class TokenLimitExceeded(Exception):
+    """A tenant is over its token rate or its monthly budget (HTTP 429)."""
+
+    def __init__(self, message: str, retry_after: float, reason: str = "rate"):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason  # "rate" or "budget"
+
+
+@app.exception_handler(TokenLimitExceeded)
+async def token_limit_exceeded(request: Request, exc: TokenLimitExceeded):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
+
+# tenant_id -> {"tokens", "at"}: refilled at TENANT_TOKENS_PER_MINUTE, capped at TENANT_TOKEN_BURST
+_token_buckets: dict = {}
+# tenant_id -> {"budget", "used", "reserved", "loaded", "month_ends"}; "used" is this month's
+# usage from token_usage plus rows still queued, re-read every TOKEN_BUDGET_REFRESH_SECONDS
+_token_budgets: dict = {}
+_token_budget_locks: dict = {}
+
+
+def estimate_tokens(*texts: str, max_output_tokens: int = 0) -> int:
+    """Rough pre-call estimate: ~4 characters per input token plus the full output allowance."""
+    return sum(len(t) for t in texts) // 4 + max_output_tokens
+
+
+async def tenant_token_budget(tenant_id: str) -> dict:
+    """This tenant's monthly budget state, loaded from Postgres and refreshed periodically so
+    usage recorded by other processes (and budget changes) are picked up."""
+    now = datetime.utcnow().timestamp()
+    state = _token_budgets.get(tenant_id)
+    if state and now - state["loaded"] < TOKEN_BUDGET_REFRESH_SECONDS and now < state["month_ends"]:
+        return state
+
+    async with _token_budget_locks.setdefault(tenant_id, asyncio.Lock()):
+        state = _token_budgets.get(tenant_id)
+        if state and now - state["loaded"] < TOKEN_BUDGET_REFRESH_SECONDS and now < state["month_ends"]:
+            return state
+        async with SessionLocal() as db:
+            await set_tenant_context(db, tenant_id)
+            row = (await db.execute(text("""
+                SELECT t.token_budget_monthly,
+                       (SELECT COALESCE(SUM(input_tokens + output_tokens), 0) FROM token_usage
+                        WHERE tenant_id = t.id AND timestamp >= DATE_TRUNC('month', CURRENT_DATE)),
+                       EXTRACT(EPOCH FROM DATE_TRUNC('month', CURRENT_DATE) + INTERVAL '1 month' - NOW())
+                FROM tenants t WHERE t.id = :tid
+            """), {"tid": tenant_id})).fetchone()
+        now = datetime.utcnow().timestamp()
+        state = _token_budgets.setdefault(tenant_id, {"reserved": 0})
+        state.update({
+            "budget": row[0] if row else 0,  # NULL budget = no monthly cap
+            "used": (int(row[1]) if row else 0) + sum(r[3] + r[4] for r in pending_events("token_usage", tenant_id)),
+            "loaded": now,
+            "month_ends": now + (float(row[2]) if row else 86400),
+        })
+        return state
+
+
+async def tokens_remaining(tenant_id: str) -> Optional[int]:
+    """Monthly budget minus recorded and in-flight usage; None when the tenant has no cap."""
+    state = await tenant_token_budget(tenant_id)
+    if state["budget"] is None:
+        return None
+    return state["budget"] - state["used"] - state["reserved"]
+
+
+async def check_token_budget(tenant_id: str, tokens: int):
+    """Reject work up front when the month's budget cannot cover `tokens`."""
+    remaining = await tokens_remaining(tenant_id)
+    if remaining is not None and remaining < tokens:
+        metrics["tokens_rejected_budget"] += 1
+        state = _token_budgets[tenant_id]
+        raise TokenLimitExceeded("Monthly token budget exhausted", state["month_ends"] - datetime.utcnow().timestamp(),
+                                 "budget")
+
+
+async def _take_from_bucket(tenant_id: str, tokens: int, lane: str) -> int:
+    """Wait until the tenant's bucket holds `tokens` and take them. Extraction may not dip into
+    the last TOKEN_INTERACTIVE_RESERVE of the bucket, so a tenant's own bulk import never
+    blocks its Q&A. Returns the amount taken."""
+    if TENANT_TOKENS_PER_MINUTE <= 0:
+        return 0
+    rate = TENANT_TOKENS_PER_MINUTE / 60
+    floor = 0 if lane == "interactive" else TENANT_TOKEN_BURST * TOKEN_INTERACTIVE_RESERVE
+    cost = min(tokens, TENANT_TOKEN_BURST - floor)  # a call bigger than the bucket waits for a full one
+    now = datetime.utcnow().timestamp()
+    bucket = _token_buckets.setdefault(tenant_id, {"tokens": float(TENANT_TOKEN_BURST), "at": now})
+    deadline = now + (TOKEN_QUEUE_SECONDS if lane == "interactive" else TOKEN_EXTRACTION_QUEUE_SECONDS)
+    queued = False
+    while True:
+        now = datetime.utcnow().timestamp()
+        bucket["tokens"] = min(TENANT_TOKEN_BURST, bucket["tokens"] + (now - bucket["at"]) * rate)
+        bucket["at"] = now
+        if bucket["tokens"] - cost >= floor:
+            bucket["tokens"] -= cost
+            return cost
+        wait = (floor + cost - bucket["tokens"]) / rate
+        if now + wait > deadline:
+            metrics["tokens_rejected_rate"] += 1
+            raise TokenLimitExceeded("Token rate limit exceeded, try again shortly", wait)
+        if not queued:
+            metrics["tokens_queued"] += 1
+            queued = True
+        await asyncio.sleep(wait)
+
+
+async def reserve_tokens(tenant_id: Optional[str], estimate: int, lane: str) -> Optional[dict]:
+    """Admit a model call of about `estimate` tokens: check the monthly budget, then wait for
+    the rate bucket. The reservation is reconciled against actual usage by release_tokens."""
+    if not tenant_id:
+        return None
+    await check_token_budget(tenant_id, estimate)
+    state = _token_budgets[tenant_id]
+    state["reserved"] += estimate
+    try:
+        cost = await _take_from_bucket(tenant_id, estimate, lane)
+    except BaseException:
+        state["reserved"] -= estimate
+        raise
+    return {"tenant_id": tenant_id, "estimate": estimate, "cost": cost}
+
+
+def release_tokens(reservation: Optional[dict], usage: Optional[dict]):
+    """Settle a reservation: refund the bucket what the call did not use (all of it when the
+    call failed). The month's usage is counted when the caller records it (record_tokens)."""
+    if reservation is None:
+        return
+    actual = usage["input_tokens"] + usage["output_tokens"] if usage else 0
+    _token_budgets[reservation["tenant_id"]]["reserved"] -= reservation["estimate"]
+    bucket = _token_buckets.get(reservation["tenant_id"])
+    if bucket is not None and reservation["cost"]:
+        bucket["tokens"] = min(TENANT_TOKEN_BURST, bucket["tokens"] + reservation["cost"] - actual)
+
+
+def record_tokens(tenant_id: str, user_id: Optional[str], request_type: str, agent_response: dict):
+    """Count usage against the tenant's month and queue its token_usage row."""
     # Gemini 2.0 Flash pricing: $0.10/1M input, $0.40/1M output
     cost = (agent_response["input_tokens"] * 0.0001 / 1000) + (agent_response["output_tokens"] * 0.0004 / 1000)
-    db.execute(text("""
-        INSERT INTO token_usage (tenant_id, user_id, request_type, input_tokens, output_tokens, cost)
-        VALUES (:tid, :uid, :rtype, :inp, :out, :cost)
-    """), {
-        "tid": tenant_id, "uid": user_id, "rtype": request_type,
-        "inp": agent_response["input_tokens"], "out": agent_response["output_tokens"], "cost": cost,
-    })
+    queue_event("token_usage", (str(tenant_id), str(user_id) if user_id else None, request_type, agent_response["input_tokens"],
+                                agent_response["output_tokens"], cost, datetime.utcnow()))
+    state = _token_budgets.get(str(tenant_id))
+    if state is not None:
+        state["used"] += agent_response["input_tokens"] + agent_response["output_tokens"]
+
+
+def token_limit_stats() -> dict:
+    return {
+        "queued": metrics["tokens_queued"],
+        "rejected_rate": metrics["tokens_rejected_rate"],
+        "rejected_budget": metrics["tokens_rejected_budget"],
+        "tenants": len(_token_budgets),
+    }
+
+# ============================================================
+# AGENT CALLS
+# ============================================================
+
+async def call_agent(kernel: str, user_message: str, context: str = "", max_output_tokens: int = 6000,
+                     tenant_id: Optional[str] = None, lane: str = "interactive") -> dict:
+    """Call the configured model provider (llm.py) with the composed kernel.
+    Raises TokenLimitExceeded (HTTP 429) when the tenant is over its token limits, and
+    LLMUnavailable (HTTP 503) when the provider is down or overloaded."""
+    messages_content = f"{context}\n\n{user_message}" if context else user_message
+    reservation = await reserve_tokens(tenant_id, estimate_tokens(kernel, messages_content,
+                                                                  max_output_tokens=max_output_tokens), lane)
+    response = None
+    try:
+        response = await get_llm().generate(kernel, messages_content, tenant_id=tenant_id, lane=lane,
+                                            max_output_tokens=max_output_tokens, temperature=0.2)
+        return response
+    finally:
+        release_tokens(reservation, response)
+
+
+async def stream_agent(kernel: str, user_message: str, context: str = "", usage: Optional[dict] = None,
+                       tenant_id: Optional[str] = None):
+    """Like call_agent, but yields text as the model produces it.
+    On completion `usage` is filled with the same keys call_agent returns. When the stream
+    stops part way (client gone, provider error) it is filled with an estimate of what the
+    model already produced instead, marked "partial"."""
+    messages_content = f"{context}\n\n{user_message}" if context else user_message
+    usage = usage if usage is not None else {}
+    reservation = await reserve_tokens(tenant_id, estimate_tokens(kernel, messages_content, max_output_tokens=6000),
+                                       "interactive")
+    streamed = []
+    try:
+        async for piece in get_llm().stream(kernel, messages_content, usage,
+                                            tenant_id=tenant_id, max_output_tokens=6000, temperature=0.2):
+            streamed.append(piece)
+            yield piece
+    finally:
+        if not usage and streamed:
+            # The provider only reports usage at the end: charge ~4 characters per token
+            partial = "".join(streamed)
+            usage.update(text=partial, input_tokens=estimate_tokens(kernel, messages_content),
+                         output_tokens=len(partial) // 4, partial=True)
+        release_tokens(reservation, usage or None)
+
+
+def sse_event(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+async def stream_agent_sse(kernel: str, user_message: str, context: str, on_complete,
+                           tenant_id: Optional[str] = None, on_partial=None):
+    """SSE body for a streamed agent call: {"delta": ...} events, then {"done": true}.
+    on_complete(agent_response) runs once the model finishes (records token usage);
+    on_partial(agent_response) gets the estimated usage of a stream cut short, including by
+    the client disconnecting. Token limit and provider errors arrive as an
+    {"error", "retry_after"} event."""
+    usage = {}
+    try:
+        async with aclosing(stream_agent(kernel, user_message, context, usage, tenant_id=tenant_id)) as chunks:
+            async for text_chunk in chunks:
+                yield sse_event({"delta": text_chunk})
+    except TokenLimitExceeded as e:
+        yield sse_event({"error": str(e), "retry_after": max(1, round(e.retry_after)), "done": True})
+        return
+    except LLMUnavailable as e:
+        logger.warning(f"Streaming agent call failed: {e}")
+        yield sse_event({"error": "Model temporarily unavailable, try again shortly",
+                         "retry_after": round(e.retry_after), "done": True})
+        return
+    except Exception as e:
+        logger.error(f"Streaming agent call failed: {e}")
+        yield sse_event({"error": "Model call failed", "done": True})
+        return
+    finally:
+        if usage.get("partial") and on_partial is not None:
+            on_partial(usage)
+    await on_complete(usage)
+    yield sse_event({"done": True})
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
 # ============================================================
 # AUTH ENDPOINTS
 # ============================================================
 
 @app.post("/auth/login")
-async def login(req: LoginRequest, db: Session = Depends(get_db)):
-    result = db.execute(text("""
+async def login(req: LoginRequest, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(text("""
         SELECT u.id, u.password_hash, u.tenant_id, u.role, t.company_name
         FROM users u JOIN tenants t ON u.tenant_id = t.id
         WHERE u.email = :email
     """), {"email": req.email})
     user = result.fetchone()
 
-    if not user or not pwd_context.verify(req.password, user[1]):
+    if not user or not await run_cpu(pwd_context.verify, req.password, user[1]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    db.execute(text("UPDATE users SET last_login = NOW() WHERE id = :uid"), {"uid": user[0]})
-    db.commit()
+    await db.execute(text("UPDATE users SET last_login = NOW() WHERE id = :uid"), {"uid": user[0]})
+    await db.commit()
 
     token = jwt.encode({
         "user_id": str(user[0]), "tenant_id": str(user[2]),
@@ -375,24 +1098,24 @@ async def login(req: LoginRequest, db: Session = Depends(get_db)):
 
 
 @app.post("/auth/register")
-async def register(req: RegisterRequest, db: Session = Depends(get_db)):
-    result = db.execute(text(
+async def register(req: RegisterRequest, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(text(
         "SELECT id FROM tenants WHERE tenant_slug = :slug AND subscription_status = 'active'"
     ), {"slug": req.tenant_code})
     tenant = result.fetchone()
     if not tenant:
         raise HTTPException(status_code=404, detail="Invalid registration code")
 
-    result = db.execute(text("SELECT id FROM users WHERE email = :email"), {"email": req.email})
+    result = await db.execute(text("SELECT id FROM users WHERE email = :email"), {"email": req.email})
     if result.fetchone():
         raise HTTPException(status_code=409, detail="Email already registered")
 
-    password_hash = pwd_context.hash(req.password)
-    db.execute(text("""
+    password_hash = await run_cpu(pwd_context.hash, req.password)
+    await db.execute(text("""
         INSERT INTO users (tenant_id, email, password_hash, name, role)
         VALUES (:tid, :email, :hash, :name, 'admin')
     """), {"tid": tenant[0], "email": req.email, "hash": password_hash, "name": req.name})
-    db.commit()
+    await db.commit()
 
     return {"status": "success", "message": "User created. Please login."}
 
@@ -400,159 +1123,1178 @@ async def register(req: RegisterRequest, db: Session = Depends(get_db)):
 # SDS UPLOAD & PARSING
 # ============================================================
 
-@app.post("/sds/upload")
+SDS_ALLOWED_SUFFIXES = {".pdf", ".jpg", ".jpeg", ".png"}
+
+
+def _too_large(name: str, max_bytes: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"{name} exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+
+
+def _too_many_files() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Bulk import is limited to {SDS_BULK_MAX_FILES} files")
+
+
+async def save_upload(file: UploadFile, dest: Path, max_bytes: int = SDS_UPLOAD_MAX_BYTES) -> tuple:
+    """Stream an UploadFile to disk in chunks; returns (bytes written, sha256 hex).
+    Memory stays at one chunk whatever the file size. Past max_bytes, or if the
+    client goes away mid-upload, the partial file is removed."""
+    size, digest = 0, hashlib.sha256()
+    try:
+        with open(dest, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large(file.filename or "Upload", max_bytes)
+                await asyncio.to_thread(out.write, chunk)
+                digest.update(chunk)
+    except BaseException:
+        dest.unlink(missing_ok=True)
+        raise
+    return size, digest.hexdigest()
+
+
+def blob_temp_path(suffix: str = "") -> Path:
+    SDS_BLOB_DIR.mkdir(parents=True, exist_ok=True)
+    return SDS_BLOB_DIR / f".upload-{uuid.uuid4()}{suffix}"
+
+
+def store_sds_blob(tmp: Path, content_hash: str, created: Optional[list] = None) -> Path:
+    """Move a freshly written upload into the content-addressed store.
+    Identical bytes (from any tenant) are kept once on disk. Blobs this call
+    added (rather than found) are appended to `created`."""
+    blob = SDS_BLOB_DIR / content_hash[:2] / content_hash
+    if blob.exists():
+        tmp.unlink(missing_ok=True)
+    else:
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp, blob)
+        if created is not None:
+            created.append(blob)
+    return blob
+
+
+async def discard_sds_blobs(db: AsyncSession, blobs: list):
+    """Remove blobs a failed upload added to the store, unless a job already points at
+    them (another upload of the same bytes may have queued in the meantime)."""
+    if not blobs:
+        return
+    result = await db.execute(text(
+        "SELECT DISTINCT file_path FROM sds_jobs WHERE file_path = ANY(:paths)"
+    ), {"paths": [str(b) for b in blobs]})
+    referenced = {r[0] for r in result.fetchall()}
+    for blob in blobs:
+        if str(blob) not in referenced:
+            await asyncio.to_thread(blob.unlink, True)
+
+
+@app.post("/sds/upload", status_code=202)
 async def upload_sds(
     file: UploadFile = File(...),
     auth: dict = Depends(verify_token),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    set_tenant_context(db, auth["tenant_id"])
-
-    # Save file
-    upload_dir = Path(f"/app/uploads/{auth['tenant_id']}")
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    file_id = str(uuid.uuid4())
-    file_path = upload_dir / f"{file_id}_{file.filename}"
-    content = await file.read()
-    file_path.write_bytes(content)
-
-    # AI extraction
-    kernel = load_agent_kernel(db, auth["tenant_id"])
-    prompt = f"""Extract ALL 16 sections from this Safety Data Sheet.
-Filename: {file.filename}
-File size: {len(content)} bytes
+    if Path(file.filename or "").suffix.lower() not in SDS_ALLOWED_SUFFIXES:
+        raise HTTPException(status_code=400, detail=f"{file.filename} is not an SDS file (.pdf, .jpg, .png)")
+    await set_tenant_context(db, auth["tenant_id"])
+    await check_token_budget(auth["tenant_id"], SDS_BULK_EST_TOKENS)
+
+    # Save file (hashed while streaming, stored once per distinct content)
+    tmp = blob_temp_path()
+    size, content_hash = await save_upload(file, tmp)
+    created = []
+    file_path = await asyncio.to_thread(store_sds_blob, tmp, content_hash, created)
+
+    # Queue extraction -- the worker pool does the AI call and DB writes
+    try:
+        result = await db.execute(text("""
+            INSERT INTO sds_jobs (tenant_id, created_by, file_path, file_name, file_size, content_hash)
+            VALUES (:tid, :uid, :path, :fname, :size, :hash)
+            RETURNING id
+        """), {
+            "tid": auth["tenant_id"], "uid": auth["user_id"],
+            "path": str(file_path), "fname": file.filename, "size": size, "hash": content_hash,
+        })
+        job_id = result.fetchone()[0]
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        await discard_sds_blobs(db, created)
+        raise
+    wake_sds_workers()
 
-Return ONLY a valid JSON object with this structure:
-{{
+    return {
+        "status": "queued",
+        "job_id": str(job_id),
+        "message": f"{file.filename} queued for extraction.",
+    }
+
+
+@app.get("/sds/jobs/{job_id}")
+async def get_sds_job(
+    job_id: str,
+    auth: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_db),
+):
+    result = await db.execute(text("""
+        SELECT id, status, file_name, attempts, result, error,
+               created_at, started_at, finished_at
+        FROM sds_jobs WHERE id = :jid AND tenant_id = :tid
+    """), {"jid": job_id, "tid": auth["tenant_id"]})
+    job = result.fetchone()
+
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return {
+        "job_id": str(job[0]),
+        "status": job[1],
+        "file_name": job[2],
+        "attempts": job[3],
+        "result": _jsonb(job[4]),
+        "error": job[5],
+        "created_at": job[6].isoformat(),
+        "started_at": job[7].isoformat() if job[7] else None,
+        "finished_at": job[8].isoformat() if job[8] else None,
+    }
+
+
+# Shape of the extraction JSON: top-level keys, then one line per GHS section
+EXTRACTION_FIELDS = {
     "product_name": "string",
     "cas_number": "XXXXX-XX-X or null",
     "manufacturer": "string",
     "signal_word": "Danger or Warning or null",
     "revision_date": "YYYY-MM-DD or null",
-    "pictogram_codes": ["GHS01", "GHS02", ...],
-    "hazard_statements": ["H226 - Flammable liquid and vapour", ...],
-    "precautionary_statements": ["P210 - Keep away from heat", ...],
+    "pictogram_codes": ["GHS01", "GHS02", "..."],
+    "hazard_statements": ["H226 - Flammable liquid and vapour", "..."],
+    "precautionary_statements": ["P210 - Keep away from heat", "..."],
     "hazard_class": "primary class string",
-    "sections": {{
-        "1": {{"title": "Product Identification", "product_name": "...", "cas_number": "...", "manufacturer": "...", "emergency_phone": "..."}},
-        "2": {{"title": "Hazard Identification", "classification": "...", "signal_word": "...", "pictograms": [...], "hazard_statements": [...], "precautionary_statements": [...]}},
-        "3": {{"title": "Composition", "components": [...]}},
-        "4": {{"title": "First Aid", "inhalation": "...", "skin": "...", "eyes": "...", "ingestion": "..."}},
-        "5": {{"title": "Fire Fighting", "extinguishing_media": "...", "specific_hazards": "...", "firefighter_protection": "..."}},
-        "6": {{"title": "Accidental Release", "personal_precautions": "...", "cleanup": "..."}},
-        "7": {{"title": "Handling and Storage", "safe_handling": "...", "storage_conditions": "...", "incompatibles": "..."}},
-        "8": {{"title": "Exposure Controls/PPE", "oel_values": "...", "engineering_controls": "...", "ppe": {{"eyes": "...", "skin": "...", "respiratory": "...", "hands": "..."}}}},
-        "9": {{"title": "Physical/Chemical Properties", "appearance": "...", "odor": "...", "flash_point": "...", "boiling_point": "...", "ph": "..."}},
-        "10": {{"title": "Stability and Reactivity", "stability": "...", "incompatible_materials": "...", "hazardous_decomposition": "..."}},
-        "11": {{"title": "Toxicological Info", "routes_of_exposure": "...", "acute_toxicity": "...", "ld50": "..."}},
-        "12": {{"title": "Ecological Info", "ecotoxicity": "...", "persistence": "..."}},
-        "13": {{"title": "Disposal", "waste_treatment": "..."}},
-        "14": {{"title": "Transport", "un_number": "...", "proper_shipping_name": "...", "hazard_class": "...", "packing_group": "..."}},
-        "15": {{"title": "Regulatory", "sara_313": "...", "cercla": "..."}},
-        "16": {{"title": "Other Information", "revision_date": "...", "prepared_by": "..."}}
-    }}
-}}"""
-
-    agent_response = call_agent(kernel, prompt)
-    log_tokens(db, auth["tenant_id"], auth["user_id"], "sds_upload", agent_response)
-
-    # Parse response
+}
+EXTRACTION_SECTIONS = {
+    "1": {"title": "Product Identification", "product_name": "...", "cas_number": "...", "manufacturer": "...", "emergency_phone": "..."},
+    "2": {"title": "Hazard Identification", "classification": "...", "signal_word": "...", "pictograms": ["..."], "hazard_statements": ["..."], "precautionary_statements": ["..."]},
+    "3": {"title": "Composition", "components": ["..."]},
+    "4": {"title": "First Aid", "inhalation": "...", "skin": "...", "eyes": "...", "ingestion": "..."},
+    "5": {"title": "Fire Fighting", "extinguishing_media": "...", "specific_hazards": "...", "firefighter_protection": "..."},
+    "6": {"title": "Accidental Release", "personal_precautions": "...", "cleanup": "..."},
+    "7": {"title": "Handling and Storage", "safe_handling": "...", "storage_conditions": "...", "incompatibles": "..."},
+    "8": {"title": "Exposure Controls/PPE", "oel_values": "...", "engineering_controls": "...", "ppe": {"eyes": "...", "skin": "...", "respiratory": "...", "hands": "..."}},
+    "9": {"title": "Physical/Chemical Properties", "appearance": "...", "odor": "...", "flash_point": "...", "boiling_point": "...", "ph": "..."},
+    "10": {"title": "Stability and Reactivity", "stability": "...", "incompatible_materials": "...", "hazardous_decomposition": "..."},
+    "11": {"title": "Toxicological Info", "routes_of_exposure": "...", "acute_toxicity": "...", "ld50": "..."},
+    "12": {"title": "Ecological Info", "ecotoxicity": "...", "persistence": "..."},
+    "13": {"title": "Disposal", "waste_treatment": "..."},
+    "14": {"title": "Transport", "un_number": "...", "proper_shipping_name": "...", "hazard_class": "...", "packing_group": "..."},
+    "15": {"title": "Regulatory", "sara_313": "...", "cercla": "..."},
+    "16": {"title": "Other Information", "revision_date": "...", "prepared_by": "..."},
+}
+# Section keys that mirror a top-level key; filled from the local parse instead of the model
+SECTION_FIELD_SOURCES = {
+    "1": {"product_name": "product_name", "cas_number": "cas_number", "manufacturer": "manufacturer"},
+    "2": {"signal_word": "signal_word", "pictograms": "pictogram_codes",
+          "hazard_statements": "hazard_statements", "precautionary_statements": "precautionary_statements"},
+    "16": {"revision_date": "revision_date"},
+}
+
+
+def extraction_schema(fields, sections) -> str:
+    """JSON skeleton for an extraction prompt covering the given top-level keys and
+    sections. Section keys that mirror a top-level key are left out (filled on merge)."""
+    lines = [f"    {json.dumps(k)}: {json.dumps(EXTRACTION_FIELDS[k])}," for k in fields]
+    section_lines = [
+        f"        {json.dumps(num)}: {json.dumps(section_shape(num))}" for num in sections
+    ]
+    lines.append('    "sections": {\n' + ",\n".join(section_lines) + "\n    }")
+    return "{\n" + "\n".join(lines) + "\n}"
+
+
+def section_shape(num: str) -> dict:
+    mirrored = SECTION_FIELD_SOURCES.get(num, {})
+    return {k: v for k, v in EXTRACTION_SECTIONS[num].items() if k not in mirrored}
+
+
+def _extraction_scope(fields, sections) -> str:
+    if len(sections) == len(EXTRACTION_SECTIONS):
+        return "ALL 16 sections"
+    parts = [f"section{'s' if len(sections) > 1 else ''} {', '.join(sections)}"] if sections else []
+    if fields:
+        parts.insert(0, "the product summary fields")
+    return " and ".join(parts)
+
+
+def build_extraction_prompt(file_name: str, file_size: int,
+                            fields=tuple(EXTRACTION_FIELDS), sections=tuple(EXTRACTION_SECTIONS)) -> str:
+    """Prompt for files with no text layer (scanned/image SDSs)."""
+    return f"""Extract {_extraction_scope(fields, sections)} from this Safety Data Sheet.
+Filename: {file_name}
+File size: {file_size} bytes
+
+Return ONLY a valid JSON object with this structure:
+{extraction_schema(fields, sections)}"""
+
+
+def section_limits() -> dict:
+    return dict.fromkeys(SDS_BRIEF_SECTIONS, SDS_BRIEF_SECTION_CHARS)
+
+
+def build_section_prompt(file_name: str, parsed: ParsedSDS, context, fields, sections) -> str:
+    """Prompt carrying the document's own text: the `context` sections, or the whole
+    (capped) text when no section headers were found. Fields the parser already
+    read are listed as known and never requested."""
+    if parsed.sections:
+        found = {n: parsed.sections[n] for n in context if n in parsed.sections}
+        body = "\n\n".join(
+            f"=== SECTION {num}: {title} ===\n{excerpt}"
+            for num, title, excerpt in section_excerpts(found, SDS_SECTION_CHARS, section_limits())
+        )
+        source = "the GHS section text below (the document's own text, split by section)"
+    else:
+        body = section_excerpts({"0": ("", parsed.text)}, SDS_SECTION_CHARS * 16)[0][2]
+        source = "the document text below (no section headers were recognised)"
+    known = sorted(parsed.fields)
+    already = f"\nAlready read from the document, do not return: {', '.join(known)}" if known and fields else ""
+    return f"""Extract {_extraction_scope(fields, sections)} of this Safety Data Sheet from {source}.
+Filename: {file_name}{already}
+Use only the text given; use null for anything it does not state.
+
+Return ONLY a valid JSON object with this structure:
+{extraction_schema(fields, sections)}
+
+{body}"""
+
+
+def parse_agent_json(text_resp: str) -> Optional[dict]:
+    """Parse a JSON object from model output, tolerating surrounding prose."""
     try:
-        data = json.loads(agent_response["text"])
+        return json.loads(text_resp)
     except json.JSONDecodeError:
-        text_resp = agent_response["text"]
         start = text_resp.find("{")
         end = text_resp.rfind("}") + 1
         if start >= 0 and end > start:
-            data = json.loads(text_resp[start:end])
+            try:
+                return json.loads(text_resp[start:end])
+            except json.JSONDecodeError:
+                return None
+        return None
+
+
+def _matches_shape(value, shape) -> bool:
+    if value is None:
+        return True
+    if isinstance(shape, dict):
+        return isinstance(value, dict) and all(_matches_shape(value.get(k), s) for k, s in shape.items())
+    if isinstance(shape, list):
+        return isinstance(value, list) and all(isinstance(v, (str, dict)) for v in value)
+    return isinstance(value, (str, int, float))
+
+
+def validate_section(num: str, value) -> Optional[dict]:
+    """The section object if it has every requested key with the right type (null is
+    allowed: the SDS may not state it), restricted to schema keys. None otherwise."""
+    shape = section_shape(num)
+    if not isinstance(value, dict):
+        return None
+    keys = [k for k in shape if k != "title"]
+    if any(k not in value or not _matches_shape(value[k], shape[k]) for k in keys):
+        return None
+    title = value.get("title")
+    return {"title": title if isinstance(title, str) and title else shape["title"], **{k: value[k] for k in keys}}
+
+
+def validate_fields(out: dict, fields) -> tuple:
+    """Check requested top-level keys. Returns (valid values, failed keys); values that
+    are well-typed but unusable (a CAS number that fails its checksum) become null."""
+    valid, failed = {}, []
+    for key in fields:
+        value = out.get(key, ...)
+        if value is None:
+            valid[key] = None
+        elif value is ... or not _matches_shape(value, EXTRACTION_FIELDS[key]):
+            failed.append(key)
+        elif key == "cas_number":
+            valid[key] = value.strip() if isinstance(value, str) and valid_cas(value.strip()) else None
+        elif key == "signal_word":
+            valid[key] = str(value).capitalize() if str(value).lower() in ("danger", "warning") else None
+        elif key == "revision_date":
+            valid[key] = parse_date(str(value))
+        elif key == "pictogram_codes":
+            valid[key] = [p for p in value if isinstance(p, str) and re.fullmatch(r"GHS0[1-9]", p)]
+        elif isinstance(EXTRACTION_FIELDS[key], list):
+            valid[key] = [v for v in value if isinstance(v, str)]
+        else:
+            valid[key] = str(value)
+    return valid, failed
+
+
+def merge_parsed_sds(fields: dict, sections: dict, parsed: ParsedSDS) -> dict:
+    """Build extracted_data from validated model output and the local parse. Parsed
+    fields win; sections that never validated keep their raw text but do not count
+    towards sections_validated."""
+    data = {**fields, **parsed.fields}
+    merged = dict(sections)
+    for num, title, excerpt in section_excerpts(parsed.sections, SDS_SECTION_CHARS, section_limits()):
+        merged.setdefault(num, {"title": title, "text": excerpt})
+    for num, mirrored in SECTION_FIELD_SOURCES.items():
+        if num in merged:
+            merged[num].update({k: data[top] for k, top in mirrored.items() if data.get(top) is not None})
+    data["sections"] = {num: merged[num] for num in sorted(merged, key=int)}
+    data["sections_validated"] = sorted(sections, key=int)
+    data["parsed_locally"] = sorted(parsed.fields)
+    return data
+
+
+def extraction_tasks(parsed: ParsedSDS) -> list:
+    """One model call per section group; the first also asks for the summary fields
+    the parser could not read. Text-layer files only ask for sections that were found."""
+    missing = [k for k in EXTRACTION_FIELDS if k not in parsed.fields]
+    if parsed.text_layer and not parsed.sections:
+        return [{"context": (), "fields": missing, "sections": list(EXTRACTION_SECTIONS)}]
+    tasks = []
+    for i, group in enumerate(SDS_SECTION_GROUPS):
+        sections = [n for n in group if not parsed.text_layer or n in parsed.sections]
+        fields = missing if i == 0 else []
+        context = group + ("16",) if "revision_date" in fields else group
+        if sections or fields:
+            tasks.append({"context": context, "fields": fields, "sections": sections})
+    return tasks
+
+
+async def extract_sds(kernel: str, file_path: str, file_name: str, tenant_id: Optional[str] = None) -> dict:
+    """Extraction for one saved SDS file: local text/section parse, then concurrent
+    model calls per section group. Each result is validated; failed sections and
+    fields are retried on their own. No DB access, safe to run in parallel."""
+    parsed = await run_cpu(parse_sds_pdf, file_path, SDS_PARSE_MAX_PAGES)
+    file_size = Path(file_path).stat().st_size
+    semaphore = asyncio.Semaphore(SDS_SECTION_CONCURRENCY)
+    usage = {"text": "", "input_tokens": 0, "output_tokens": 0}
+
+    async def run(task: dict) -> dict:
+        if parsed.text_layer:
+            prompt = build_section_prompt(file_name, parsed, task["context"], task["fields"], task["sections"])
         else:
-            db.commit()
+            prompt = build_extraction_prompt(file_name, file_size, task["fields"], task["sections"])
+        async with semaphore:
+            return await call_agent(kernel, prompt, max_output_tokens=SDS_SECTION_MAX_TOKENS,
+                                    tenant_id=tenant_id, lane="extraction")
+
+    fields, sections, errors = {}, {}, []
+    tasks = extraction_tasks(parsed)
+    for attempt in range(SDS_SECTION_RETRIES + 1):
+        results = await asyncio.gather(*(run(t) for t in tasks), return_exceptions=True)
+        retry = []
+        for task, result in zip(tasks, results):
+            if isinstance(result, Exception):
+                errors.append(result)
+                failed_sections, failed_fields = task["sections"], task["fields"]
+            else:
+                usage["input_tokens"] += result["input_tokens"]
+                usage["output_tokens"] += result["output_tokens"]
+                out = parse_agent_json(result["text"]) or {}
+                out_sections = out.get("sections") if isinstance(out.get("sections"), dict) else {}
+                failed_sections = []
+                for num in task["sections"]:
+                    section = validate_section(num, out_sections.get(num))
+                    if section:
+                        sections[num] = section
+                    else:
+                        failed_sections.append(num)
+                valid, failed_fields = validate_fields(out, task["fields"])
+                fields.update(valid)
+            # Retry each failed section alone; failed fields keep the task's context
+            retry += [{"context": (n,), "fields": [], "sections": [n]} for n in failed_sections]
+            if failed_fields:
+                retry.append({"context": task["context"], "fields": failed_fields, "sections": []})
+        tasks = retry
+        if not tasks:
+            break
+        logger.info(f"Extraction of {file_name}: retrying {len(tasks)} section/field request(s)")
+
+    if not sections and not any(v is not None for v in fields.values()) and not parsed.fields:
+        if errors:
+            raise errors[0]  # nothing extracted because the model was unreachable: let the job retry
+        return {"agent_response": usage, "data": None}
+    return {"agent_response": usage, "data": merge_parsed_sds(fields, sections, parsed)}
+
+
+# Zero-cost response recorded in token_usage when the extraction cache answers
+CACHED_AGENT_RESPONSE = {"text": "", "input_tokens": 0, "output_tokens": 0}
+
+
+def extraction_version() -> str:
+    """Extraction cache key component: changes with the provider/model, prompt, parser or agent kernel.
+    Tenant layers are left out -- extraction output depends on the document only."""
+    agent_kernel = read_kernel_file(AGENT_KERNEL_PATH) or ""
+    fingerprint = "\n".join([get_llm().label, build_extraction_prompt("", 0), agent_kernel,
+                             f"parser={PARSER_VERSION} section_chars={SDS_SECTION_CHARS}/{SDS_BRIEF_SECTION_CHARS}",
+                             f"groups={SDS_SECTION_GROUPS} max_tokens={SDS_SECTION_MAX_TOKENS}"])
+    return hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+
+
+async def get_cached_extractions(db: AsyncSession, content_hashes: list, version: str) -> dict:
+    """Look up extraction results by content hash; returns {hash: extracted_data}."""
+    hashes = [h for h in content_hashes if h]
+    if not hashes:
+        return {}
+    result = await db.execute(text("""
+        UPDATE sds_extraction_cache SET hit_count = hit_count + 1, last_hit_at = NOW()
+        WHERE content_hash = ANY(:hashes) AND extraction_version = :ver
+        RETURNING content_hash, extracted_data
+    """), {"hashes": hashes, "ver": version})
+    return {r[0]: _jsonb(r[1]) for r in result.fetchall()}
+
+
+async def save_extractions(db: AsyncSession, version: str, entries: list):
+    """entries: [(content_hash, data, agent_response)]"""
+    rows = [
+        {"hash": h, "ver": version, "data": json.dumps(data),
+         "inp": resp["input_tokens"], "out": resp["output_tokens"]}
+        for h, data, resp in entries if h
+    ]
+    if rows:
+        await db.execute(text("""
+            INSERT INTO sds_extraction_cache (content_hash, extraction_version, extracted_data, input_tokens, output_tokens)
+            VALUES (:hash, :ver, :data, :inp, :out)
+            ON CONFLICT (content_hash, extraction_version) DO NOTHING
+        """), rows)
+
+
+async def store_sds_results(db: AsyncSession, tenant_id: str, items: list) -> list:
+    """Match/create chemicals and store documents, sections and events for a batch
+    of extracted SDSs using multi-row inserts. Each item needs user_id, file_path,
+    file_name and data. Returns one upload result per item (caller commits, via
+    commit_with_events so the sds_uploaded events are queued)."""
+    cas_numbers = [it["data"]["cas_number"] for it in items if it["data"].get("cas_number")]
+    names = [it["data"]["product_name"] for it in items if it["data"].get("product_name")]
+
+    by_cas, by_name = {}, {}
+    if cas_numbers or names:
+        result = await db.execute(text("""
+            SELECT id, cas_number, chemical_name FROM chemicals
+            WHERE tenant_id = :tid AND (cas_number = ANY(:cas) OR chemical_name = ANY(:names))
+        """), {"tid": tenant_id, "cas": cas_numbers, "names": names})
+        for row in result.fetchall():
+            if row[1]:
+                by_cas.setdefault(row[1], row[0])
+            by_name.setdefault(row[2], row[0])
+
+    new_chemicals, documents, sections, outcomes = [], [], [], []
+    for it in items:
+        data = it["data"]
+
+        # Find or create chemical (CAS first, then name; also matches earlier items in this batch)
+        chemical_id = by_cas.get(data.get("cas_number")) or by_name.get(data.get("product_name"))
+        if not chemical_id:
+            chemical_id = str(uuid.uuid4())
+            new_chemicals.append({
+                "id": chemical_id, "tid": tenant_id,
+                "name": data.get("product_name") or it["file_name"],
+                "cas": data.get("cas_number"),
+                "mfr": data.get("manufacturer", ""),
+                "sw": data.get("signal_word"),
+                "hc": data.get("hazard_class", ""),
+                "rev": _date(data.get("revision_date")),
+            })
+            if data.get("cas_number"):
+                by_cas[data["cas_number"]] = chemical_id
+            if data.get("product_name"):
+                by_name[data["product_name"]] = chemical_id
+
+        doc_sections = data.get("sections", {})
+        validated = data.get("sections_validated")  # absent in results cached before section validation
+        sections_complete = len(validated) if validated is not None else sum(1 for v in doc_sections.values() if v)
+        sds_doc_id = str(uuid.uuid4())
+        documents.append({
+            "id": sds_doc_id, "tid": tenant_id, "cid": chemical_id,
+            "path": it["file_path"], "fname": it["file_name"],
+            "rev": _date(data.get("revision_date")),
+            "edata": json.dumps(data), "sc": sections_complete,
+            "uid": it["user_id"], "hash": it.get("content_hash"),
+        })
+        for sec_num, sec_data in doc_sections.items():
+            if sec_data:
+                sections.append({
+                    "tid": tenant_id, "did": sds_doc_id,
+                    "num": int(sec_num),
+                    "title": sec_data.get("title", f"Section {sec_num}"),
+                    "content": json.dumps(sec_data),
+                })
+        log_event(db, tenant_id, chemical_id, "sds_uploaded",
+                  {"file": it["file_name"], "sections_extracted": sections_complete}, it["user_id"])
+        outcomes.append({
+            "status": "success",
+            "message": f"SDS for {data.get('product_name', 'unknown')} processed. {sections_complete}/16 sections extracted.",
+            "chemical_id": str(chemical_id),
+            "data": data,
+        })
+
+    if new_chemicals:
+        await db.execute(text("""
+            INSERT INTO chemicals (id, tenant_id, chemical_name, cas_number, manufacturer, signal_word, hazard_class,
+                                   has_sds, sds_revision_date, status, next_status_change)
+            VALUES (:id, :tid, :name, :cas, :mfr, :sw, :hc, true, :rev,
+                    sds_status(CAST(:rev AS date)), sds_next_status_change(CAST(:rev AS date)))
+        """), new_chemicals)
+    if documents:
+        await db.execute(text("""
+            INSERT INTO sds_documents (id, tenant_id, chemical_id, file_path, file_name, revision_date, extracted_data, sections_complete, uploaded_by, content_hash)
+            VALUES (:id, :tid, :cid, :path, :fname, :rev, :edata, :sc, :uid, :hash)
+        """), documents)
+    if sections:
+        await db.execute(text("""
+            INSERT INTO sds_sections (tenant_id, sds_document_id, section_number, section_title, content)
+            VALUES (:tid, :did, :num, :title, :content)
+        """), sections)
+
+    return outcomes
+
+
+async def ingest_sds_file(db: AsyncSession, tenant_id: str, user_id: str, file_path: str, file_name: str,
+                          content_hash: Optional[str] = None) -> dict:
+    """Run AI extraction on a saved SDS file and store the results (caller commits)."""
+    version = extraction_version()
+    cached = await get_cached_extractions(db, [content_hash], version)
+
+    if content_hash in cached:
+        data = cached[content_hash]
+        record_tokens(tenant_id, user_id, "sds_upload_cached", CACHED_AGENT_RESPONSE)
+    else:
+        kernel = await load_agent_kernel(db, tenant_id)
+        extracted = await extract_sds(kernel, file_path, file_name, tenant_id)
+        record_tokens(tenant_id, user_id, "sds_upload", extracted["agent_response"])
+        data = extracted["data"]
+        if data is None:
             return {"status": "error", "message": "Could not parse SDS data."}
+        await save_extractions(db, version, [(content_hash, data, extracted["agent_response"])])
 
-    # Find or create chemical
-    chemical_id = None
-    if data.get("cas_number"):
-        result = db.execute(text("""
-            SELECT id FROM chemicals WHERE tenant_id = :tid AND cas_number = :cas
-        """), {"tid": auth["tenant_id"], "cas": data["cas_number"]})
-        existing = result.fetchone()
-        if existing:
-            chemical_id = existing[0]
-
-    if not chemical_id and data.get("product_name"):
-        result = db.execute(text("""
-            SELECT id FROM chemicals WHERE tenant_id = :tid AND chemical_name = :name
-        """), {"tid": auth["tenant_id"], "name": data["product_name"]})
-        existing = result.fetchone()
-        if existing:
-            chemical_id = existing[0]
-
-    if not chemical_id:
-        # Auto-create chemical entry
-        result = db.execute(text("""
-            INSERT INTO chemicals (tenant_id, chemical_name, cas_number, manufacturer, signal_word, hazard_class, has_sds, sds_revision_date, status)
-            VALUES (:tid, :name, :cas, :mfr, :sw, :hc, true, :rev, 'current')
-            RETURNING id
+    outcomes = await store_sds_results(db, tenant_id, [{
+        "user_id": user_id, "file_path": file_path, "file_name": file_name, "data": data,
+        "content_hash": content_hash,
+    }])
+    return outcomes[0]
+
+# ============================================================
+# BULK SDS IMPORT
+# ============================================================
+
+_sds_batch_tasks: set = set()
+
+
+def _unzip_sds_archive(archive: Path, zip_name: str, saved: list, created: list):
+    """Extract SDS files from a ZIP into the blob store, appending (path, original name, size, sha256)
+    to `saved` as each one is stored. Limits are checked while inflating, so a small archive of
+    highly compressible members stops at SDS_BULK_MAX_FILES files or SDS_ARCHIVE_MAX_BYTES
+    unpacked instead of filling the disk first."""
+    inflated = 0
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            name = Path(info.filename).name
+            if info.is_dir() or name.startswith(".") or "__MACOSX" in info.filename:
+                continue
+            if Path(name).suffix.lower() not in SDS_ALLOWED_SUFFIXES:
+                continue
+            if len(saved) >= SDS_BULK_MAX_FILES:
+                raise _too_many_files()
+            if info.file_size > SDS_UPLOAD_MAX_BYTES:
+                raise _too_large(name, SDS_UPLOAD_MAX_BYTES)
+            tmp, digest, size = blob_temp_path(), hashlib.sha256(), 0
+            try:
+                with zf.open(info) as src, open(tmp, "wb") as out:
+                    # The header size is only a claim: enforce the limits on what actually inflates
+                    while chunk := src.read(UPLOAD_CHUNK_SIZE):
+                        size += len(chunk)
+                        inflated += len(chunk)
+                        if size > SDS_UPLOAD_MAX_BYTES:
+                            raise _too_large(name, SDS_UPLOAD_MAX_BYTES)
+                        if inflated > SDS_ARCHIVE_MAX_BYTES:
+                            raise _too_large(f"{zip_name} (unpacked)", SDS_ARCHIVE_MAX_BYTES)
+                        out.write(chunk)
+                        digest.update(chunk)
+            except BaseException:
+                tmp.unlink(missing_ok=True)
+                raise
+            saved.append((store_sds_blob(tmp, digest.hexdigest(), created), name, size, digest.hexdigest()))
+
+
+@app.post("/sds/bulk", status_code=202)
+async def bulk_upload_sds(
+    files: list[UploadFile] = File(...),
+    auth: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_db),
+):
+    await check_token_budget(auth["tenant_id"], SDS_BULK_EST_TOKENS)
+
+    saved, created = [], []  # created: blobs this request added to the store
+    try:
+        for file in files:
+            suffix = Path(file.filename or "").suffix.lower()
+            if suffix == ".zip":
+                archive = blob_temp_path(".zip")
+                await save_upload(file, archive, SDS_ARCHIVE_MAX_BYTES)
+                try:
+                    await asyncio.to_thread(_unzip_sds_archive, archive, file.filename, saved, created)
+                except zipfile.BadZipFile:
+                    raise HTTPException(status_code=400, detail=f"{file.filename} is not a valid ZIP archive")
+                finally:
+                    archive.unlink(missing_ok=True)
+            elif suffix in SDS_ALLOWED_SUFFIXES:
+                if len(saved) >= SDS_BULK_MAX_FILES:
+                    raise _too_many_files()
+                tmp = blob_temp_path()
+                size, content_hash = await save_upload(file, tmp)
+                path = await asyncio.to_thread(store_sds_blob, tmp, content_hash, created)
+                saved.append((path, file.filename, size, content_hash))
+
+        if not saved:
+            raise HTTPException(status_code=400, detail="No SDS files (.pdf, .jpg, .png) found in upload")
+
+        batch_id = str(uuid.uuid4())
+        await db.execute(text("""
+            INSERT INTO sds_batches (id, tenant_id, created_by, total_files)
+            VALUES (:bid, :tid, :uid, :total)
+        """), {"bid": batch_id, "tid": auth["tenant_id"], "uid": auth["user_id"], "total": len(saved)})
+        await db.execute(text("""
+            INSERT INTO sds_jobs (tenant_id, created_by, batch_id, file_path, file_name, file_size, content_hash)
+            VALUES (:tid, :uid, :bid, :path, :fname, :size, :hash)
+        """), [
+            {"tid": auth["tenant_id"], "uid": auth["user_id"], "bid": batch_id,
+             "path": str(path), "fname": name, "size": size, "hash": content_hash}
+            for path, name, size, content_hash in saved
+        ])
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        await discard_sds_blobs(db, created)
+        raise
+    start_sds_batch(batch_id)
+
+    return {
+        "status": "queued",
+        "batch_id": batch_id,
+        "files": len(saved),
+        "message": f"{len(saved)} SDS files queued for extraction.",
+    }
+
+
+@app.get("/sds/batches/{batch_id}")
+async def get_sds_batch(
+    batch_id: str,
+    auth: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_db),
+):
+    result = await db.execute(text("""
+        SELECT status, total_files, created_at, finished_at
+        FROM sds_batches WHERE id = :bid AND tenant_id = :tid
+    """), {"bid": batch_id, "tid": auth["tenant_id"]})
+    batch = result.fetchone()
+
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    jobs = (await db.execute(text("""
+        SELECT id, file_name, status, error, result->>'chemical_id'
+        FROM sds_jobs WHERE batch_id = :bid
+        ORDER BY created_at, file_name
+    """), {"bid": batch_id})).fetchall()
+
+    counts = {}
+    for j in jobs:
+        counts[j[2]] = counts.get(j[2], 0) + 1
+
+    return {
+        "batch_id": batch_id,
+        "status": batch[0],
+        "total": batch[1],
+        "counts": counts,
+        "created_at": batch[2].isoformat(),
+        "finished_at": batch[3].isoformat() if batch[3] else None,
+        "files": [
+            {"job_id": str(j[0]), "file_name": j[1], "status": j[2], "error": j[3], "chemical_id": j[4]}
+            for j in jobs
+        ],
+    }
+
+
+async def claim_sds_batch_jobs(batch_id: str) -> tuple:
+    """Claim the next chunk of a batch, sized to what the tenant's token budget allows.
+    Returns (jobs, kernel); an empty job list with kernel None means the budget ran out."""
+    db = SessionLocal()
+    try:
+        tenant_id = (await db.execute(text(
+            "SELECT tenant_id FROM sds_batches WHERE id = :bid"
+        ), {"bid": batch_id})).scalar()
+        await set_tenant_context(db, str(tenant_id))
+
+        # A file that kills or hangs the runner leaves its job running: reclaim it
+        # until SDS_JOB_MAX_ATTEMPTS, then give up on it like process_sds_job does
+        await db.execute(text("""
+            UPDATE sds_jobs SET status = 'error', error = :error, finished_at = NOW()
+            WHERE batch_id = :bid AND status = 'running' AND attempts >= :max
+              AND started_at < NOW() - make_interval(secs => :stale)
+        """), {"bid": batch_id, "max": SDS_JOB_MAX_ATTEMPTS, "stale": SDS_JOB_STALE_SECONDS,
+               "error": f"Gave up after {SDS_JOB_MAX_ATTEMPTS} attempts"})
+
+        remaining = await tokens_remaining(str(tenant_id))
+        limit = SDS_BULK_WRITE_BATCH
+        if remaining is not None:
+            limit = min(limit, max(remaining, 0) // SDS_BULK_EST_TOKENS)
+        if limit == 0:
+            pending = (await db.execute(text("""
+                SELECT 1 FROM sds_jobs WHERE batch_id = :bid AND status IN ('queued', 'running') LIMIT 1
+            """), {"bid": batch_id})).fetchone()
+            return ([], None) if pending else ([], "")
+
+        result = await db.execute(text("""
+            UPDATE sds_jobs SET status = 'running', attempts = attempts + 1, started_at = NOW()
+            WHERE id IN (
+                SELECT id FROM sds_jobs
+                WHERE batch_id = :bid
+                  AND (status = 'queued'
+                       OR (status = 'running' AND started_at < NOW() - make_interval(secs => :stale)
+                           AND attempts < :max))
+                ORDER BY created_at
+                FOR UPDATE SKIP LOCKED
+                LIMIT :limit
+            )
+            RETURNING id, tenant_id, created_by, file_path, file_name, attempts, content_hash
+        """), {"bid": batch_id, "stale": SDS_JOB_STALE_SECONDS, "max": SDS_JOB_MAX_ATTEMPTS, "limit": limit})
+        jobs = [
+            {"id": str(r[0]), "tenant_id": str(r[1]), "user_id": str(r[2]) if r[2] else None,
+             "file_path": r[3], "file_name": r[4], "attempts": r[5], "content_hash": r[6]}
+            for r in result.fetchall()
+        ]
+        kernel = ""
+        if jobs:
+            cached = await get_cached_extractions(db, [j["content_hash"] for j in jobs], extraction_version())
+            for j in jobs:
+                j["cached"] = cached.get(j["content_hash"])
+            if any(j["cached"] is None for j in jobs):
+                kernel = await load_agent_kernel(db, str(tenant_id))
+            await db.execute(text(
+                "UPDATE sds_batches SET status = 'running' WHERE id = :bid AND status = 'queued'"
+            ), {"bid": batch_id})
+        await db.commit()
+        return jobs, kernel
+    finally:
+        await db.close()
+
+
+async def store_sds_batch(jobs: list, extracted: list):
+    """Write one extracted chunk: token usage, SDS rows and job results in one transaction."""
+    tenant_id = jobs[0]["tenant_id"]
+    db = SessionLocal()
+    try:
+        await set_tenant_context(db, tenant_id)
+
+        ok_jobs, items, failed, new_cache = [], [], [], []
+        for job, ex in zip(jobs, extracted):
+            if isinstance(ex, Exception):
+                failed.append((job, str(ex), ex))
+                continue
+            rtype = "sds_upload_cached" if ex.get("cached") else "sds_upload"
+            record_tokens(tenant_id, job["user_id"], rtype, ex["agent_response"])
+            if ex["data"] is None:
+                failed.append((job, "Could not parse SDS data.", None))
+                continue
+            if not ex.get("cached"):
+                new_cache.append((job["content_hash"], ex["data"], ex["agent_response"]))
+            ok_jobs.append(job)
+            items.append({"user_id": job["user_id"], "file_path": job["file_path"],
+                          "file_name": job["file_name"], "data": ex["data"],
+                          "content_hash": job["content_hash"]})
+
+        await save_extractions(db, extraction_version(), new_cache)
+        outcomes = await store_sds_results(db, tenant_id, items) if items else []
+
+        updates = [
+            {"jid": job["id"], "status": "done", "result": json.dumps(outcome), "error": None, "retry": False}
+            for job, outcome in zip(ok_jobs, outcomes)
+        ]
+        for job, error, exc in failed:
+            # Model/transport errors get retried; unparseable output is final, and so is
+            # an exhausted monthly budget (same rule as process_sds_job)
+            budget_exhausted = isinstance(exc, TokenLimitExceeded) and exc.reason == "budget"
+            retry = exc is not None and not budget_exhausted and job["attempts"] < SDS_JOB_MAX_ATTEMPTS
+            updates.append({
+                "jid": job["id"], "status": "queued" if retry else "skipped" if budget_exhausted else "error",
+                "result": json.dumps({"status": "error", "message": error}), "error": error, "retry": retry,
+            })
+        await db.execute(text("""
+            UPDATE sds_jobs SET status = :status, result = :result, error = :error,
+                   finished_at = CASE WHEN :retry THEN NULL ELSE NOW() END
+            WHERE id = :jid
+        """), updates)
+        await commit_with_events(db)
+    except Exception:
+        await db.rollback()
+        logger.exception(f"Failed to store SDS batch chunk ({len(jobs)} files)")
+        await db.execute(text("""
+            UPDATE sds_jobs SET status = CASE WHEN attempts < :max THEN 'queued' ELSE 'error' END,
+                   error = 'Failed to store extraction results'
+            WHERE id = ANY(:ids)
+        """), {"max": SDS_JOB_MAX_ATTEMPTS, "ids": [j["id"] for j in jobs]})
+        await db.commit()
+    finally:
+        await db.close()
+
+
+async def finish_sds_batch(batch_id: str, budget_exhausted: bool):
+    db = SessionLocal()
+    try:
+        if budget_exhausted:
+            await db.execute(text("""
+                UPDATE sds_jobs SET status = 'skipped', error = 'Monthly token budget exhausted', finished_at = NOW()
+                WHERE batch_id = :bid AND status = 'queued'
+            """), {"bid": batch_id})
+        await db.execute(text("""
+            UPDATE sds_batches SET status = 'done', finished_at = NOW()
+            WHERE id = :bid AND NOT EXISTS (
+                SELECT 1 FROM sds_jobs WHERE batch_id = :bid AND status IN ('queued', 'running')
+            )
+        """), {"bid": batch_id})
+        await db.commit()
+    finally:
+        await db.close()
+
+
+async def run_sds_batch(batch_id: str):
+    """Extract a batch chunk by chunk: up to SDS_BULK_CONCURRENCY model calls in
+    flight, then one transaction per chunk for all of its inserts."""
+    semaphore = asyncio.Semaphore(SDS_BULK_CONCURRENCY)
+
+    async def extract(job: dict, kernel: str):
+        async with semaphore:
+            return await extract_sds(kernel, job["file_path"], job["file_name"], job["tenant_id"])
+
+    budget_exhausted = False
+    try:
+        while True:
+            jobs, kernel = await claim_sds_batch_jobs(batch_id)
+            if not jobs:
+                budget_exhausted = kernel is None
+                break
+
+            # Cache hits skip the model; identical files within the chunk are extracted once
+            pending = {}
+            for j in jobs:
+                if j["cached"] is None:
+                    pending.setdefault(j["content_hash"] or j["id"], j)
+            results = await asyncio.gather(*(extract(j, kernel) for j in pending.values()), return_exceptions=True)
+            by_key = dict(zip(pending, results))
+
+            extracted = []
+            for j in jobs:
+                key = j["content_hash"] or j["id"]
+                if j["cached"] is not None:
+                    extracted.append({"agent_response": CACHED_AGENT_RESPONSE, "data": j["cached"], "cached": True})
+                elif pending[key] is j or isinstance(by_key[key], Exception):
+                    extracted.append(by_key[key])
+                else:
+                    extracted.append({"agent_response": CACHED_AGENT_RESPONSE, "data": by_key[key]["data"], "cached": True})
+            await store_sds_batch(jobs, extracted)
+        await finish_sds_batch(batch_id, budget_exhausted)
+    except Exception:
+        logger.exception(f"SDS batch {batch_id} stopped; it resumes on next startup")
+
+
+def start_sds_batch(batch_id: str):
+    task = asyncio.create_task(run_sds_batch(batch_id))
+    _sds_batch_tasks.add(task)
+    task.add_done_callback(_sds_batch_tasks.discard)
+
+
+async def pending_sds_batches() -> list:
+    db = SessionLocal()
+    try:
+        result = await db.execute(text("""
+            SELECT DISTINCT batch_id FROM sds_jobs
+            WHERE batch_id IS NOT NULL AND status IN ('queued', 'running')
+        """))
+        return [str(r[0]) for r in result.fetchall()]
+    finally:
+        await db.close()
+
+# ============================================================
+# SDS INGESTION WORKERS
+# ============================================================
+
+_sds_job_wakeup: Optional[asyncio.Event] = None
+_sds_worker_tasks: list = []
+
+
+def wake_sds_workers():
+    if _sds_job_wakeup is not None:
+        _sds_job_wakeup.set()
+
+
+async def claim_sds_job() -> Optional[dict]:
+    """Claim the oldest queued single-upload job (or a stale running one left by a dead worker)."""
+    db = SessionLocal()
+    try:
+        result = await db.execute(text("""
+            UPDATE sds_jobs SET status = 'running', attempts = attempts + 1, started_at = NOW()
+            WHERE id = (
+                SELECT id FROM sds_jobs
+                WHERE batch_id IS NULL
+                  AND (status = 'queued'
+                       OR (status = 'running' AND started_at < NOW() - make_interval(secs => :stale)))
+                ORDER BY created_at
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING id, tenant_id, created_by, file_path, file_name, attempts, content_hash
+        """), {"stale": SDS_JOB_STALE_SECONDS})
+        row = result.fetchone()
+        await db.commit()
+    finally:
+        await db.close()
+
+    if not row:
+        return None
+    return {
+        "id": str(row[0]), "tenant_id": str(row[1]),
+        "user_id": str(row[2]) if row[2] else None,
+        "file_path": row[3], "file_name": row[4], "attempts": row[5], "content_hash": row[6],
+    }
+
+
+async def process_sds_job(job: dict):
+    """Extract + store one SDS. Results and job state commit in the same transaction."""
+    db = SessionLocal()
+    try:
+        if job["attempts"] > SDS_JOB_MAX_ATTEMPTS:
+            raise RuntimeError(f"Gave up after {SDS_JOB_MAX_ATTEMPTS} attempts")
+
+        await set_tenant_context(db, job["tenant_id"])
+        outcome = await ingest_sds_file(db, job["tenant_id"], job["user_id"], job["file_path"], job["file_name"],
+                                        job["content_hash"])
+        await db.execute(text("""
+            UPDATE sds_jobs SET status = :status, result = :result, error = :error, finished_at = NOW()
+            WHERE id = :jid
         """), {
-            "tid": auth["tenant_id"],
-            "name": data.get("product_name", file.filename),
-            "cas": data.get("cas_number"),
-            "mfr": data.get("manufacturer", ""),
-            "sw": data.get("signal_word"),
-            "hc": data.get("hazard_class", ""),
-            "rev": data.get("revision_date"),
+            "jid": job["id"],
+            "status": "done" if outcome["status"] == "success" else "error",
+            "result": json.dumps(outcome),
+            "error": None if outcome["status"] == "success" else outcome.get("message"),
         })
-        chemical_id = result.fetchone()[0]
+        await commit_with_events(db)
+    except Exception as e:
+        await db.rollback()
+        logger.exception(f"SDS job {job['id']} failed (attempt {job['attempts']})")
+        # Out of monthly budget: no point retrying until the month rolls over
+        budget_exhausted = isinstance(e, TokenLimitExceeded) and e.reason == "budget"
+        retry = not budget_exhausted and job["attempts"] < SDS_JOB_MAX_ATTEMPTS
+        status = "queued" if retry else "skipped" if budget_exhausted else "error"
+        await db.execute(text("""
+            UPDATE sds_jobs SET status = :status, error = :error,
+                   finished_at = CASE WHEN :retry THEN NULL ELSE NOW() END
+            WHERE id = :jid
+        """), {"jid": job["id"], "status": status, "error": str(e), "retry": retry})
+        await db.commit()
+    finally:
+        await db.close()
 
-    # Store SDS document
-    sections = data.get("sections", {})
-    sections_complete = sum(1 for v in sections.values() if v)
 
-    result = db.execute(text("""
-        INSERT INTO sds_documents (tenant_id, chemical_id, file_path, file_name, revision_date, extracted_data, sections_complete, uploaded_by)
-        VALUES (:tid, :cid, :path, :fname, :rev, :edata, :sc, :uid)
-        RETURNING id
-    """), {
-        "tid": auth["tenant_id"], "cid": chemical_id,
-        "path": str(file_path), "fname": file.filename,
-        "rev": data.get("revision_date"),
-        "edata": json.dumps(data), "sc": sections_complete,
-        "uid": auth["user_id"],
-    })
-    sds_doc_id = result.fetchone()[0]
-
-    # Store individual sections
-    for sec_num, sec_data in sections.items():
-        if sec_data:
-            db.execute(text("""
-                INSERT INTO sds_sections (tenant_id, sds_document_id, section_number, section_title, content)
-                VALUES (:tid, :did, :num, :title, :content)
-            """), {
-                "tid": auth["tenant_id"], "did": sds_doc_id,
-                "num": int(sec_num),
-                "title": sec_data.get("title", f"Section {sec_num}"),
-                "content": json.dumps(sec_data),
-            })
+async def run_sds_worker(worker_id: int):
+    while True:
+        try:
+            job = await claim_sds_job()
+        except Exception:
+            logger.exception(f"SDS worker {worker_id} could not claim a job")
+            job = None
+
+        if job is None:
+            _sds_job_wakeup.clear()
+            try:
+                await asyncio.wait_for(_sds_job_wakeup.wait(), timeout=SDS_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        try:
+            await process_sds_job(job)
+        except Exception:
+            logger.exception(f"SDS worker {worker_id} could not record job {job['id']}")
 
-    # Log event
-    db.execute(text("""
-        INSERT INTO compliance_events (tenant_id, chemical_id, event_type, event_data, created_by)
-        VALUES (:tid, :cid, 'sds_uploaded', :edata, :uid)
-    """), {
-        "tid": auth["tenant_id"], "cid": chemical_id,
-        "edata": json.dumps({"file": file.filename, "sections_extracted": sections_complete}),
-        "uid": auth["user_id"],
-    })
 
-    db.commit()
+@app.on_event("startup")
+async def start_sds_workers():
+    global _sds_job_wakeup
+    _sds_job_wakeup = asyncio.Event()
+    for i in range(SDS_WORKERS):
+        _sds_worker_tasks.append(asyncio.create_task(run_sds_worker(i)))
+    for batch_id in await pending_sds_batches():
+        start_sds_batch(batch_id)
+
+
+_sds_expiry_task: Optional[asyncio.Task] = None
+
+
+async def advance_sds_statuses() -> Optional[tuple]:
+    """One expiry step; returns (documents changed, chemicals changed), or None when
+    another replica holds the lock. Compliance events are written by the function."""
+    async with SessionLocal() as db:
+        locked = (await db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": SDS_EXPIRY_LOCK})).scalar()
+        if not locked:
+            return None
+        changed = (await db.execute(text("SELECT * FROM advance_sds_statuses()"))).fetchone()
+        await db.commit()
+        return tuple(changed)
+
+
+async def run_sds_expiry():
+    while True:
+        try:
+            changed = await advance_sds_statuses()
+            if changed and any(changed):
+                logger.info(f"SDS expiry: {changed[0]} documents, {changed[1]} chemicals changed status")
+                metrics["sds_status_changes"] += changed[1]
+        except Exception:
+            logger.exception("SDS expiry step failed")
+        await asyncio.sleep(SDS_EXPIRY_INTERVAL)
 
+
+@app.on_event("startup")
+async def start_sds_expiry():
+    global _sds_expiry_task
+    if SDS_EXPIRY_INTERVAL > 0:
+        _sds_expiry_task = asyncio.create_task(run_sds_expiry())
+
+
+_pdf_warm_task: Optional[asyncio.Task] = None
+
+
+@app.on_event("startup")
+async def warm_pdf_pool():
+    # Spawning and warming the workers takes a moment; let startup finish meanwhile
+    global _pdf_warm_task
+    _pdf_warm_task = asyncio.create_task(start_pdf_pool())
+
+
+@app.on_event("shutdown")
+async def stop_sds_workers():
+    # Jobs interrupted mid-run stay 'running' and are reclaimed once stale
+    for task in _sds_worker_tasks + list(_sds_batch_tasks):
+        task.cancel()
+    if _sds_expiry_task is not None:
+        _sds_expiry_task.cancel()
+
+
+@app.on_event("shutdown")
+async def close_pools():
+    await close_spoolers()
+    await close_pdf_pool()
+    await stop_event_writer()
+    await engine.dispose()
+    cpu_executor.shutdown(wait=False)
+    await close_llm()
+    if SSO_AVAILABLE:
+        await close_gp3_client()
+
+# ============================================================
+# ANSWER CACHE
+# ============================================================
+
+# Process-wide counters, reported by /sds/metrics
+metrics: Counter = Counter()
+
+# tenant_id -> {"key": (registry version, kernel hash), "entries": OrderedDict(normalized question -> entry)}
+_answer_caches: dict = {}
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9-]+", question.lower()))
+
+
+def _answer_cache(tenant_id: str, key: tuple) -> OrderedDict:
+    """The tenant's entries, emptied when the registry or kernel has changed since they were stored."""
+    cache = _answer_caches.get(tenant_id)
+    if cache is None or cache["key"] != key:
+        if cache is not None and cache["entries"]:
+            metrics["answer_cache_invalidations"] += 1
+        cache = {"key": key, "entries": OrderedDict()}
+        _answer_caches[tenant_id] = cache
+    return cache["entries"]
+
+
+def get_cached_answer(tenant_id: str, key: tuple, question: str) -> Optional[str]:
+    entries = _answer_cache(tenant_id, key)
+    norm = normalize_question(question)
+    now = datetime.utcnow().timestamp()
+
+    entry = entries.get(norm)
+    match = "exact" if entry else None
+    if entry is None and ANSWER_CACHE_SIMILARITY < 1:
+        # Near-duplicate: same question terms give or take a word ("ppe for acetone" / "acetone ppe?")
+        terms = frozenset(tokenize(question))
+        best = 0.0
+        for cand_norm, cand in entries.items():
+            if not terms or not cand["terms"]:
+                continue
+            sim = len(terms & cand["terms"]) / len(terms | cand["terms"])
+            if sim > best:
+                best, norm, entry = sim, cand_norm, cand
+        if best < ANSWER_CACHE_SIMILARITY:
+            entry = None
+        match = "similar"
+
+    if entry is not None and now - entry["at"] > ANSWER_CACHE_TTL:
+        del entries[norm]
+        metrics["answer_cache_expired"] += 1
+        entry = None
+    if entry is None:
+        metrics["answer_cache_misses"] += 1
+        return None
+
+    entries.move_to_end(norm)
+    metrics[f"answer_cache_hits_{match}"] += 1
+    return entry["answer"]
+
+
+def put_cached_answer(tenant_id: str, key: tuple, question: str, answer: str):
+    entries = _answer_cache(tenant_id, key)
+    entries[normalize_question(question)] = {
+        "answer": answer, "terms": frozenset(tokenize(question)), "at": datetime.utcnow().timestamp(),
+    }
+    entries.move_to_end(normalize_question(question))
+    while len(entries) > ANSWER_CACHE_SIZE:
+        entries.popitem(last=False)
+        metrics["answer_cache_evictions"] += 1
+
+
+async def answer_cache_key(db: AsyncSession, tenant_id: str) -> tuple:
+    return (await get_registry_version(db, tenant_id), (await get_tenant_kernel(db, tenant_id))["hash"])
+
+
+def answer_cache_stats() -> dict:
+    hits = metrics["answer_cache_hits_exact"] + metrics["answer_cache_hits_similar"]
+    lookups = hits + metrics["answer_cache_misses"]
     return {
-        "status": "success",
-        "message": f"SDS for {data.get('product_name', 'unknown')} processed. {sections_complete}/16 sections extracted.",
-        "chemical_id": str(chemical_id),
-        "data": data,
+        "hits": hits,
+        "hits_exact": metrics["answer_cache_hits_exact"],
+        "hits_similar": metrics["answer_cache_hits_similar"],
+        "misses": metrics["answer_cache_misses"],
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        "evictions": metrics["answer_cache_evictions"],
+        "expired": metrics["answer_cache_expired"],
+        "invalidations": metrics["answer_cache_invalidations"],
+        "tenants": len(_answer_caches),
+        "entries": sum(len(c["entries"]) for c in _answer_caches.values()),
     }
 
+
+@app.get("/sds/metrics")
+async def get_metrics(auth: dict = Depends(verify_token)):
+    if auth["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    stats = {"answer_cache": answer_cache_stats(), "llm": llm_stats(), "token_limits": token_limit_stats(),
+             "events": event_stats(), "printers": spooler_stats(),
+             "zpl_templates": template_stats(), "pdf": pdf_stats(),
+             "dashboard_cache": {"hits": metrics["dashboard_cache_hits"], "misses": metrics["dashboard_cache_misses"],
+                                 "tenants": len(_dashboard_cache)}}
+    if SSO_AVAILABLE:
+        stats["sso"] = auth_cache_stats()
+    return stats
+
 # ============================================================
 # NATURAL LANGUAGE Q&A
 # ============================================================
@@ -561,73 +2303,139 @@ Return ONLY a valid JSON object with this structure:
 async def ask_question(
     req: QuestionRequest,
     auth: dict = Depends(verify_token),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    set_tenant_context(db, auth["tenant_id"])
+    await set_tenant_context(db, auth["tenant_id"])
 
-    # Build context
-    result = db.execute(text("""
-        SELECT c.chemical_name, c.cas_number, c.signal_word, c.hazard_class,
-               c.storage_class, c.location, c.status, c.critical,
-               sd.revision_date, sd.sections_complete
-        FROM chemicals c
-        LEFT JOIN LATERAL (
-            SELECT revision_date, sections_complete FROM sds_documents
-            WHERE chemical_id = c.id ORDER BY upload_date DESC LIMIT 1
-        ) sd ON true
-        WHERE c.tenant_id = :tid
-        ORDER BY c.chemical_name
-    """), {"tid": auth["tenant_id"]})
-    chemicals = result.fetchall()
-
-    context = "Chemical inventory:\n" + "\n".join([
-        f"- {c[0]} (CAS: {c[1] or 'N/A'}, Signal: {c[2] or 'None'}, Class: {c[3] or 'N/A'}, "
-        f"Storage: {c[4]}, Location: {c[5] or 'unassigned'}, Status: {c[6]}, Critical: {c[7]}, "
-        f"SDS Rev: {c[8] or 'N/A'}, Sections: {c[9] or 0}/16)"
-        for c in chemicals
-    ]) if chemicals else "No chemicals in registry yet."
+    cache_key = await answer_cache_key(db, auth["tenant_id"])
+    cached = get_cached_answer(auth["tenant_id"], cache_key, req.question)
+    if cached is not None:
+        record_tokens(auth["tenant_id"], auth["user_id"], "question_cached", CACHED_AGENT_RESPONSE)
+        return {"status": "success", "answer": cached, "cached": True}
 
-    context += f"\n\nTotal chemicals: {len(chemicals)}"
+    # Build context from the chemicals and SDS sections relevant to the question
+    context, chemical_list = await build_qa_context(db, auth["tenant_id"], req.question)
 
-    kernel = load_agent_kernel(db, auth["tenant_id"])
-    agent_response = call_agent(kernel, req.question, context)
-    log_tokens(db, auth["tenant_id"], auth["user_id"], "question", agent_response)
-    db.commit()
+    kernel = await load_agent_kernel(db, auth["tenant_id"], chemical_list)
+    agent_response = await call_agent(kernel, req.question, context, tenant_id=auth["tenant_id"])
+    record_tokens(auth["tenant_id"], auth["user_id"], "question", agent_response)
+    put_cached_answer(auth["tenant_id"], cache_key, req.question, agent_response["text"])
 
-    return {"status": "success", "answer": agent_response["text"]}
+    return {"status": "success", "answer": agent_response["text"], "cached": False}
 
-# ============================================================
-# GHS LABEL GENERATION
-# ============================================================
 
-@app.post("/sds/label")
-async def generate_label(
-    req: LabelRequest,
+@app.post("/sds/question/stream")
+async def ask_question_stream(
+    req: QuestionRequest,
     auth: dict = Depends(verify_token),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    set_tenant_context(db, auth["tenant_id"])
-
-    # Get chemical + latest SDS data
-    result = db.execute(text("""
-        SELECT c.chemical_name, c.cas_number, c.signal_word, c.manufacturer,
-               sd.extracted_data
-        FROM chemicals c
-        LEFT JOIN LATERAL (
-            SELECT extracted_data FROM sds_documents
-            WHERE chemical_id = c.id ORDER BY upload_date DESC LIMIT 1
-        ) sd ON true
-        WHERE c.id = :cid AND c.tenant_id = :tid
-    """), {"cid": req.chemical_id, "tid": auth["tenant_id"]})
-    chem = result.fetchone()
-
-    if not chem:
-        raise HTTPException(status_code=404, detail="Chemical not found")
+    """Server-sent events version of /sds/question: answer text arrives as it is generated."""
+    await set_tenant_context(db, auth["tenant_id"])
+    tenant_id, user_id = auth["tenant_id"], auth["user_id"]
+
+    cache_key = await answer_cache_key(db, tenant_id)
+    cached = get_cached_answer(tenant_id, cache_key, req.question)
+    if cached is not None:
+        record_tokens(tenant_id, user_id, "question_cached", CACHED_AGENT_RESPONSE)
+        body = iter([sse_event({"delta": cached}), sse_event({"done": True, "cached": True})])
+        return StreamingResponse(body, media_type="text/event-stream", headers=SSE_HEADERS)
+
+    context, chemical_list = await build_qa_context(db, tenant_id, req.question)
+    kernel = await load_agent_kernel(db, tenant_id, chemical_list)
+
+    async def on_complete(agent_response: dict):
+        record_tokens(tenant_id, user_id, "question", agent_response)
+        put_cached_answer(tenant_id, cache_key, req.question, agent_response["text"])
+
+    def on_partial(agent_response: dict):
+        record_tokens(tenant_id, user_id, "question", agent_response)
+
+    return StreamingResponse(
+        stream_agent_sse(kernel, req.question, context, on_complete, tenant_id, on_partial),
+        media_type="text/event-stream", headers=SSE_HEADERS,
+    )
 
-    sds_data = json.loads(chem[4]) if chem[4] else {}
+# ============================================================
+# GHS LABEL GENERATION
+# ============================================================
 
-    # Build label data
-    label_data = {
+# Chemical + latest SDS + any label already rendered from that SDS revision with the same
+# type, size and template version; callers append the WHERE clause. extracted_data is only
+# read (and detoasted) when there is no stored label to reuse.
+LABEL_SOURCE_SQL = """
+    SELECT c.chemical_name, c.cas_number, c.signal_word, c.manufacturer,
+           CASE WHEN l.id IS NULL THEN sd.extracted_data END, c.id, sd.id,
+           l.id, l.label_data, l.zpl_content
+    FROM chemicals c
+    LEFT JOIN sds_documents sd ON sd.id = c.latest_sds_document_id
+    LEFT JOIN labels l ON l.tenant_id = c.tenant_id AND l.chemical_id = c.id
+        AND l.sds_document_id IS NOT DISTINCT FROM sd.id AND l.label_type = :ltype AND l.label_size = :lsize
+        AND l.template_version = :tver
+"""
+ZPL_LABEL_TYPES = ("ghs_primary", "secondary")
+LABEL_DATA_VERSION = "1"  # bump when build_label_data output changes
+
+
+def label_dpi(printer_config: dict) -> int:
+    """Printer resolution from the tenant kernel (printer_dpi), 203 when unset or unsupported."""
+    try:
+        dpi = int(printer_config.get("printer_dpi", BASE_DPI))
+    except ValueError:
+        return BASE_DPI
+    return dpi if dpi in SUPPORTED_DPI else BASE_DPI
+
+
+def label_template_version(dpi: int) -> str:
+    """Stored labels are reused only while label data, kernel layouts and resolution are unchanged."""
+    return f"{LABEL_DATA_VERSION}-{template_version(read_kernel_file(PRINTER_KERNEL_PATH) or '', dpi)}"
+
+
+async def resolve_labels(db: AsyncSession, tenant_id: str, chems: list, label_type: str, label_size: str,
+                         quantity: int, dpi: int, tver: str) -> tuple:
+    """Reuse labels already rendered from each chemical's latest SDS revision and render the rest.
+    Returns ([(label_id, chemical_id, label_data, zpl), ...], reused count). Reused rows only get
+    their generated_count bumped; new renderings are upserted on the render key in one statement."""
+    labels, reused, rendered = [], [], []
+    for chem in chems:
+        if chem[7] is not None:
+            label_data = {**_jsonb(chem[8]), "quantity": quantity}
+            zpl = set_quantity(chem[9], quantity) if chem[9] else None
+            labels.append((str(chem[7]), str(chem[5]), label_data, zpl))
+            reused.append(str(chem[7]))
+            continue
+        label_data = build_label_data(chem, label_type, label_size, quantity, dpi)
+        zpl = generate_zpl_label(label_data) if label_type in ZPL_LABEL_TYPES else None
+        labels.append((None, str(chem[5]), label_data, zpl))
+        rendered.append((tenant_id, str(chem[5]), str(chem[6]) if chem[6] else None, label_type, label_size, tver,
+                         json.dumps(label_data), zpl))
+
+    if reused:
+        await db.execute(text("""
+            UPDATE labels SET generated_count = generated_count + 1, last_generated = NOW()
+            WHERE id = ANY(CAST(:ids AS uuid[]))
+        """), {"ids": reused})
+    if rendered:
+        columns = list(zip(*rendered))
+        result = await db.execute(text("""
+            INSERT INTO labels (tenant_id, chemical_id, sds_document_id, label_type, label_size, template_version,
+                                label_data, zpl_content)
+            SELECT * FROM unnest(CAST(:tids AS uuid[]), CAST(:cids AS uuid[]), CAST(:docs AS uuid[]),
+                                 CAST(:ltypes AS text[]), CAST(:lsizes AS text[]), CAST(:tvers AS text[]),
+                                 CAST(:ldata AS jsonb[]), CAST(:zpls AS text[]))
+            ON CONFLICT (tenant_id, chemical_id, sds_document_id, label_type, label_size, template_version)
+            DO UPDATE SET label_data = EXCLUDED.label_data, zpl_content = EXCLUDED.zpl_content,
+                          generated_count = labels.generated_count + 1, last_generated = NOW()
+            RETURNING id, chemical_id
+        """), dict(zip(("tids", "cids", "docs", "ltypes", "lsizes", "tvers", "ldata", "zpls"), map(list, columns))))
+        ids = {str(cid): str(label_id) for label_id, cid in result.fetchall()}
+        labels = [(label_id or ids[cid], cid, label_data, zpl) for label_id, cid, label_data, zpl in labels]
+    return labels, len(reused)
+
+
+def build_label_data(chem, label_type: str, label_size: str, quantity: int, dpi: int = BASE_DPI) -> dict:
+    sds_data = _jsonb(chem[4]) or {}
+    return {
         "product_name": chem[0],
         "cas_number": chem[1] or "",
         "signal_word": chem[2] or sds_data.get("signal_word", ""),
@@ -635,109 +2443,126 @@ async def generate_label(
         "pictogram_codes": sds_data.get("pictogram_codes", []),
         "hazard_statements": sds_data.get("hazard_statements", []),
         "precautionary_statements": sds_data.get("precautionary_statements", [])[:6],
-        "label_type": req.label_type,
-        "label_size": req.label_size,
-        "quantity": req.quantity,
+        "label_type": label_type,
+        "label_size": label_size,
+        "quantity": quantity,
+        "dpi": dpi,
         "generated_at": datetime.utcnow().isoformat(),
     }
 
-    # Generate ZPL for Zebra printers
-    zpl = generate_zpl_label(label_data) if req.label_type in ("ghs_primary", "secondary") else None
 
-    # Store label record
-    db.execute(text("""
-        INSERT INTO labels (tenant_id, chemical_id, label_type, label_size, label_data, zpl_content)
-        VALUES (:tid, :cid, :ltype, :lsize, :ldata, :zpl)
-    """), {
-        "tid": auth["tenant_id"], "cid": req.chemical_id,
-        "ltype": req.label_type, "lsize": req.label_size,
-        "ldata": json.dumps(label_data), "zpl": zpl,
+@app.post("/sds/label")
+async def generate_label(
+    req: LabelRequest,
+    auth: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_db),
+):
+    await set_tenant_context(db, auth["tenant_id"])
+    dpi = label_dpi(await get_tenant_printer_config(auth["tenant_id"], db))
+    tver = label_template_version(dpi)
+
+    # Get chemical + latest SDS data (or the label already rendered from it)
+    result = await db.execute(text(LABEL_SOURCE_SQL + "WHERE c.id = :cid AND c.tenant_id = :tid"), {
+        "cid": req.chemical_id, "tid": auth["tenant_id"],
+        "ltype": req.label_type, "lsize": req.label_size, "tver": tver,
     })
+    chem = result.fetchone()
 
-    db.execute(text("""
-        INSERT INTO compliance_events (tenant_id, chemical_id, event_type, event_data, created_by)
-        VALUES (:tid, :cid, 'label_generated', :edata, :uid)
-    """), {
-        "tid": auth["tenant_id"], "cid": req.chemical_id,
-        "edata": json.dumps({"label_type": req.label_type, "quantity": req.quantity}),
-        "uid": auth["user_id"],
-    })
-    db.commit()
+    if not chem:
+        raise HTTPException(status_code=404, detail="Chemical not found")
+
+    [(label_id, _, label_data, zpl)], reused = await resolve_labels(
+        db, auth["tenant_id"], [chem], req.label_type, req.label_size, req.quantity, dpi, tver)
+
+    log_event(db, auth["tenant_id"], req.chemical_id, "label_generated",
+              {"label_type": req.label_type, "quantity": req.quantity, "reused": bool(reused)}, auth["user_id"])
+    await commit_with_events(db)
 
     return {
         "status": "success",
+        "label_id": label_id,
         "label_data": label_data,
         "zpl": zpl,
         "message": f"Label generated for {chem[0]}",
     }
 
 
-def generate_zpl_label(label_data: dict) -> str:
-    """Generate ZPL II code for a GHS label."""
-    name = label_data["product_name"][:40]
-    signal = label_data.get("signal_word", "")
-    cas = label_data.get("cas_number", "")
-    hazards = " ".join(label_data.get("hazard_statements", []))[:300]
-    precautions = " ".join(label_data.get("precautionary_statements", []))[:400]
-    supplier = label_data.get("manufacturer", "")
-    qty = label_data.get("quantity", 1)
-    date = datetime.utcnow().strftime("%Y-%m-%d")
-
-    if label_data.get("label_type") == "secondary":
-        # Small 2×1 secondary container label
-        return f"""^XA
-^CI28
-^FO10,10^A0N,28,28^FD{name}^FS
-^FO10,45^A0N,22,22^FD{signal}^FS
-^FO10,75^FB380,3,0,L^A0N,16,16^FD{hazards[:100]}^FS
-^PQ{qty}
-^XZ"""
-
-    # Full 4×6 GHS label
-    pictogram_list = ", ".join(label_data.get("pictogram_codes", []))
-
-    return f"""^XA
-^CI28
-^CF0,30,30
-
-~DGR:LABEL.GRF,0,0,
-^FO40,40^A0N,50,50^FD{name}^FS
-
-^FO40,110^GB730,55,55,B^FS
-^FO50,115^FR^A0N,42,42^FD{signal}^FS
-
-^FO40,185^A0N,20,20^FDPictograms: {pictogram_list}^FS
-
-^FO40,220^A0N,18,18^FDHazard Statements:^FS
-^FO40,245^FB730,6,0,L^A0N,18,18^FD{hazards}^FS
-
-^FO40,400^A0N,18,18^FDPrecautionary Statements:^FS
-^FO40,425^FB730,8,0,L^A0N,16,16^FD{precautions}^FS
+def printer_kernel() -> str:
+    kernel = read_kernel_file(PRINTER_KERNEL_PATH)
+    if kernel is None:
+        raise HTTPException(status_code=500, detail="Printer drivers kernel not found")
+    return kernel
 
-^FO40,620^A0N,18,18^FDSupplier: {supplier}^FS
-^FO40,650^A0N,16,16^FDCAS: {cas}^FS
-^FO40,675^A0N,14,14^FDGenerated: {date}^FS
 
-^PQ{qty}
-^XZ"""
+def generate_zpl_label(label_data: dict, stored_graphics: bool = False) -> str:
+    """Generate ZPL II code for a GHS label from the printer drivers kernel layouts (see zpl.py).
+    stored_graphics recalls pictograms downloaded with graphic_downloads instead of inlining them."""
+    hazards = label_data.get("hazard_statements", [])
+    fields = {
+        "product_name": label_data["product_name"][:40],
+        "signal_word": label_data.get("signal_word", ""),
+        "cas_number": label_data.get("cas_number", ""),
+        "hazard_statements_joined": " ".join(hazards)[:300],
+        "key_hazards": " ".join(hazards)[:100],
+        "precautionary_statements_joined": " ".join(label_data.get("precautionary_statements", []))[:400],
+        "supplier_name": label_data.get("manufacturer", ""),
+        "quantity": label_data.get("quantity", 1),
+        "date": datetime.utcnow().strftime("%Y-%m-%d"),
+    }
+    try:
+        return render_label(printer_kernel(), label_data.get("label_type", "ghs_primary"),
+                            label_data.get("dpi", BASE_DPI), fields, label_data.get("pictogram_codes", []),
+                            stored=stored_graphics)
+    except TemplateNotFound as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 # ============================================================
 # LABEL PRINTING
 # ============================================================
 
+async def record_print_job(job: PrintJob):
+    """Spooler callback once a job has actually printed: bump print counts on the labels
+    it carried and log label_printed for each chemical."""
+    async with SessionLocal() as db:
+        await set_tenant_context(db, job.tenant_id)
+        await db.execute(text("""
+            UPDATE labels SET print_count = print_count + :qty, last_printed = NOW()
+            WHERE id = ANY(CAST(:ids AS uuid[])) AND tenant_id = :tid
+        """), {"qty": job.meta["quantity"], "ids": job.meta["label_ids"], "tid": job.tenant_id})
+        event_data = {"printer": job.printer, "quantity": job.meta["quantity"], "job_id": job.id}
+        if len(job.meta["chemical_ids"]) > 1:
+            event_data["batch"] = len(job.meta["chemical_ids"])
+        for chemical_id in job.meta["chemical_ids"]:
+            log_event(db, job.tenant_id, chemical_id, "label_printed", event_data, job.meta["user_id"])
+        await commit_with_events(db)
+
+
+def queue_print_job(auth: dict, printer_ip: str, zpl: str, label_ids: list, chemical_ids: list,
+                    quantity: int) -> PrintJob:
+    try:
+        return submit_print_job(
+            printer_ip, zpl, labels=len(label_ids) * quantity, tenant_id=auth["tenant_id"],
+            meta={"label_ids": label_ids, "chemical_ids": chemical_ids, "quantity": quantity,
+                  "user_id": auth["user_id"]},
+            on_complete=record_print_job,
+        )
+    except PrintQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+
 @app.post("/sds/print")
 async def print_label(
     req: PrintRequest,
     auth: dict = Depends(verify_token),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    set_tenant_context(db, auth["tenant_id"])
+    await set_tenant_context(db, auth["tenant_id"])
 
     # Get latest label for this chemical
-    result = db.execute(text("""
-        SELECT zpl_content, label_data FROM labels
+    result = await db.execute(text("""
+        SELECT zpl_content, label_data, id FROM labels
         WHERE chemical_id = :cid AND tenant_id = :tid AND label_type = :ltype
-        ORDER BY created_at DESC LIMIT 1
+        ORDER BY last_generated DESC LIMIT 1
     """), {"cid": req.chemical_id, "tid": auth["tenant_id"], "ltype": req.label_type})
     label = result.fetchone()
 
@@ -745,10 +2570,7 @@ async def print_label(
         raise HTTPException(status_code=404, detail="No ZPL label found. Generate a label first.")
 
     # Get printer IP from request or tenant config
-    printer_ip = req.printer_ip
-    if not printer_ip:
-        config = get_tenant_printer_config(auth["tenant_id"], db)
-        printer_ip = config.get("printer_ip")
+    printer_ip = choose_printer(req.printer_ip, await get_tenant_printer_config(auth["tenant_id"], db))
 
     if not printer_ip or printer_ip == "TBD":
         return {
@@ -757,34 +2579,172 @@ async def print_label(
             "zpl": label[0],
         }
 
-    # Send ZPL to Zebra printer via TCP
+    # Hand the ZPL to the printer's spooler; print_count and the label_printed event
+    # are recorded once the printer reports the job done (see record_print_job)
+    job = queue_print_job(auth, printer_ip, set_quantity(label[0], req.quantity), [str(label[2])],
+                          [req.chemical_id], req.quantity)
+    return {
+        "status": "queued",
+        "job_id": job.id,
+        "message": f"Queued {req.quantity} labels for printer at {printer_ip}",
+    }
+
+
+@app.get("/sds/print/jobs/{job_id}")
+async def get_print_job_status(job_id: str, auth: dict = Depends(verify_token)):
+    job = get_print_job(job_id)
+    if job is None or job.tenant_id != auth["tenant_id"]:
+        raise HTTPException(status_code=404, detail="Print job not found")
+    return job.to_dict()
+
+
+@app.get("/sds/printers/status")
+async def get_printer_status(
+    printer_ip: Optional[str] = None,
+    auth: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_db),
+):
+    """Live ~HS status (paper, head, ribbon, buffered formats) plus the printer's spool queue."""
+    printer_ip = choose_printer(printer_ip, await get_tenant_printer_config(auth["tenant_id"], db))
+    if not printer_ip or printer_ip == "TBD":
+        raise HTTPException(status_code=404, detail="No printer configured")
+    return await printer_status(printer_ip)
+
+
+def parse_label_chemical_ids(chemical_ids: list, location: Optional[str]) -> list:
+    if not chemical_ids and not location:
+        raise HTTPException(status_code=400, detail="Provide chemical_ids or location")
+    if len(chemical_ids) > LABEL_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Label batches are limited to {LABEL_BATCH_MAX} chemicals")
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(5)
-        sock.connect((printer_ip, 9100))
-        sock.sendall(label[0].encode("utf-8"))
-        sock.close()
-
-        # Update print count
-        db.execute(text("""
-            UPDATE labels SET print_count = print_count + :qty, last_printed = NOW()
-            WHERE chemical_id = :cid AND tenant_id = :tid AND label_type = :ltype
-        """), {"qty": req.quantity, "cid": req.chemical_id, "tid": auth["tenant_id"], "ltype": req.label_type})
+        return [str(uuid.UUID(cid)) for cid in chemical_ids]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid chemical id")
 
-        db.execute(text("""
-            INSERT INTO compliance_events (tenant_id, chemical_id, event_type, event_data, created_by)
-            VALUES (:tid, :cid, 'label_printed', :edata, :uid)
-        """), {
-            "tid": auth["tenant_id"], "cid": req.chemical_id,
-            "edata": json.dumps({"printer": printer_ip, "quantity": req.quantity}),
-            "uid": auth["user_id"],
-        })
-        db.commit()
 
-        return {"status": "success", "message": f"Sent {req.quantity} labels to printer at {printer_ip}"}
+async def select_label_chemicals(db: AsyncSession, tenant_id: str, chemical_ids: list, location: Optional[str],
+                                 label_type: str, label_size: str, tver: str) -> list:
+    """LABEL_SOURCE_SQL rows for a list of chemicals or everything stored at a location."""
+    if chemical_ids:
+        where = "WHERE c.tenant_id = :tid AND c.id = ANY(CAST(:ids AS uuid[]))"
+        params = {"tid": tenant_id, "ids": chemical_ids}
+    else:
+        where = """WHERE c.tenant_id = :tid AND (c.location = :loc OR EXISTS (
+            SELECT 1 FROM chemical_locations cl WHERE cl.chemical_id = c.id AND cl.location_name = :loc))"""
+        params = {"tid": tenant_id, "loc": location}
+    chems = (await db.execute(text(LABEL_SOURCE_SQL + where + " ORDER BY c.chemical_name LIMIT :limit"), {
+        **params, "limit": LABEL_BATCH_MAX + 1, "ltype": label_type, "lsize": label_size, "tver": tver,
+    })).fetchall()
+    if not chems:
+        raise HTTPException(status_code=404, detail="No matching chemicals found")
+    if len(chems) > LABEL_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Label batches are limited to {LABEL_BATCH_MAX} chemicals")
+    return chems
+
+
+@app.post("/sds/labels/batch")
+async def generate_label_batch(
+    req: LabelBatchRequest,
+    auth: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_db),
+):
+    """Labels for many chemicals at once -- a list of ids or everything at a location.
+    One query for the label content, one multi-row insert, and with print=true a single
+    concatenated ZPL job on the printer's spooler instead of one job per label."""
+    chemical_ids = parse_label_chemical_ids(req.chemical_ids, req.location)
+    await set_tenant_context(db, auth["tenant_id"])
+    printer_config = await get_tenant_printer_config(auth["tenant_id"], db)
+    printer_ip = choose_printer(req.printer_ip, printer_config) if req.print else None
+    dpi = label_dpi(printer_config)
+    tver = label_template_version(dpi)
+    chems = await select_label_chemicals(db, auth["tenant_id"], chemical_ids, req.location, req.label_type,
+                                         req.label_size, tver)
+
+    # Reuse what is already rendered, render the rest in one pass and store it in one statement
+    labels, reused = await resolve_labels(db, auth["tenant_id"], chems, req.label_type, req.label_size,
+                                          req.quantity, dpi, tver)
+    zpl_job = "\n".join(zpl for _, _, _, zpl in labels if zpl)
+    for _, cid, _, _ in labels:
+        log_event(db, auth["tenant_id"], cid, "label_generated",
+                  {"label_type": req.label_type, "quantity": req.quantity, "batch": len(labels)}, auth["user_id"])
+    await commit_with_events(db)
+
+    status, message, job = "success", f"Generated {len(labels)} labels", None
+    if reused:
+        message += f" ({reused} unchanged since their last render)"
+    if req.print:
+        if not zpl_job:
+            status, message = "warning", f"{req.label_type} labels have no ZPL output"
+        elif not printer_ip or printer_ip == "TBD":
+            status, message = "warning", "No printer configured. Download ZPL manually."
+        else:
+            # Each distinct pictogram goes to the printer once (~DG) and every label recalls it by name
+            printable = [(label_id, cid, label_data) for label_id, cid, label_data, zpl in labels if zpl]
+            codes = {code for _, _, label_data in printable for code in label_data["pictogram_codes"][:4]}
+            print_job = "\n".join(
+                graphic_downloads(printer_kernel(), req.label_type, dpi, codes)
+                + [generate_zpl_label(label_data, stored_graphics=True) for _, _, label_data in printable]
+            )
+            job = queue_print_job(auth, printer_ip, print_job, [p[0] for p in printable], [p[1] for p in printable],
+                                  req.quantity)
+            status, message = "queued", message + f", queued as one job for printer at {printer_ip}"
+
+    found = {cid for _, cid, _, _ in labels}
+    return {
+        "status": status,
+        "count": len(labels),
+        "reused": reused,
+        "labels": [{"chemical_id": cid, "product_name": d["product_name"]} for _, cid, d, _ in labels],
+        "missing": [cid for cid in chemical_ids if cid not in found],
+        "job_id": job.id if job else None,
+        "message": message,
+        "zpl": None if job else zpl_job or None,
+    }
 
-    except (socket.error, socket.timeout) as e:
-        return {"status": "error", "message": f"Printer connection failed: {str(e)}", "zpl": label[0]}
+@app.post("/sds/labels/pdf")
+async def generate_label_pdf(
+    req: LabelPdfRequest,
+    auth: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_db),
+):
+    """PDF labels for standard printers: one per page at label size (PDF-driven label printers)
+    or multi-up on Letter/A4 sheets, e.g. 30-up 2x1 secondary labels. Label content is the same
+    stored label_data /sds/label uses; drawing runs in the PDF worker pool."""
+    try:
+        layout = resolve_layout(req.label_type, req.label_size, req.layout)
+    except LabelLayoutError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if req.flow_direction not in ("right", "left", "both"):
+        raise HTTPException(status_code=400, detail="flow_direction must be right, left or both")
+    if req.quantity < 1:
+        raise HTTPException(status_code=400, detail="quantity must be at least 1")
+    chemical_ids = parse_label_chemical_ids(req.chemical_ids, req.location)
+    await set_tenant_context(db, auth["tenant_id"])
+    dpi = label_dpi(await get_tenant_printer_config(auth["tenant_id"], db))
+    tver = label_template_version(dpi)
+    chems = await select_label_chemicals(db, auth["tenant_id"], chemical_ids, req.location, req.label_type,
+                                         req.label_size, tver)
+    if len(chems) * req.quantity > LABEL_PDF_MAX:
+        raise HTTPException(status_code=413, detail=f"Label PDFs are limited to {LABEL_PDF_MAX} labels")
+
+    labels, _ = await resolve_labels(db, auth["tenant_id"], chems, req.label_type, req.label_size,
+                                     req.quantity, dpi, tver)
+    for _, cid, _, _ in labels:
+        log_event(db, auth["tenant_id"], cid, "label_generated",
+                  {"label_type": req.label_type, "quantity": req.quantity, "format": "pdf", "layout": layout},
+                  auth["user_id"])
+    await commit_with_events(db)
+
+    label_data = [{**data, "flow_direction": req.flow_direction} for _, _, data, _ in labels]
+    try:
+        pdf_bytes = await run_pdf(render_labels_pdf, label_data, layout, req.quantity)
+    except LabelLayoutError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filename = f"labels_{req.label_type}_{datetime.utcnow().strftime('%Y%m%d')}.pdf"
+    return Response(
+        content=pdf_bytes, media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 # ============================================================
 # EMERGENCY QUICK REFERENCE
@@ -794,18 +2754,15 @@ async def print_label(
 async def emergency_reference(
     chemical_id: str,
     auth: dict = Depends(verify_token),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    set_tenant_context(db, auth["tenant_id"])
+    await set_tenant_context(db, auth["tenant_id"])
 
-    result = db.execute(text("""
+    result = await db.execute(text("""
         SELECT c.chemical_name, c.cas_number, c.signal_word,
                sd.extracted_data
         FROM chemicals c
-        LEFT JOIN LATERAL (
-            SELECT extracted_data FROM sds_documents
-            WHERE chemical_id = c.id ORDER BY upload_date DESC LIMIT 1
-        ) sd ON true
+        LEFT JOIN sds_documents sd ON sd.id = c.latest_sds_document_id
         WHERE c.id = :cid AND c.tenant_id = :tid
     """), {"cid": chemical_id, "tid": auth["tenant_id"]})
     chem = result.fetchone()
@@ -813,7 +2770,7 @@ async def emergency_reference(
     if not chem:
         raise HTTPException(status_code=404, detail="Chemical not found")
 
-    sds_data = json.loads(chem[3]) if chem[3] else {}
+    sds_data = _jsonb(chem[3]) or {}
     sections = sds_data.get("sections", {})
 
     # Direct from parsed data — no AI call needed
@@ -836,11 +2793,11 @@ async def emergency_reference(
 @app.get("/sds/compatibility")
 async def check_compatibility(
     auth: dict = Depends(verify_token),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    set_tenant_context(db, auth["tenant_id"])
+    await set_tenant_context(db, auth["tenant_id"])
 
-    result = db.execute(text("""
+    result = await db.execute(text("""
         SELECT c.id, c.chemical_name, c.storage_class, c.location, c.signal_word, c.hazard_class
         FROM chemicals c
         WHERE c.tenant_id = :tid AND c.location IS NOT NULL AND c.location != ''
@@ -883,56 +2840,132 @@ async def check_compatibility(
 # CHEMICALS MANAGEMENT
 # ============================================================
 
+# Listing columns: field -> select expression. The latest-SDS fields join sds_documents
+# through chemicals.latest_sds_document_id; the rest read the chemicals row only.
+CHEMICAL_FIELDS = {
+    "id": "c.id", "chemical_name": "c.chemical_name", "cas_number": "c.cas_number",
+    "manufacturer": "c.manufacturer", "product_code": "c.product_code", "signal_word": "c.signal_word",
+    "hazard_class": "c.hazard_class", "storage_class": "c.storage_class", "location": "c.location",
+    "quantity": "c.quantity", "unit": "c.unit", "critical": "c.critical", "has_sds": "c.has_sds",
+    "sds_revision_date": "c.sds_revision_date", "status": "c.status", "notes": "c.notes",
+    "latest_sds_file": "sd.file_name", "sections_complete": "sd.sections_complete",
+}
+LATEST_SDS_FIELDS = {"latest_sds_file", "sections_complete"}
+CHEMICALS_PAGE_DEFAULT = 100
+CHEMICALS_PAGE_MAX = 500
+
+
+def encode_chemicals_cursor(name: str, chemical_id) -> str:
+    return base64.urlsafe_b64encode(json.dumps([name, str(chemical_id)]).encode()).decode().rstrip("=")
+
+
+def decode_chemicals_cursor(cursor: str) -> tuple:
+    try:
+        name, chemical_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(name), str(uuid.UUID(chemical_id))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _chemical_value(value):
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, date):
+        return str(value)
+    return value
+
+
 @app.get("/sds/chemicals")
 async def list_chemicals(
+    request: Request,
+    limit: int = CHEMICALS_PAGE_DEFAULT,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    storage_class: Optional[str] = None,
+    location: Optional[str] = None,
+    critical: Optional[bool] = None,
+    has_sds: Optional[bool] = None,
+    q: Optional[str] = None,
+    fields: Optional[str] = None,
     auth: dict = Depends(verify_token),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    set_tenant_context(db, auth["tenant_id"])
-
-    result = db.execute(text("""
-        SELECT c.id, c.chemical_name, c.cas_number, c.manufacturer, c.product_code,
-               c.signal_word, c.hazard_class, c.storage_class, c.location,
-               c.quantity, c.unit, c.critical, c.has_sds, c.sds_revision_date,
-               c.status, c.notes,
-               sd.file_name AS latest_sds_file,
-               sd.sections_complete
-        FROM chemicals c
-        LEFT JOIN LATERAL (
-            SELECT file_name, sections_complete FROM sds_documents
-            WHERE chemical_id = c.id ORDER BY upload_date DESC LIMIT 1
-        ) sd ON true
-        WHERE c.tenant_id = :tid
-        ORDER BY c.chemical_name
-    """), {"tid": auth["tenant_id"]})
-
+    """One page of the registry in (chemical_name, id) order. Pass next_cursor back as
+    ?cursor= for the following page; total is counted on the first page only.
+    Pages carry an ETag tied to the tenant's registry version, so an unchanged
+    page answers If-None-Match with 304 before any rows are read."""
+    await set_tenant_context(db, auth["tenant_id"])
+    limit = max(1, min(limit, CHEMICALS_PAGE_MAX))
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(CHEMICAL_FIELDS)
+    unknown = [f for f in selected if f not in CHEMICAL_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    if "id" not in selected:
+        selected.insert(0, "id")
+
+    version = await get_registry_version(db, auth["tenant_id"])
+    query_key = json.dumps([str(auth["tenant_id"]), limit, cursor, status, storage_class, location,
+                            critical, has_sds, q, selected])
+    etag = f'W/"{version}-{hashlib.sha1(query_key.encode()).hexdigest()[:16]}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in (request.headers.get("if-none-match") or ""):
+        return Response(status_code=304, headers=cache_headers)
+
+    where = ["c.tenant_id = :tid"]
+    params = {"tid": auth["tenant_id"]}
+    for column, value in (("status", status), ("storage_class", storage_class), ("location", location),
+                          ("critical", critical), ("has_sds", has_sds)):
+        if value is not None:
+            where.append(f"c.{column} = :{column}")
+            params[column] = value
+    if q:
+        where.append("(c.chemical_name ILIKE :q OR c.cas_number ILIKE :q "
+                     "OR c.manufacturer ILIKE :q OR c.product_code ILIKE :q)")
+        params["q"] = "%" + re.sub(r"([\\%_])", r"\\\1", q.strip()) + "%"
+
+    total = None
+    if cursor is None:
+        total = (await db.execute(text(f"SELECT COUNT(*) FROM chemicals c WHERE {' AND '.join(where)}"), params)).scalar()
+    else:
+        params["after_name"], params["after_id"] = decode_chemicals_cursor(cursor)
+        where.append("(c.chemical_name, c.id) > (:after_name, CAST(:after_id AS uuid))")
+
+    latest_join = ""
+    if LATEST_SDS_FIELDS.intersection(selected):
+        latest_join = """
+        LEFT JOIN sds_documents sd ON sd.id = c.latest_sds_document_id"""
+    columns = ", ".join(CHEMICAL_FIELDS[f] for f in selected)
+    params["limit"] = limit + 1
+    result = await db.execute(text(f"""
+        SELECT {columns}, c.chemical_name AS sort_name
+        FROM chemicals c{latest_join}
+        WHERE {' AND '.join(where)}
+        ORDER BY c.chemical_name, c.id
+        LIMIT :limit
+    """), params)
     rows = result.fetchall()
-    return {
-        "chemicals": [
-            {
-                "id": str(r[0]), "chemical_name": r[1], "cas_number": r[2],
-                "manufacturer": r[3], "product_code": r[4], "signal_word": r[5],
-                "hazard_class": r[6], "storage_class": r[7], "location": r[8],
-                "quantity": r[9], "unit": r[10], "critical": r[11],
-                "has_sds": r[12], "sds_revision_date": str(r[13]) if r[13] else None,
-                "status": r[14], "notes": r[15],
-                "latest_sds_file": r[16], "sections_complete": r[17],
-            }
-            for r in rows
-        ],
-        "total": len(rows),
-    }
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_chemicals_cursor(rows[-1][-1], rows[-1][0])
+
+    return JSONResponse({
+        "chemicals": [{f: _chemical_value(v) for f, v in zip(selected, r)} for r in rows],
+        "next_cursor": next_cursor,
+        "total": total,
+    }, headers=cache_headers)
 
 
 @app.post("/sds/chemicals")
 async def add_chemical(
     chem: ChemicalCreate,
     auth: dict = Depends(verify_token),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    set_tenant_context(db, auth["tenant_id"])
+    await set_tenant_context(db, auth["tenant_id"])
 
-    db.execute(text("""
+    await db.execute(text("""
         INSERT INTO chemicals
         (tenant_id, chemical_name, cas_number, manufacturer, product_code,
          storage_class, location, quantity, unit, critical)
@@ -944,7 +2977,7 @@ async def add_chemical(
         "loc": chem.location, "qty": chem.quantity,
         "unit": chem.unit, "crit": chem.critical,
     })
-    db.commit()
+    await db.commit()
 
     return {"status": "success", "message": f"Chemical {chem.chemical_name} added."}
 
@@ -952,33 +2985,25 @@ async def add_chemical(
 # EVIDENCE PACKAGE / DOWNLOAD
 # ============================================================
 
-@app.post("/sds/download")
-async def generate_evidence(
-    req: DownloadRequest,
-    auth: dict = Depends(verify_token),
-    db: Session = Depends(get_db),
-):
-    set_tenant_context(db, auth["tenant_id"])
-
-    where_clause = ""
-    if req.evidence_type == "expired":
-        where_clause = "AND c.status = 'expired'"
-    elif req.evidence_type == "missing":
-        where_clause = "AND c.has_sds = false"
-    elif req.evidence_type == "current":
-        where_clause = "AND c.status = 'current'"
+async def build_evidence_prompt(db: AsyncSession, tenant_id: str, evidence_type: str) -> tuple:
+    """Select the evidence records for a report type; returns (records, prompt)."""
+    snapshot = await get_registry_snapshot(db, tenant_id)
+    if evidence_type == "expired":
+        keep = lambda r: r[6] == "expired"
+    elif evidence_type == "missing":
+        keep = lambda r: r[8] is False
+    elif evidence_type == "current":
+        keep = lambda r: r[6] == "current"
+    else:
+        keep = lambda r: True
 
-    result = db.execute(text(f"""
-        SELECT c.chemical_name, c.cas_number, c.signal_word, c.hazard_class,
-               c.storage_class, c.location, c.status, c.critical, c.has_sds,
-               c.sds_revision_date
-        FROM chemicals c
-        WHERE c.tenant_id = :tid {where_clause}
-        ORDER BY c.storage_class, c.chemical_name
-    """), {"tid": auth["tenant_id"]})
-    records = result.fetchall()
+    # Snapshot rows are in chemical_name order; a stable sort groups them by storage class
+    selected = sorted(
+        (i for i, r in enumerate(snapshot["records"]) if keep(r)),
+        key=lambda i: (snapshot["records"][i][4] is None, snapshot["records"][i][4] or ""),
+    )
+    records = [snapshot["records"][i][:10] for i in selected]
 
-    kernel = load_agent_kernel(db, auth["tenant_id"])
     prompt = f"""Generate an SDS compliance audit evidence summary.
 Include:
 - Executive summary of chemical safety program health
@@ -986,24 +3011,31 @@ Include:
 - Storage compliance issues
 - Recommendations by priority
 
-Evidence type: {req.evidence_type}
+Evidence type: {evidence_type}
 Total chemicals: {len(records)}
 
 Chemicals:
-""" + "\n".join([
-        f"- {r[0]} (CAS: {r[1] or 'N/A'}, Signal: {r[2] or 'None'}, Class: {r[3] or 'N/A'}, "
-        f"Storage: {r[4]}, Location: {r[5] or 'N/A'}, Status: {r[6]}, Critical: {r[7]}, "
-        f"Has SDS: {r[8]}, Rev Date: {r[9] or 'N/A'})"
-        for r in records
-    ])
+""" + "\n".join(snapshot["evidence_lines"][i] for i in selected)
+    return records, prompt
 
-    agent_response = call_agent(kernel, prompt)
-    log_tokens(db, auth["tenant_id"], auth["user_id"], "download", agent_response)
-    db.commit()
+
+@app.post("/sds/download")
+async def generate_evidence(
+    req: DownloadRequest,
+    auth: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_db),
+):
+    await set_tenant_context(db, auth["tenant_id"])
+
+    records, prompt = await build_evidence_prompt(db, auth["tenant_id"], req.evidence_type)
+    kernel = await load_agent_kernel(db, auth["tenant_id"])
+
+    agent_response = await call_agent(kernel, prompt, tenant_id=auth["tenant_id"])
+    record_tokens(auth["tenant_id"], auth["user_id"], "download", agent_response)
 
     if req.format == "pdf":
-        branding = load_tenant_branding(db, auth["tenant_id"])
-        pdf_bytes = generate_sds_evidence_pdf(branding, records, req.evidence_type, agent_response["text"])
+        branding = await load_tenant_branding(db, auth["tenant_id"])
+        pdf_bytes = await run_pdf(render_evidence_pdf, branding, records, req.evidence_type, agent_response["text"])
         filename = f"sds_evidence_{req.evidence_type}_{datetime.utcnow().strftime('%Y%m%d')}.pdf"
         return Response(
             content=pdf_bytes, media_type="application/pdf",
@@ -1018,97 +3050,33 @@ Chemicals:
     }
 
 
-def generate_sds_evidence_pdf(branding: dict, records: list, evidence_type: str, ai_summary: str) -> bytes:
-    """Generate branded SDS compliance PDF."""
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib.units import inch
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.colors import HexColor
-    from reportlab.lib.enums import TA_CENTER
-
-    buf = io.BytesIO()
-    doc = SimpleDocTemplate(buf, pagesize=letter, topMargin=0.75*inch, bottomMargin=0.75*inch)
-    primary = HexColor(branding["primary_color"])
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle("BrandTitle", parent=styles["Title"], textColor=primary, fontSize=22, spaceAfter=6))
-    styles.add(ParagraphStyle("BrandSub", parent=styles["Normal"], textColor=primary, fontSize=11, spaceAfter=12))
-    styles.add(ParagraphStyle("SHead", parent=styles["Heading2"], textColor=primary, fontSize=14, spaceBefore=16, spaceAfter=8))
-    styles.add(ParagraphStyle("Foot", parent=styles["Normal"], textColor=HexColor("#888888"), fontSize=8, alignment=TA_CENTER))
-
-    elements = []
-
-    if branding.get("logo_path") and Path(branding["logo_path"]).exists():
-        logo = Image(branding["logo_path"], width=2*inch, height=1*inch)
-        logo.hAlign = "LEFT"
-        elements.append(logo)
-        elements.append(Spacer(1, 12))
-
-    elements.append(Paragraph("SDS Compliance Evidence Package", styles["BrandTitle"]))
-    elements.append(Paragraph(branding["company_name"], styles["BrandSub"]))
-    for line in branding.get("address_lines", []):
-        elements.append(Paragraph(line, styles["Normal"]))
-    elements.append(Spacer(1, 20))
-
-    total = len(records)
-    current = sum(1 for r in records if r[6] == "current")
-    expired = sum(1 for r in records if r[6] == "expired")
-    missing = sum(1 for r in records if not r[8])
-    compliance = f"{(current / total * 100):.1f}%" if total > 0 else "N/A"
-
-    cover = Table([
-        ["Report Type", evidence_type.replace("_", " ").title()],
-        ["Generated", datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")],
-        ["Total Chemicals", str(total)],
-        ["SDS Compliance Rate", compliance],
-        ["Current SDS", str(current)],
-        ["Expired SDS", str(expired)],
-        ["Missing SDS", str(missing)],
-    ], colWidths=[2*inch, 3*inch])
-    cover.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (0, -1), primary),
-        ("TEXTCOLOR", (0, 0), (0, -1), HexColor("#FFFFFF")),
-        ("FONTSIZE", (0, 0), (-1, -1), 10),
-        ("PADDING", (0, 0), (-1, -1), 8),
-        ("GRID", (0, 0), (-1, -1), 0.5, HexColor("#CCCCCC")),
-    ]))
-    elements.append(cover)
-    elements.append(Spacer(1, 20))
-
-    elements.append(Paragraph("Executive Summary", styles["SHead"]))
-    for para in ai_summary.split("\n\n"):
-        clean = re.sub(r'[#*]+\s*', '', para.strip())
-        clean = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', clean)
-        if clean:
-            elements.append(Paragraph(clean, styles["Normal"]))
-            elements.append(Spacer(1, 6))
-
-    if records:
-        elements.append(Spacer(1, 12))
-        elements.append(Paragraph("Chemical Inventory", styles["SHead"]))
-        header = ["Chemical", "CAS#", "Signal", "Hazard", "Storage", "Location", "Status"]
-        table_data = [header]
-        for r in records:
-            table_data.append([
-                str(r[0])[:25], str(r[1] or ""), str(r[2] or ""),
-                str(r[3] or "")[:15], str(r[4] or ""), str(r[5] or ""),
-                str(r[6] or "").replace("_", " ").title(),
-            ])
-        t = Table(table_data, repeatRows=1)
-        t.setStyle(TableStyle([
-            ("BACKGROUND", (0, 0), (-1, 0), primary),
-            ("TEXTCOLOR", (0, 0), (-1, 0), HexColor("#FFFFFF")),
-            ("FONTSIZE", (0, 0), (-1, -1), 7),
-            ("PADDING", (0, 0), (-1, -1), 4),
-            ("GRID", (0, 0), (-1, -1), 0.5, HexColor("#CCCCCC")),
-            ("ROWBACKGROUNDS", (0, 1), (-1, -1), [HexColor("#FFFFFF"), HexColor("#F5F5F5")]),
-        ]))
-        elements.append(t)
-
-    elements.append(Spacer(1, 30))
-    elements.append(Paragraph(branding.get("report_footer", ""), styles["Foot"]))
-    doc.build(elements)
-    return buf.getvalue()
+@app.post("/sds/download/stream")
+async def generate_evidence_stream(
+    req: DownloadRequest,
+    auth: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_db),
+):
+    """Streams the evidence summary text as server-sent events (the PDF still uses /sds/download)."""
+    await set_tenant_context(db, auth["tenant_id"])
+    tenant_id, user_id = auth["tenant_id"], auth["user_id"]
+
+    records, prompt = await build_evidence_prompt(db, tenant_id, req.evidence_type)
+    kernel = await load_agent_kernel(db, tenant_id)
+
+    async def on_complete(agent_response: dict):
+        record_tokens(tenant_id, user_id, "download", agent_response)
+
+    def on_partial(agent_response: dict):
+        record_tokens(tenant_id, user_id, "download", agent_response)
+
+    async def body():
+        yield sse_event({"record_count": len(records), "generated_at": datetime.utcnow().isoformat()})
+        async with aclosing(stream_agent_sse(kernel, prompt, "", on_complete, tenant_id, on_partial)) as events:
+            async for event in events:
+                yield event
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 
 # ============================================================
 # LOGO UPLOAD
@@ -1118,87 +3086,105 @@ def generate_sds_evidence_pdf(branding: dict, records: list, evidence_type: str,
 async def upload_logo(
     file: UploadFile = File(...),
     auth: dict = Depends(verify_token),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     if auth["role"] != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
 
-    result = db.execute(text("SELECT tenant_slug FROM tenants WHERE id = :tid"), {"tid": auth["tenant_id"]})
-    tenant = result.fetchone()
-    if not tenant:
+    compiled = await get_tenant_kernel(db, auth["tenant_id"])
+    if not compiled["tenant_found"]:
         raise HTTPException(status_code=404)
 
-    slug = tenant[0]
+    slug = compiled["tenant_slug"]
     logo_dir = Path(f"/app/uploads/tenants/{slug}")
     logo_dir.mkdir(parents=True, exist_ok=True)
 
-    kernel_path = Path(f"/app/kernels/tenants/{slug}-sds.ttc.md")
-    logo_filename = "bunting-logo.png"
-    if kernel_path.exists():
-        match = re.search(r'logo_file\s*:=\s*(\S+)', kernel_path.read_text())
-        if match:
-            logo_filename = match.group(1)
+    logo_filename = compiled["branding"].get("logo_file") or "bunting-logo.png"
 
-    (logo_dir / logo_filename).write_bytes(await file.read())
+    # Stream to a temp file beside the logo, then swap it in: label renders never see a partial image
+    tmp = logo_dir / f".upload-{uuid.uuid4()}"
+    await save_upload(file, tmp, LOGO_UPLOAD_MAX_BYTES)
+    await asyncio.to_thread(os.replace, tmp, logo_dir / logo_filename)
     return {"status": "success", "message": f"Logo uploaded as {logo_filename}"}
 
 # ============================================================
 # DASHBOARD
 # ============================================================
 
-@app.get("/sds/dashboard")
-async def dashboard(
-    auth: dict = Depends(verify_token),
-    db: Session = Depends(get_db),
-):
-    set_tenant_context(db, auth["tenant_id"])
+_dashboard_cache: dict = {}  # tenant_id -> (expires at, response)
+_dashboard_locks: dict = {}  # tenant_id -> asyncio.Lock, so concurrent misses build once
 
-    chem_count = db.execute(text(
-        "SELECT COUNT(*) FROM chemicals WHERE tenant_id = :tid"
-    ), {"tid": auth["tenant_id"]}).scalar()
 
-    status_counts = db.execute(text("""
-        SELECT status, COUNT(*) FROM chemicals
-        WHERE tenant_id = :tid GROUP BY status
-    """), {"tid": auth["tenant_id"]}).fetchall()
+def _counter_key(value: str):
+    return None if value == "none" else value
 
-    hazard_counts = db.execute(text("""
-        SELECT storage_class, COUNT(*) FROM chemicals
-        WHERE tenant_id = :tid GROUP BY storage_class
-    """), {"tid": auth["tenant_id"]}).fetchall()
 
-    label_count = db.execute(text("""
-        SELECT COUNT(*), COALESCE(SUM(print_count), 0) FROM labels
-        WHERE tenant_id = :tid
-    """), {"tid": auth["tenant_id"]}).fetchone()
+async def build_dashboard(db: AsyncSession, tenant_id: str) -> dict:
+    # Activity and usage below read the event tables. This tenant's queued events are not
+    # flushed here (that would write every tenant's buffer on this request's clock): wake the
+    # writer instead, and they show up once it has run and this cache entry expires.
+    if _event_wakeup is not None and (pending_events("compliance_events", tenant_id)
+                                      or pending_events("token_usage", tenant_id)):
+        _event_wakeup.set()
+    await set_tenant_context(db, tenant_id)
 
-    token_usage = db.execute(text("""
-        SELECT COALESCE(SUM(input_tokens + output_tokens), 0), COALESCE(SUM(cost), 0)
-        FROM token_usage WHERE tenant_id = :tid
-        AND timestamp >= DATE_TRUNC('month', CURRENT_DATE)
-    """), {"tid": auth["tenant_id"]}).fetchone()
+    # Counts come from the trigger-maintained rollup rows (tenant_counters), not aggregates
+    counters = (await db.execute(text("""
+        SELECT counter, value, to_char(CURRENT_DATE, 'YYYY-MM') FROM tenant_counters
+        WHERE tenant_id = :tid
+    """), {"tid": tenant_id})).fetchall()
+    values = {r[0]: r[1] for r in counters}
+    month = counters[0][2] if counters else ""
+    count = lambda name: int(values.get(name, 0))
 
-    events = db.execute(text("""
+    events = (await db.execute(text("""
         SELECT ce.event_type, ce.event_data, ce.created_at, c.chemical_name
         FROM compliance_events ce
         LEFT JOIN chemicals c ON ce.chemical_id = c.id
         WHERE ce.tenant_id = :tid
         ORDER BY ce.created_at DESC LIMIT 10
-    """), {"tid": auth["tenant_id"]}).fetchall()
+    """), {"tid": tenant_id})).fetchall()
 
     return {
-        "chemical_count": chem_count,
-        "status_summary": {r[0]: r[1] for r in status_counts},
-        "hazard_summary": {r[0]: r[1] for r in hazard_counts},
-        "labels_generated": label_count[0] if label_count else 0,
-        "labels_printed": label_count[1] if label_count else 0,
-        "token_usage": {"tokens": token_usage[0], "cost": float(token_usage[1])},
+        "chemical_count": count("chemicals"),
+        "status_summary": {_counter_key(k[7:]): int(v) for k, v in values.items() if k.startswith("status:") and v},
+        "hazard_summary": {_counter_key(k[8:]): int(v) for k, v in values.items() if k.startswith("storage:") and v},
+        "labels_generated": count("labels_generated"),
+        "labels_printed": count("labels_printed"),
+        "token_usage": {
+            "tokens": count(f"usage_tokens:{month}"), "cost": float(values.get(f"usage_cost:{month}", 0)),
+            "requests": count(f"usage_requests:{month}"), "cached_requests": count(f"usage_cached:{month}"),
+            "remaining": await tokens_remaining(tenant_id),
+        },
         "recent_events": [
-            {"type": r[0], "data": r[1], "timestamp": r[2].isoformat(), "chemical": r[3]}
+            {"type": r[0], "data": _jsonb(r[1]), "timestamp": r[2].isoformat(), "chemical": r[3]}
             for r in events
         ],
     }
 
+
+@app.get("/sds/dashboard")
+async def dashboard(
+    auth: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_db),
+):
+    tenant_id = str(auth["tenant_id"])
+    cached = _dashboard_cache.get(tenant_id)
+    if cached and cached[0] > datetime.utcnow().timestamp():
+        metrics["dashboard_cache_hits"] += 1
+        return cached[1]
+
+    async with _dashboard_locks.setdefault(tenant_id, asyncio.Lock()):
+        cached = _dashboard_cache.get(tenant_id)
+        if cached and cached[0] > datetime.utcnow().timestamp():
+            metrics["dashboard_cache_hits"] += 1
+            return cached[1]
+        metrics["dashboard_cache_misses"] += 1
+        response = await build_dashboard(db, tenant_id)
+        if DASHBOARD_CACHE_TTL > 0:
+            _dashboard_cache[tenant_id] = (datetime.utcnow().timestamp() + DASHBOARD_CACHE_TTL, response)
+        return response
+
 # ============================================================
 # HEALTH
 # ============================================================
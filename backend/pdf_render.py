@@ -0,0 +1,519 @@
+"""
+PDF rendering (ReportLab) in a pre-warmed process pool.
+GHS labels (4x6 primary, 2x1 secondary, pipe markers) are drawn straight from
+the label_data dicts /sds/label stores, one per page for PDF-driven label
+printers or multi-up on Letter/A4 sheets for laser printers, and the audit
+evidence report is built here too. Worker processes import ReportLab, build
+paragraph styles, register fonts and load pictogram artwork once, in the pool
+initializer; the API process only ships dicts in and PDF bytes out, so a
+30-up sheet never holds the event loop or the GIL.
+
+Usage:
+    await start_pdf_pool()                                   # app startup: spawn + warm workers
+    pdf = await run_pdf(render_labels_pdf, [label_data, ...], "letter-30", 1)
+    pdf = await run_pdf(render_evidence_pdf, branding, records, "all", summary)
+    await close_pdf_pool()
+"""
+import io
+import os
+import re
+import time
+import asyncio
+import logging
+import multiprocessing
+from pathlib import Path
+from datetime import datetime
+from collections import Counter
+from functools import lru_cache
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.units import inch
+from reportlab.lib.pagesizes import letter, A4, landscape
+from reportlab.lib.colors import HexColor, black, white
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image, KeepInFrame
+
+logger = logging.getLogger("sds")
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_FONT_PATH = os.getenv("PDF_FONT_PATH", "")  # optional TTF for names outside Latin-1 (e.g. DejaVuSans.ttf)
+PICTOGRAM_DIR = Path(os.getenv("PICTOGRAM_DIR", "/app/kernels/pictograms"))
+
+GHS_RED = HexColor("#E3000F")
+# ANSI/ASME A13.1 pipe marker colours (printerdrivers kernel): (background, text)
+PIPE_COLORS = {
+    "flammable": (HexColor("#FFD100"), black),  # flammable / oxidizer
+    "toxic": (HexColor("#FF8200"), black),  # toxic / corrosive
+    "other": (HexColor("#00843D"), white),
+}
+PIPE_HAZARDS = {"GHS02": "flammable", "GHS03": "flammable", "GHS05": "toxic", "GHS06": "toxic"}
+
+# Sheet layouts: page size, grid (None = as many as fit), cell size, margins, gaps, cut marks
+SHEETS = {
+    "letter": {"page": letter, "margin": (0.25 * inch, 0.25 * inch), "gap": (0, 0), "cut_marks": True},
+    "a4": {"page": A4, "margin": (0.25 * inch, 0.25 * inch), "gap": (0, 0), "cut_marks": True},
+    # Avery 5160-compatible: 3 x 10 die-cut 2.625" x 1" labels
+    "letter-30": {"page": letter, "grid": (3, 10), "cell": (2.625 * inch, 1 * inch),
+                  "margin": (0.1875 * inch, 0.5 * inch), "gap": (0.125 * inch, 0), "cut_marks": False},
+}
+LAYOUTS = ("auto", "label") + tuple(SHEETS)
+
+metrics: Counter = Counter()
+_pool: Optional[ProcessPoolExecutor] = None
+_font = {"regular": "Helvetica", "bold": "Helvetica-Bold"}
+_styles: dict = {}
+
+
+class LabelLayoutError(ValueError):
+    pass
+
+
+# ---------- worker setup (runs once per process) ----------
+
+def init_worker():
+    """Pool initializer: fonts, paragraph styles and pictogram artwork, loaded once per worker."""
+    if PDF_FONT_PATH and Path(PDF_FONT_PATH).exists():
+        pdfmetrics.registerFont(TTFont("LabelFont", PDF_FONT_PATH))
+        _font["regular"] = _font["bold"] = "LabelFont"
+    _styles.update(_label_styles())
+    for path in PICTOGRAM_DIR.glob("GHS*.png") if PICTOGRAM_DIR.is_dir() else ():
+        _pictogram_image(path.stem)
+
+
+def warm() -> int:
+    """Render a throwaway label so the first real request finds everything imported and cached."""
+    render_labels_pdf([{"product_name": "warm-up", "label_type": "secondary", "label_size": "2x1",
+                        "pictogram_codes": ["GHS07"]}], "label", 1)
+    return os.getpid()
+
+
+def _label_styles() -> dict:
+    base = getSampleStyleSheet()["Normal"]
+    return {size: ParagraphStyle(f"Label{size}", parent=base, fontName=_font["regular"], fontSize=size,
+                                 leading=size * 1.15)
+            for size in (5, 6, 7, 8, 9)}
+
+
+@lru_cache(maxsize=32)
+def _pictogram_image(code: str) -> Optional[ImageReader]:
+    path = PICTOGRAM_DIR / f"{code}.png"
+    return ImageReader(str(path)) if path.exists() else None
+
+
+# ---------- label drawing ----------
+
+def _parse_size(label_size: str) -> tuple:
+    try:
+        w, h = (float(v) for v in label_size.lower().split("x"))
+    except ValueError:
+        raise LabelLayoutError(f"Invalid label size '{label_size}' (expected WxH in inches, e.g. 4x6)")
+    if not (0.5 <= w <= 12 and 0.5 <= h <= 12):
+        raise LabelLayoutError(f"Label size '{label_size}' out of range")
+    return w * inch, h * inch
+
+
+def _fit_text(c, text: str, font: str, size: float, max_width: float, min_size: float = 5) -> float:
+    """Largest font size <= size at which text fits max_width."""
+    width = c.stringWidth(text, font, size)
+    if width > max_width:
+        size = max(min_size, size * max_width / width)
+    return size
+
+
+def _pictogram(c, code: str, x: float, y: float, size: float):
+    """One GHS pictogram as a form XObject: drawn once per document, placed by reference."""
+    name = f"picto_{code}_{int(size * 100)}"
+    forms = c._label_forms
+    if name not in forms:
+        c.saveState()
+        c.beginForm(name)
+        image = _pictogram_image(code)
+        if image is not None:
+            c.drawImage(image, 0, 0, size, size, mask="auto")
+        else:
+            half = size / 2
+            inset = size * 0.04
+            path = c.beginPath()
+            path.moveTo(half, inset)
+            path.lineTo(size - inset, half)
+            path.lineTo(half, size - inset)
+            path.lineTo(inset, half)
+            path.close()
+            c.setStrokeColor(GHS_RED)
+            c.setFillColor(white)
+            c.setLineWidth(max(1, size * 0.07))
+            c.drawPath(path, stroke=1, fill=1)
+            c.setFillColor(black)
+            c.setFont(_font["bold"], size * 0.16)
+            c.drawCentredString(half, half - size * 0.05, code)
+        c.endForm()
+        c.restoreState()
+        forms.add(name)
+    c.saveState()
+    c.translate(x, y)
+    c.doForm(name)
+    c.restoreState()
+
+
+def _paragraph(c, text: str, x: float, top: float, width: float, height: float, size: int):
+    """Wrapped text in a box, shrunk to fit when it would overflow."""
+    if not text or height <= 0:
+        return
+    style = _styles.get(size) or _label_styles()[size]
+    frame = KeepInFrame(width, height, [Paragraph(_escape(text), style)], mode="shrink")
+    _, h = frame.wrapOn(c, width, height)
+    frame.drawOn(c, x, top - h)
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _signal_box(c, signal: str, x: float, top: float, width: float, height: float):
+    if not signal:
+        return
+    c.setFillColor(black)
+    c.rect(x, top - height, width, height, stroke=0, fill=1)
+    c.setFillColor(white)
+    size = _fit_text(c, signal.upper(), _font["bold"], height * 0.7, width - 8)
+    c.setFont(_font["bold"], size)
+    c.drawString(x + 4, top - height + (height - size * 0.7) / 2, signal.upper())
+    c.setFillColor(black)
+
+
+def draw_ghs_label(c, data: dict, x: float, y: float, w: float, h: float):
+    m = min(w, h) * 0.04
+    left, right, top = x + m, x + w - m, y + h - m
+    inner = right - left
+    name = data.get("product_name", "")[:60]
+    size = _fit_text(c, name, _font["bold"], h * 0.05, inner)
+    c.setFont(_font["bold"], size)
+    c.drawString(left, top - size, name)
+    top -= size * 1.4
+    _signal_box(c, data.get("signal_word", ""), left, top, inner, h * 0.06)
+    top -= h * 0.06 + m
+    codes = data.get("pictogram_codes", [])[:4]
+    if codes:
+        picto = min(inner / 4 - m / 2, h * 0.2)
+        for i, code in enumerate(codes):
+            _pictogram(c, code, left + i * (picto + m / 2), top - picto, picto)
+        top -= picto + m
+    footer = h * 0.1
+    body = top - (y + m + footer)
+    _paragraph(c, " ".join(data.get("hazard_statements", [])), left, top, inner, body * 0.45, 8)
+    _paragraph(c, " ".join(data.get("precautionary_statements", [])), left, top - body * 0.48, inner, body * 0.52, 7)
+    c.setFont(_font["regular"], 7)
+    base = y + m + footer
+    if data.get("manufacturer"):
+        c.drawString(left, base - 9, f"Supplier: {data['manufacturer']}"[:90])
+    if data.get("cas_number"):
+        c.drawString(left, base - 19, f"CAS: {data['cas_number']}")
+    c.drawRightString(right, base - 19, f"Generated: {data.get('generated_at', '')[:10]}")
+
+
+def draw_secondary_label(c, data: dict, x: float, y: float, w: float, h: float):
+    m = min(w, h) * 0.06
+    codes = data.get("pictogram_codes", [])[:2]
+    picto = min((h - 2 * m - m / 2) / 2, w * 0.2) if codes else 0
+    text_width = w - 2 * m - (picto + m if codes else 0)
+    top = y + h - m
+    name = data.get("product_name", "")[:40]
+    size = _fit_text(c, name, _font["bold"], h * 0.16, text_width)
+    c.setFont(_font["bold"], size)
+    c.drawString(x + m, top - size, name)
+    top -= size * 1.25
+    if data.get("signal_word"):
+        c.setFont(_font["bold"], size * 0.8)
+        c.drawString(x + m, top - size * 0.8, data["signal_word"].upper())
+        top -= size
+    _paragraph(c, " ".join(data.get("hazard_statements", []))[:160], x + m, top, text_width, top - (y + m), 6)
+    for i, code in enumerate(codes):
+        _pictogram(c, code, x + w - m - picto, y + h - m - (i + 1) * picto - i * m / 2, picto)
+
+
+def draw_pipe_marker(c, data: dict, x: float, y: float, w: float, h: float):
+    codes = data.get("pictogram_codes", [])
+    hazard = next((PIPE_HAZARDS[code] for code in codes if code in PIPE_HAZARDS), "other")
+    background, ink = PIPE_COLORS[hazard]
+    c.setFillColor(background)
+    c.rect(x, y, w, h, stroke=0, fill=1)
+    c.setFillColor(ink)
+    c.setStrokeColor(ink)
+    m = h * 0.12
+    arrow = h * 0.9
+    picto = h - 2 * m if codes else 0
+    direction = data.get("flow_direction", "right")
+    # Arrow(s) at the ends showing the flow direction
+    for at_right in (True, False):
+        if direction == "both" or (direction == "right") == at_right:
+            tip = x + w - m - picto - (m if picto else 0) if at_right else x + m
+            back = tip - arrow if at_right else tip + arrow
+            path = c.beginPath()
+            path.moveTo(tip, y + h / 2)
+            path.lineTo(back, y + h - m)
+            path.lineTo(back, y + m)
+            path.close()
+            c.drawPath(path, stroke=0, fill=1)
+    name = data.get("product_name", "").upper()
+    room = w - 2 * (arrow + 2 * m) - picto
+    size = _fit_text(c, name, _font["bold"], h * 0.55, room)
+    c.setFont(_font["bold"], size)
+    c.drawCentredString(x + (w - picto) / 2, y + (h - size * 0.7) / 2, name)
+    if codes:
+        c.setFillColor(white)
+        c.rect(x + w - m / 2 - picto - m / 2, y + m / 2, picto + m, h - m, stroke=0, fill=1)
+        _pictogram(c, codes[0], x + w - m - picto, y + m, picto)
+    c.setFillColor(black)
+
+
+DRAWERS = {"ghs_primary": draw_ghs_label, "secondary": draw_secondary_label, "pipe_marker": draw_pipe_marker}
+DEFAULT_SIZES = {"ghs_primary": "4x6", "secondary": "2x1", "pipe_marker": "8x1"}
+
+
+def _grid(sheet: dict, cell: tuple) -> tuple:
+    """(columns, rows, cell width, cell height) for a sheet."""
+    page_w, page_h = sheet["page"]
+    (mx, my), (gx, gy) = sheet["margin"], sheet["gap"]
+    if "grid" in sheet:
+        return (*sheet["grid"], *sheet["cell"])
+    cw, ch = cell
+    cols = int((page_w - 2 * mx + gx) // (cw + gx))
+    rows = int((page_h - 2 * my + gy) // (ch + gy))
+    if cols < 1 or rows < 1:
+        raise LabelLayoutError("Label does not fit on the sheet")
+    return cols, rows, cw, ch
+
+
+def _cut_marks(c, x: float, y: float, w: float, h: float):
+    c.saveState()
+    c.setStrokeColor(HexColor("#AAAAAA"))
+    c.setLineWidth(0.3)
+    tick = 6
+    for cx, cy, dx, dy in ((x, y, -1, -1), (x + w, y, 1, -1), (x, y + h, -1, 1), (x + w, y + h, 1, 1)):
+        c.line(cx, cy + dy * 1, cx, cy + dy * tick)
+        c.line(cx + dx * 1, cy, cx + dx * tick, cy)
+    c.restoreState()
+
+
+def resolve_layout(label_type: str, label_size: str, layout: str) -> str:
+    if label_type not in DRAWERS:
+        raise LabelLayoutError(f"No PDF layout for {label_type} labels (one of: {', '.join(DRAWERS)})")
+    if layout not in LAYOUTS:
+        raise LabelLayoutError(f"Unknown layout '{layout}' (one of: {', '.join(LAYOUTS)})")
+    if layout != "auto":
+        return layout
+    w, h = _parse_size(label_size)
+    return "letter-30" if (w, h) == (2 * inch, 1 * inch) else "letter"
+
+
+def render_labels_pdf(labels: list, layout: str = "auto", copies: int = 1) -> bytes:
+    """PDF of labels (label_data dicts, each carrying label_type/label_size), `copies` of each.
+    layout "label" is one label per page at label size; sheet layouts place them multi-up."""
+    if not labels:
+        raise LabelLayoutError("No labels to render")
+    label_type = labels[0].get("label_type", "ghs_primary")
+    drawer = DRAWERS.get(label_type)
+    if drawer is None:
+        raise LabelLayoutError(f"No PDF layout for {label_type} labels")
+    label_size = labels[0].get("label_size") or DEFAULT_SIZES[label_type]
+    size = _parse_size(label_size)
+    layout = resolve_layout(label_type, label_size, layout)
+
+    buf = io.BytesIO()
+    if layout == "label":
+        c = canvas.Canvas(buf, pagesize=size, pageCompression=1)
+        c._label_forms = set()
+        for data in labels:
+            for _ in range(copies):
+                drawer(c, data, 0, 0, *size)
+                c.showPage()
+    else:
+        sheet = dict(SHEETS[layout])
+        if "grid" in sheet:
+            if size[0] > sheet["cell"][0] + 1 or size[1] > sheet["cell"][1] + 1:
+                raise LabelLayoutError(f"{label_size} labels do not fit the {layout} sheet")
+        elif size[0] > sheet["page"][0] - 2 * sheet["margin"][0]:
+            sheet["page"] = landscape(sheet["page"])  # wide pipe markers
+        page = sheet["page"]
+        cols, rows, cw, ch = _grid(sheet, size)
+        c = canvas.Canvas(buf, pagesize=page, pageCompression=1)
+        c._label_forms = set()
+        (mx, my), (gx, gy) = sheet["margin"], sheet["gap"]
+        slot = 0
+        for data in labels:
+            for _ in range(copies):
+                if slot == cols * rows:
+                    c.showPage()
+                    slot = 0
+                col, row = slot % cols, slot // cols
+                x = mx + col * (cw + gx)
+                y = page[1] - my - (row + 1) * ch - row * gy
+                drawer(c, data, x, y, cw, ch)
+                if sheet["cut_marks"]:
+                    _cut_marks(c, x, y, cw, ch)
+                slot += 1
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+# ---------- evidence report ----------
+
+@lru_cache(maxsize=16)
+def _evidence_styles(primary_color: str):
+    primary = HexColor(primary_color)
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle("BrandTitle", parent=styles["Title"], textColor=primary, fontSize=22, spaceAfter=6))
+    styles.add(ParagraphStyle("BrandSub", parent=styles["Normal"], textColor=primary, fontSize=11, spaceAfter=12))
+    styles.add(ParagraphStyle("SHead", parent=styles["Heading2"], textColor=primary, fontSize=14, spaceBefore=16, spaceAfter=8))
+    styles.add(ParagraphStyle("Foot", parent=styles["Normal"], textColor=HexColor("#888888"), fontSize=8, alignment=TA_CENTER))
+    return styles
+
+
+def render_evidence_pdf(branding: dict, records: list, evidence_type: str, ai_summary: str) -> bytes:
+    """Generate branded SDS compliance PDF."""
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=letter, topMargin=0.75*inch, bottomMargin=0.75*inch)
+    primary = HexColor(branding["primary_color"])
+    styles = _evidence_styles(branding["primary_color"])
+
+    elements = []
+
+    if branding.get("logo_path") and Path(branding["logo_path"]).exists():
+        logo = Image(branding["logo_path"], width=2*inch, height=1*inch)
+        logo.hAlign = "LEFT"
+        elements.append(logo)
+        elements.append(Spacer(1, 12))
+
+    elements.append(Paragraph("SDS Compliance Evidence Package", styles["BrandTitle"]))
+    elements.append(Paragraph(branding["company_name"], styles["BrandSub"]))
+    for line in branding.get("address_lines", []):
+        elements.append(Paragraph(line, styles["Normal"]))
+    elements.append(Spacer(1, 20))
+
+    total = len(records)
+    current = sum(1 for r in records if r[6] == "current")
+    expired = sum(1 for r in records if r[6] == "expired")
+    missing = sum(1 for r in records if not r[8])
+    compliance = f"{(current / total * 100):.1f}%" if total > 0 else "N/A"
+
+    cover = Table([
+        ["Report Type", evidence_type.replace("_", " ").title()],
+        ["Generated", datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")],
+        ["Total Chemicals", str(total)],
+        ["SDS Compliance Rate", compliance],
+        ["Current SDS", str(current)],
+        ["Expired SDS", str(expired)],
+        ["Missing SDS", str(missing)],
+    ], colWidths=[2*inch, 3*inch])
+    cover.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (0, -1), primary),
+        ("TEXTCOLOR", (0, 0), (0, -1), HexColor("#FFFFFF")),
+        ("FONTSIZE", (0, 0), (-1, -1), 10),
+        ("PADDING", (0, 0), (-1, -1), 8),
+        ("GRID", (0, 0), (-1, -1), 0.5, HexColor("#CCCCCC")),
+    ]))
+    elements.append(cover)
+    elements.append(Spacer(1, 20))
+
+    elements.append(Paragraph("Executive Summary", styles["SHead"]))
+    for para in ai_summary.split("\n\n"):
+        clean = re.sub(r'[#*]+\s*', '', para.strip())
+        clean = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', clean)
+        if clean:
+            elements.append(Paragraph(clean, styles["Normal"]))
+            elements.append(Spacer(1, 6))
+
+    if records:
+        elements.append(Spacer(1, 12))
+        elements.append(Paragraph("Chemical Inventory", styles["SHead"]))
+        header = ["Chemical", "CAS#", "Signal", "Hazard", "Storage", "Location", "Status"]
+        table_data = [header]
+        for r in records:
+            table_data.append([
+                str(r[0])[:25], str(r[1] or ""), str(r[2] or ""),
+                str(r[3] or "")[:15], str(r[4] or ""), str(r[5] or ""),
+                str(r[6] or "").replace("_", " ").title(),
+            ])
+        t = Table(table_data, repeatRows=1)
+        t.setStyle(TableStyle([
+            ("BACKGROUND", (0, 0), (-1, 0), primary),
+            ("TEXTCOLOR", (0, 0), (-1, 0), HexColor("#FFFFFF")),
+            ("FONTSIZE", (0, 0), (-1, -1), 7),
+            ("PADDING", (0, 0), (-1, -1), 4),
+            ("GRID", (0, 0), (-1, -1), 0.5, HexColor("#CCCCCC")),
+            ("ROWBACKGROUNDS", (0, 1), (-1, -1), [HexColor("#FFFFFF"), HexColor("#F5F5F5")]),
+        ]))
+        elements.append(t)
+
+    elements.append(Spacer(1, 30))
+    elements.append(Paragraph(branding.get("report_footer", ""), styles["Foot"]))
+    doc.build(elements)
+    return buf.getvalue()
+
+
+# ---------- pool ----------
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: workers must not inherit the API process's event loop, threads and sockets
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                                    initializer=init_worker)
+    return _pool
+
+
+async def start_pdf_pool():
+    """Spawn the workers and render one throwaway label in each, off the request path."""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    pool = _get_pool()
+    pids = await asyncio.gather(*(loop.run_in_executor(pool, warm) for _ in range(PDF_WORKERS)))
+    logger.info(f"PDF pool warm: {len(set(pids))} workers in {time.perf_counter() - started:.1f}s")
+
+
+def _drop_pool(pool: ProcessPoolExecutor):
+    """Forget a pool whose worker died (OOM kill, segfault), so the next job spawns a new one."""
+    global _pool
+    if _pool is pool:
+        _pool = None
+        metrics["pool_restarts"] += 1
+        logger.warning("PDF worker died; restarting the pool")
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_pdf(fn, *args):
+    """Run a render function from this module in the worker pool. A job that hits a broken
+    pool is retried once on a fresh one."""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    metrics["jobs"] += 1
+    try:
+        for attempt in range(2):
+            pool = _get_pool()
+            try:
+                return await loop.run_in_executor(pool, fn, *args)
+            except BrokenProcessPool:
+                _drop_pool(pool)
+                if attempt:
+                    raise
+    finally:
+        metrics["wall_ms"] += int((time.perf_counter() - started) * 1000)
+
+
+async def close_pdf_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def pdf_stats() -> dict:
+    return {"workers": PDF_WORKERS, "started": _pool is not None, **metrics}
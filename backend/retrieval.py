@@ -0,0 +1,149 @@
+"""
+Local retrieval for SDS Q&A.
+BM25 over a tenant's chemicals and the text of their latest SDS sections,
+so /sds/question can send the model the few chemicals and excerpts that
+matter instead of the whole inventory. Pure Python, no network.
+
+Usage:
+    index = RegistryIndex(chemicals, sections)
+    hits = index.search("what gloves for acetone", k=8)
+    excerpts = index.excerpts("what gloves for acetone", [h.key for h in hits], k=6)
+"""
+import re
+import math
+import heapq
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Chemical names/CAS numbers matter more than incidental section text
+CHEMICAL_FIELD_BOOST = 3
+
+# CAS numbers are kept whole so '67-64-1' matches exactly; everything else splits on non-alphanumerics
+_TOKEN_RE = re.compile(r"\b\d{2,7}-\d{2}-\d\b|[a-z0-9]+")
+_STOPWORDS = frozenset("""
+a an and are as at be by can do does for from has have how i in is it its me my
+of on or our should the their there this to was we what when where which who
+why will with you your any all about if into than that then these those
+""".split())
+
+
+def tokenize(text: str) -> list:
+    """Lowercased word and CAS-number tokens, minus stopwords."""
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in _STOPWORDS]
+
+
+def flatten_json(value) -> str:
+    """Join the scalar leaves of a JSON section into plain text."""
+    if isinstance(value, dict):
+        return " ".join(flatten_json(v) for v in value.values())
+    if isinstance(value, list):
+        return " ".join(flatten_json(v) for v in value)
+    return "" if value is None else str(value)
+
+
+class BM25:
+    """Okapi BM25 over pre-tokenized documents.
+
+    Postings hold the length-normalised tf weight, so a query only multiplies by
+    idf and sums. Terms found in more than max_df of the documents carry almost
+    no idf and are skipped at query time.
+    """
+
+    def __init__(self, docs: list, max_df: float = 0.5):
+        self.n = len(docs)
+        avgdl = (sum(len(d) for d in docs) / self.n) if self.n else 1.0
+        counts = [Counter(d) for d in docs]
+        postings = defaultdict(list)  # term -> [(doc, weight)]
+        for i, (doc, tfs) in enumerate(zip(docs, counts)):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * len(doc) / (avgdl or 1.0))
+            for term, tf in tfs.items():
+                postings[term].append((i, tf * (BM25_K1 + 1) / (tf + norm)))
+        self.postings = postings
+        self.idf = {
+            term: math.log(1 + (self.n - len(p) + 0.5) / (len(p) + 0.5))
+            for term, p in postings.items()
+            if len(p) <= max(1, max_df * self.n)
+        }
+
+    def scores(self, query_tokens: list, restrict=None) -> dict:
+        scores = defaultdict(float)
+        for term in set(query_tokens):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc, weight in self.postings[term]:
+                if restrict is None or doc in restrict:
+                    scores[doc] += idf * weight
+        return scores
+
+
+@dataclass
+class Hit:
+    key: object
+    score: float
+
+
+class RegistryIndex:
+    """Two-stage index: chemicals first, then section excerpts of the chemicals found.
+
+    chemicals: [(key, text)] -- key is whatever the caller uses to find the row again
+    sections:  [(key, section_number, section_title, text)]
+    """
+
+    def __init__(self, chemicals: list, sections: list):
+        self.sections = sections
+        self.section_index = BM25([tokenize(f"{title} {txt}") for _, _, title, txt in sections])
+        self.sections_by_key = defaultdict(list)
+        for i, (key, *_rest) in enumerate(sections):
+            self.sections_by_key[key].append(i)
+        self._set_chemicals(chemicals)
+
+    def _set_chemicals(self, chemicals: list):
+        self.chemical_keys = [key for key, _ in chemicals]
+        self._chem_pos = {key: i for i, key in enumerate(self.chemical_keys)}
+        self.chem_index = BM25([tokenize(txt) * CHEMICAL_FIELD_BOOST for _, txt in chemicals])
+
+    def with_chemicals(self, chemicals: list) -> "RegistryIndex":
+        """Copy sharing this index's sections -- the section index is the expensive part,
+        and most registry changes (edits, new chemicals without SDS) leave it untouched."""
+        clone = object.__new__(RegistryIndex)
+        clone.__dict__.update(self.__dict__)
+        clone._set_chemicals(chemicals)
+        return clone
+
+    def search(self, question: str, k: int = 8) -> list:
+        """Rank chemicals by name/attribute match plus their best matching SDS section."""
+        tokens = tokenize(question)
+        if not tokens:
+            return []
+        scores = defaultdict(float)
+        for doc, score in self.chem_index.scores(tokens).items():
+            scores[self.chemical_keys[doc]] += score
+        best_section = {}
+        for doc, score in self.section_index.scores(tokens).items():
+            key = self.sections[doc][0]
+            if score > best_section.get(key, 0.0):
+                best_section[key] = score
+        for key, score in best_section.items():
+            if key in self._chem_pos:
+                scores[key] += score
+        top = heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+        return [Hit(key, score) for key, score in top if score > 0]
+
+    def excerpts(self, question: str, keys: list, k: int = 6, max_chars: int = 700) -> list:
+        """Best matching sections among the given chemicals: [(key, number, title, excerpt)]."""
+        tokens = tokenize(question)
+        restrict = {i for key in keys for i in self.sections_by_key.get(key, ())}
+        if not tokens or not restrict:
+            return []
+        scores = self.section_index.scores(tokens, restrict)
+        top = heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+        out = []
+        for doc, _ in top:
+            key, number, title, txt = self.sections[doc]
+            excerpt = txt if len(txt) <= max_chars else txt[:max_chars].rsplit(" ", 1)[0] + " …"
+            out.append((key, number, title, excerpt))
+        return out
@@ -0,0 +1,382 @@
+"""
+Local text extraction for SDS PDFs.
+Reads a PDF page by page through a memory map, splits the text into the 16
+GHS sections and pulls out the fields a deterministic parser reads reliably
+(CAS number, H/P statements, signal word, pictograms, revision date), so the
+model only sees section text and only fills in what could not be parsed.
+Pure Python (pypdf), no network.
+
+Usage:
+    parsed = parse_sds_pdf("/app/uploads/blobs/ab/abcd....pdf")
+    parsed.sections["4"]          # ("First-aid measures", "Inhalation: Remove to fresh air ...")
+    parsed.fields["cas_number"]   # "67-64-1"
+"""
+import re
+import mmap
+from datetime import date
+from dataclasses import dataclass, field
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+# Part of the extraction cache key: bump when parsing output changes
+PARSER_VERSION = "1"
+
+# A PDF whose first pages carry less text than this is treated as scanned
+SCANNED_PROBE_PAGES = 3
+SCANNED_MIN_CHARS = 40
+MAX_TEXT_CHARS = 400_000  # stop reading pages past this (appendices, translations)
+
+SECTION_TITLES = {
+    "1": "Identification", "2": "Hazard identification", "3": "Composition/information on ingredients",
+    "4": "First-aid measures", "5": "Fire-fighting measures", "6": "Accidental release measures",
+    "7": "Handling and storage", "8": "Exposure controls/personal protection",
+    "9": "Physical and chemical properties", "10": "Stability and reactivity",
+    "11": "Toxicological information", "12": "Ecological information", "13": "Disposal considerations",
+    "14": "Transport information", "15": "Regulatory information", "16": "Other information",
+}
+
+# A bare "4. FIRST AID" line only counts as a header when its title looks like that section
+SECTION_KEYWORDS = {
+    1: ("identification", "product", "company"), 2: ("hazard",), 3: ("composition", "ingredient"),
+    4: ("first", "aid"), 5: ("fire",), 6: ("accidental", "release", "spill"), 7: ("handling", "storage"),
+    8: ("exposure", "protection", "ppe"), 9: ("physical", "chemical"), 10: ("stability", "reactivity"),
+    11: ("toxicolog",), 12: ("ecolog",), 13: ("disposal",), 14: ("transport",), 15: ("regulat",),
+    16: ("other", "additional"),
+}
+
+_SECTION_RE = re.compile(r"^\s*section\s*(\d{1,2})\b\s*[:.\-–—)]?\s*(.*)$", re.I)
+_NUMBERED_RE = re.compile(r"^\s*(\d{1,2})\s*[.):]?\s+([A-Za-z][^\d]{2,})$")
+_CAS_RE = re.compile(r"(?<![\d-])(\d{2,7})-(\d{2})-(\d)(?![\d-])")
+_H_CODE_RE = re.compile(r"\b((?:EUH|H)\d{3}(?:\s*\+\s*H\d{3})*)\b")
+_P_CODE_RE = re.compile(r"\b(P\d{3}(?:\s*\+\s*P\d{3})*)\b")
+_GHS_CODE_RE = re.compile(r"\bGHS0([1-9])\b")
+_SIGNAL_RE = re.compile(r"signal\s*word\s*[:\-]?\s*(danger|warning)\b", re.I)
+_PRODUCT_RE = re.compile(r"^\s*(?:product\s*name|trade\s*name|product\s*identifier)\s*[:\-]?\s*(.*)$", re.I)
+_SUPPLIER_RE = re.compile(r"^\s*(?:manufacturer|supplier|company(?:\s*name)?|distributor)\s*(?:name)?\s*[:\-]\s*(.+)$", re.I)
+_REVISION_RE = re.compile(
+    r"(?:revision\s*date|date\s*of\s*(?:last\s*)?revision|revised(?:\s*on)?|issue\s*date|date\s*of\s*issue"
+    r"|version\s*date|date\s*prepared|rev\.?\s*date)\s*[:\-]?\s*([^\n]{6,40})", re.I)
+
+_MONTHS = {m: i + 1 for i, m in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"])}
+_ISO_DATE_RE = re.compile(r"\b(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b")
+_NUM_DATE_RE = re.compile(r"\b(\d{1,2})([-/.])(\d{1,2})\2(\d{4})\b")
+_DAY_MONTH_RE = re.compile(r"\b(\d{1,2})[\s\-.]*([A-Za-z]{3,9})\.?[\s\-.,]*(\d{4})\b")
+_MONTH_DAY_RE = re.compile(r"\b([A-Za-z]{3,9})\.?\s+(\d{1,2}),?\s+(\d{4})\b")
+
+_PICTOGRAM_NAMES = [  # longest first so "flame over circle" wins over "flame"
+    ("flame over circle", "GHS03"), ("exploding bomb", "GHS01"), ("skull and crossbones", "GHS06"),
+    ("exclamation mark", "GHS07"), ("health hazard", "GHS08"), ("gas cylinder", "GHS04"),
+    ("corrosion", "GHS05"), ("environment", "GHS09"), ("flame", "GHS02"),
+]
+
+# Pictogram implied by each hazard statement (GHS Rev. 9, Annex 1)
+_H_PICTOGRAMS = {
+    **dict.fromkeys(["H200", "H201", "H202", "H203", "H204", "H240", "H241"], "GHS01"),
+    **dict.fromkeys(["H220", "H221", "H222", "H223", "H224", "H225", "H226", "H228", "H230", "H231",
+                     "H232", "H242", "H250", "H251", "H252", "H260", "H261"], "GHS02"),
+    **dict.fromkeys(["H270", "H271", "H272"], "GHS03"),
+    **dict.fromkeys(["H280", "H281"], "GHS04"),
+    **dict.fromkeys(["H290", "H314", "H318"], "GHS05"),
+    **dict.fromkeys(["H300", "H301", "H310", "H311", "H330", "H331"], "GHS06"),
+    **dict.fromkeys(["H302", "H312", "H332", "H315", "H317", "H319", "H335", "H336", "H420"], "GHS07"),
+    **dict.fromkeys(["H304", "H334", "H340", "H341", "H350", "H351", "H360", "H361", "H362", "H370",
+                     "H371", "H372", "H373"], "GHS08"),
+    **dict.fromkeys(["H400", "H410", "H411"], "GHS09"),
+}
+# GHS precedence: no exclamation mark for acute toxicity next to the skull, for
+# irritation next to corrosion, or for skin sensitisation next to the health hazard
+_GHS07_SUPPRESSED_BY = {
+    "H302": "GHS06", "H312": "GHS06", "H332": "GHS06",
+    "H315": "GHS05", "H319": "GHS05", "H317": "GHS08",
+}
+
+
+@dataclass
+class ParsedSDS:
+    pages: int = 0
+    text_chars: int = 0
+    text_layer: bool = False  # False for scanned/image files: nothing to parse locally
+    sections: dict = field(default_factory=dict)  # {"1": (title, text), ...}, only sections found
+    fields: dict = field(default_factory=dict)  # top-level extraction keys parsed locally
+    text: str = ""  # full text when no section headers were found (capped), else ""
+
+
+def read_pdf_text(path, max_pages: int = 50) -> tuple:
+    """Text of each page, read lazily from a memory map. Returns (page texts, page count).
+    Stops early for scanned files (no text on the first pages) and past MAX_TEXT_CHARS."""
+    if PdfReader is None:
+        return [], 0
+    texts, total = [], 0
+    with open(path, "rb") as f:
+        # Blobs are stored by content hash without a suffix: sniff the header (images have none)
+        if not f.read(1024).lstrip().startswith(b"%PDF"):
+            return [], 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            try:
+                reader = PdfReader(mm)
+                page_count = len(reader.pages)
+                for i in range(min(page_count, max_pages)):
+                    page_text = reader.pages[i].extract_text() or ""
+                    texts.append(page_text)
+                    total += len(page_text.strip())
+                    if i + 1 == SCANNED_PROBE_PAGES and total < SCANNED_MIN_CHARS:
+                        break
+                    if total >= MAX_TEXT_CHARS:
+                        break
+            except Exception:  # malformed/encrypted PDFs: let the model path handle them
+                return [], 0
+    return texts, page_count
+
+
+def split_sections(text: str) -> dict:
+    """{"n": (title, body)} for the GHS section headers found, in document order.
+    Of all header-like lines, keeps the longest run with increasing numbers, so a
+    stray "Section 8 ..." line, a table of contents or a repeated page header
+    cannot hide the real headers around it."""
+    candidates = []
+    for line_no, (line_start, line) in enumerate(_lines(text)):
+        m = _SECTION_RE.match(line) or _NUMBERED_RE.match(line)
+        if not m:
+            continue
+        number, title = int(m.group(1)), m.group(2).strip()
+        if not 1 <= number <= 16:
+            continue
+        # "SECTION 8" alone is a header; with a title, the title has to fit the number
+        if (title or m.re is _NUMBERED_RE) and not any(k in title.lower() for k in SECTION_KEYWORDS[number]):
+            continue
+        candidates.append((number, title.rstrip(" :.-") or SECTION_TITLES[str(number)],
+                           line_start, line_start + len(line), line_no))
+
+    # Three or more headers on consecutive lines are a table of contents, not sections
+    toc = set()
+    for i in range(len(candidates)):
+        j = i
+        while (j + 1 < len(candidates) and candidates[j + 1][4] == candidates[j][4] + 1
+               and candidates[j + 1][0] > candidates[j][0]):
+            j += 1
+        if j - i >= 2:
+            toc.update(range(i, j + 1))
+    candidates = [c for i, c in enumerate(candidates) if i not in toc]
+
+    # Longest increasing subsequence by section number; ties keep the earliest header
+    length, prev = [1] * len(candidates), [-1] * len(candidates)
+    for i, (number, *_) in enumerate(candidates):
+        for j in range(i):
+            if candidates[j][0] < number and length[j] + 1 > length[i]:
+                length[i], prev[i] = length[j] + 1, j
+    found, i = [], max(range(len(candidates)), key=length.__getitem__, default=-1)
+    while i >= 0:
+        found.append(candidates[i])
+        i = prev[i]
+    found.reverse()
+
+    sections = {}
+    for i, (number, title, _, body_start, _) in enumerate(found):
+        body_end = found[i + 1][2] if i + 1 < len(found) else len(text)
+        sections[str(number)] = (title, text[body_start:body_end].strip())
+    return sections
+
+
+def _lines(text: str):
+    pos = 0
+    for line in text.split("\n"):
+        yield pos, line
+        pos += len(line) + 1
+
+
+def valid_cas(cas: str) -> bool:
+    """CAS check digit: weighted sum of the other digits, right to left, mod 10."""
+    digits = cas.replace("-", "")
+    if not digits.isdigit() or len(digits) < 5:
+        return False
+    body, check = digits[:-1], int(digits[-1])
+    return sum(int(d) * (i + 1) for i, d in enumerate(reversed(body))) % 10 == check
+
+
+def find_cas_numbers(text: str) -> list:
+    seen = []
+    for m in _CAS_RE.finditer(text):
+        cas = m.group(0)
+        if valid_cas(cas) and cas not in seen:
+            seen.append(cas)
+    return seen
+
+
+def find_statements(text: str, pattern: re.Pattern, valid) -> list:
+    """["H225 - Highly flammable liquid and vapour", ...]: each code with the text
+    that follows it on the same line, de-duplicated by code, in document order."""
+    out, seen = [], set()
+    for line in text.split("\n"):
+        matches = list(pattern.finditer(line))
+        for i, m in enumerate(matches):
+            code = re.sub(r"\s+", "", m.group(1))
+            if code in seen or not all(valid(c) for c in code.split("+")):
+                continue
+            seen.add(code)
+            end = matches[i + 1].start() if i + 1 < len(matches) else len(line)
+            phrase = line[m.end():end].strip(" \t:-–—.,;")
+            out.append(f"{code} - {phrase}" if len(phrase) > 3 else code)
+    return out
+
+
+def _valid_h(code: str) -> bool:
+    n = int(code[-3:])
+    return code.startswith("EUH") or 200 <= n <= 420
+
+
+def _valid_p(code: str) -> bool:
+    return 101 <= int(code[1:]) <= 502
+
+
+def pictograms_for(hazard_codes: list) -> list:
+    """Pictograms implied by hazard statements, with the GHS precedence rules applied."""
+    codes = [c for s in hazard_codes for c in s.split(" ")[0].split("+")]
+    pictos = {_H_PICTOGRAMS[c] for c in codes if c in _H_PICTOGRAMS}
+    if "GHS07" in pictos:
+        needs_07 = any(
+            _H_PICTOGRAMS.get(c) == "GHS07" and _GHS07_SUPPRESSED_BY.get(c) not in pictos
+            for c in codes
+        )
+        if not needs_07:
+            pictos.discard("GHS07")
+    return sorted(pictos)
+
+
+def find_pictograms(text: str) -> list:
+    """Pictograms named in the text: GHS codes anywhere, names on pictogram/symbol lines."""
+    pictos = {f"GHS0{d}" for d in _GHS_CODE_RE.findall(text)}
+    for line in text.split("\n"):
+        lowered = line.lower()
+        if "pictogram" not in lowered and "symbol" not in lowered:
+            continue
+        for name, code in _PICTOGRAM_NAMES:
+            if re.search(rf"\b{name}\b", lowered):
+                pictos.add(code)
+                lowered = lowered.replace(name, "")
+    return sorted(pictos)
+
+
+def parse_date(value: str):
+    """ISO date string from the common SDS date formats, or None. Numeric dates
+    are read month-first (US SDS) unless the first number can only be a day."""
+    candidates = []
+    m = _ISO_DATE_RE.search(value)
+    if m:
+        candidates.append((int(m.group(1)), int(m.group(2)), int(m.group(3))))
+    m = _NUM_DATE_RE.search(value)
+    if m:
+        a, b, year = int(m.group(1)), int(m.group(3)), int(m.group(4))
+        month_first = a <= 12 and m.group(2) == "/"
+        candidates.append((year, a, b) if month_first else (year, b, a))
+    m = _DAY_MONTH_RE.search(value)
+    if m and m.group(2)[:3].lower() in _MONTHS:
+        candidates.append((int(m.group(3)), _MONTHS[m.group(2)[:3].lower()], int(m.group(1))))
+    m = _MONTH_DAY_RE.search(value)
+    if m and m.group(1)[:3].lower() in _MONTHS:
+        candidates.append((int(m.group(3)), _MONTHS[m.group(1)[:3].lower()], int(m.group(2))))
+    for year, month, day in candidates:
+        try:
+            if 1980 <= year <= 2100:
+                return date(year, month, day).isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def find_revision_date(text: str):
+    for m in _REVISION_RE.finditer(text):
+        parsed = parse_date(m.group(1))
+        if parsed:
+            return parsed
+    return None
+
+
+def _labelled_value(text: str, pattern: re.Pattern):
+    """Value after a label like "Product name:", or on the next line when the
+    PDF puts the label and value in separate table cells."""
+    lines = [l.strip() for l in text.split("\n")]
+    for i, line in enumerate(lines):
+        m = pattern.match(line)
+        if not m:
+            continue
+        value = m.group(1).strip(" :-\t")
+        if not value and i + 1 < len(lines):
+            value = lines[i + 1]
+        if 1 < len(value) <= 150:
+            return value
+    return None
+
+
+def parse_fields(sections: dict, text: str) -> dict:
+    """Top-level extraction keys the parser can read; keys it cannot read are left out."""
+    identification = sections.get("1", ("", text))[1]
+    hazards = sections.get("2", ("", text))[1]
+    fields = {}
+
+    product = _labelled_value(identification, _PRODUCT_RE)
+    if product:
+        fields["product_name"] = product
+    supplier = _labelled_value(identification, _SUPPLIER_RE)
+    if supplier:
+        fields["manufacturer"] = supplier
+
+    # The product's own CAS number is given in section 1, or is the only one in section 3
+    cas = find_cas_numbers(identification) if "1" in sections else []
+    if not cas and "3" in sections:
+        composition = find_cas_numbers(sections["3"][1])
+        cas = composition if len(composition) == 1 else []
+    if cas:
+        fields["cas_number"] = cas[0]
+
+    signal = _SIGNAL_RE.search(hazards)
+    if signal:
+        fields["signal_word"] = signal.group(1).capitalize()
+
+    h_statements = find_statements(hazards, _H_CODE_RE, _valid_h)
+    p_statements = find_statements(hazards, _P_CODE_RE, _valid_p)
+    if h_statements:
+        fields["hazard_statements"] = h_statements
+    if p_statements:
+        fields["precautionary_statements"] = p_statements
+    pictos = find_pictograms(hazards) or pictograms_for(h_statements)
+    if pictos or h_statements:
+        fields["pictogram_codes"] = pictos
+
+    revision = find_revision_date(sections.get("16", ("", ""))[1]) or find_revision_date(text)
+    if revision:
+        fields["revision_date"] = revision
+    return fields
+
+
+def section_excerpts(sections: dict, max_chars: int, limits: dict = None) -> list:
+    """[(number, title, text)] with whitespace squeezed and each text cut at a word
+    boundary to max_chars (or limits[number]) -- what gets sent to the model."""
+    out = []
+    for num, (title, body) in sections.items():
+        body = "\n".join(" ".join(line.split()) for line in body.split("\n") if line.strip())
+        cap = (limits or {}).get(num, max_chars)
+        if len(body) > cap:
+            body = body[:cap].rsplit(" ", 1)[0] + " …"
+        out.append((num, title, body))
+    return out
+
+
+def parse_sds_pdf(path, max_pages: int = 50) -> ParsedSDS:
+    """Read and parse one SDS file. CPU/file bound; run it off the event loop."""
+    pages, page_count = read_pdf_text(path, max_pages)
+    text = "\n".join(pages)
+    if len(text.strip()) < SCANNED_MIN_CHARS:
+        return ParsedSDS(pages=page_count)
+    sections = split_sections(text)
+    return ParsedSDS(
+        pages=page_count,
+        text_chars=len(text),
+        text_layer=True,
+        sections=sections,
+        fields=parse_fields(sections, text),
+        text="" if sections else text[:MAX_TEXT_CHARS],
+    )
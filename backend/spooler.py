@@ -0,0 +1,367 @@
+"""
+Print spooler for Zebra (ZPL) printers on raw TCP port 9100.
+
+Each printer gets a bounded job queue and one worker that keeps its connection
+open between jobs. Before sending, the worker asks the printer for its host
+status (~HS): paper out, head open, ribbon out or pause hold the job until the
+printer recovers (up to PRINT_READY_WAIT). After sending, it polls ~HS until
+the printer's format buffer and label batch have drained, marks the job done
+and runs the job's on_complete callback (print bookkeeping lives in main.py).
+Connection errors before the data is handed over reconnect and retry the job.
+A spooler with nothing to do for PRINTER_IDLE_SECONDS closes its connection and
+removes itself; the next job for that printer starts a fresh one.
+
+Job state is in-process (recent jobs are kept for the job API); no database here.
+"""
+import os
+import re
+import uuid
+import asyncio
+import logging
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger("sds-agent")
+
+PRINTER_PORT = int(os.getenv("PRINTER_PORT", "9100"))
+PRINTER_TIMEOUT = float(os.getenv("PRINTER_TIMEOUT", "5"))  # connect, write and ~HS reply
+PRINT_RETRIES = int(os.getenv("PRINT_RETRIES", "3"))  # reconnect + resend attempts after the first
+PRINT_RETRY_BACKOFF = float(os.getenv("PRINT_RETRY_BACKOFF", "1"))  # seconds, doubled per attempt
+PRINT_READY_WAIT = float(os.getenv("PRINT_READY_WAIT", "120"))  # hold a job this long for paper/head/ribbon
+PRINT_COMPLETE_WAIT = float(os.getenv("PRINT_COMPLETE_WAIT", "300"))  # max wait for a sent job to finish printing
+PRINTER_STATUS_POLL = float(os.getenv("PRINTER_STATUS_POLL", "1"))  # ~HS interval while waiting on the printer
+PRINTER_IDLE_SECONDS = float(os.getenv("PRINTER_IDLE_SECONDS", "300"))  # drop idle spoolers (and connections) after this
+PRINTER_QUEUE_MAX = int(os.getenv("PRINTER_QUEUE_MAX", "500"))  # queued jobs per printer
+PRINT_JOB_HISTORY = int(os.getenv("PRINT_JOB_HISTORY", "2000"))  # jobs kept for status lookups
+
+metrics: Counter = Counter()
+
+
+class PrintQueueFull(Exception):
+    pass
+
+
+class PrinterNotReady(Exception):
+    pass
+
+
+@dataclass
+class PrinterStatus:
+    """The parts of a ~HS reply the spooler acts on."""
+    paper_out: bool = False
+    paused: bool = False
+    head_open: bool = False
+    ribbon_out: bool = False
+    buffer_full: bool = False
+    formats_in_buffer: int = 0
+    labels_remaining: int = 0
+
+    @property
+    def problems(self) -> list:
+        flags = ("paper_out", "head_open", "ribbon_out", "paused", "buffer_full")
+        return [name for name in flags if getattr(self, name)]
+
+    @property
+    def ready(self) -> bool:
+        return not self.problems
+
+    @property
+    def idle(self) -> bool:
+        return self.formats_in_buffer == 0 and self.labels_remaining == 0
+
+    def to_dict(self) -> dict:
+        return {
+            "ready": self.ready, "problems": self.problems,
+            "formats_in_buffer": self.formats_in_buffer, "labels_remaining": self.labels_remaining,
+        }
+
+
+_HS_FRAME = re.compile(rb"\x02([^\x03]*)\x03")
+
+
+def parse_host_status(raw: bytes) -> PrinterStatus:
+    """Parse a ~HS reply: three STX...ETX strings.
+    String 1: aaa,b(paper out),c(pause),dddd,eee(formats in buffer),f(buffer full),g,h,iii,j,k,l
+    String 2: mmm,n,o(head up),p(ribbon out),q(thermal transfer),r,s,t,uuuuuuuu(labels remaining),v,www"""
+    frames = _HS_FRAME.findall(raw)
+    if len(frames) < 2:
+        raise ValueError("Incomplete ~HS reply")
+    s1 = frames[0].decode("ascii", "replace").split(",")
+    s2 = frames[1].decode("ascii", "replace").split(",")
+    if len(s1) < 6 or len(s2) < 9:
+        raise ValueError("Malformed ~HS reply")
+    return PrinterStatus(
+        paper_out=s1[1] == "1",
+        paused=s1[2] == "1",
+        formats_in_buffer=int(s1[4]),
+        buffer_full=s1[5] == "1",
+        head_open=s2[2] == "1",
+        ribbon_out=s2[3] == "1" and s2[4] == "1",  # the ribbon flag only means something in thermal transfer mode
+        labels_remaining=int(s2[8]),
+    )
+
+
+@dataclass
+class PrintJob:
+    printer: str
+    zpl: str
+    tenant_id: Optional[str] = None
+    labels: int = 1
+    meta: dict = field(default_factory=dict)
+    on_complete: Optional[Callable[["PrintJob"], Awaitable]] = None
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    state: str = "queued"  # queued, waiting, sending, printing, done, failed
+    attempts: int = 0
+    error: Optional[str] = None
+    confirmed: bool = False  # the printer reported the job drained (False: sent, printer has no ~HS)
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+    def finish(self, state: str, error: Optional[str] = None):
+        self.state, self.error, self.finished_at = state, error, datetime.utcnow()
+        metrics[f"jobs_{state}"] += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "printer": self.printer,
+            "state": self.state,
+            "labels": self.labels,
+            "attempts": self.attempts,
+            "confirmed": self.confirmed,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class PrinterSpooler:
+    """Queue + worker + persistent connection for one printer."""
+
+    def __init__(self, printer: str):
+        self.printer = printer
+        self.queue: asyncio.Queue = asyncio.Queue(PRINTER_QUEUE_MAX)
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.io_lock = asyncio.Lock()  # one command/reply exchange on the connection at a time
+        self.status: Optional[PrinterStatus] = None
+        self.status_at: Optional[datetime] = None
+        self.status_supported = True
+        self.last_error: Optional[str] = None
+        self.current: Optional[PrintJob] = None
+        self.task = asyncio.create_task(self._run())
+
+    async def _connect(self):
+        if self.writer is not None and not self.writer.is_closing():
+            return
+        host, _, port = self.printer.partition(":")
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(host, int(port or PRINTER_PORT)), timeout=PRINTER_TIMEOUT)
+        metrics["connects"] += 1
+
+    def _disconnect(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    def close(self):
+        """Stop the worker, close the connection and forget this spooler."""
+        self.task.cancel()
+        self._disconnect()
+        if _spoolers.get(self.printer) is self:
+            del _spoolers[self.printer]
+
+    async def _send(self, data: bytes):
+        await self._connect()
+        self.writer.write(data)
+        await asyncio.wait_for(self.writer.drain(), timeout=PRINTER_TIMEOUT)
+
+    async def query_status(self) -> Optional[PrinterStatus]:
+        """One ~HS round trip. Returns None for printers that do not answer it."""
+        if not self.status_supported:
+            return None
+        async with self.io_lock:
+            await self._send(b"~HS")
+            raw = b""
+            try:
+                while raw.count(b"\x03") < 3:
+                    chunk = await asyncio.wait_for(self.reader.read(1024), timeout=PRINTER_TIMEOUT)
+                    if not chunk:
+                        raise ConnectionError("Printer closed the connection")
+                    raw += chunk
+            except asyncio.TimeoutError:
+                if raw:
+                    raise
+                # Silent printer: stop asking, and drop the connection in case a late reply shows up
+                logger.warning(f"Printer {self.printer} does not answer ~HS; printing without status checks")
+                self.status_supported = False
+                self._disconnect()
+                return None
+        metrics["status_queries"] += 1
+        self.status, self.status_at = parse_host_status(raw), datetime.utcnow()
+        return self.status
+
+    async def _wait_ready(self, job: PrintJob):
+        waited = 0.0
+        while True:
+            status = await self.query_status()
+            if status is None or status.ready:
+                job.error = None
+                return
+            job.state, job.error = "waiting", ", ".join(status.problems)
+            if waited >= PRINT_READY_WAIT:
+                raise PrinterNotReady(f"Printer not ready: {job.error}")
+            await asyncio.sleep(PRINTER_STATUS_POLL)
+            waited += PRINTER_STATUS_POLL
+
+    async def _wait_printed(self, job: PrintJob) -> bool:
+        """Poll until the printer has worked through its buffer. A dropped connection here
+        is not retried -- the data was already handed over, and resending could double-print."""
+        waited = 0.0
+        while waited < PRINT_COMPLETE_WAIT:
+            await asyncio.sleep(PRINTER_STATUS_POLL)
+            waited += PRINTER_STATUS_POLL
+            try:
+                status = await self.query_status()
+            except (OSError, asyncio.TimeoutError, ValueError) as e:
+                self._disconnect()
+                job.error = f"Status unavailable after sending: {str(e) or 'timed out'}"
+                return False
+            if status is None:
+                return False
+            if status.idle:
+                return True
+            # Paper can run out mid-job; the printer resumes once it is fixed
+            job.state, job.error = ("waiting", ", ".join(status.problems)) if status.problems else ("printing", None)
+        job.error = f"Printer still busy after {PRINT_COMPLETE_WAIT:.0f}s"
+        return False
+
+    async def _print(self, job: PrintJob):
+        for attempt in range(1, PRINT_RETRIES + 2):
+            job.attempts = attempt
+            try:
+                await self._wait_ready(job)
+                job.state = "sending"
+                async with self.io_lock:
+                    await self._send(job.zpl.encode("utf-8"))
+            except PrinterNotReady as e:
+                job.finish("failed", str(e))
+                return
+            except (OSError, asyncio.TimeoutError, ValueError) as e:
+                self._disconnect()
+                self.last_error = f"{type(e).__name__}: {str(e) or 'timed out'}"
+                if attempt > PRINT_RETRIES:
+                    job.finish("failed", f"Printer connection failed: {str(e) or 'timed out'}")
+                    return
+                metrics["retries"] += 1
+                job.state, job.error = "queued", self.last_error
+                await asyncio.sleep(PRINT_RETRY_BACKOFF * 2 ** (attempt - 1))
+                continue
+
+            job.state, job.error = "printing", None
+            job.confirmed = await self._wait_printed(job)
+            job.finish("done", job.error)
+            return
+
+    async def _run(self):
+        while True:
+            try:
+                job = await asyncio.wait_for(self.queue.get(), timeout=PRINTER_IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                if self.queue.empty():
+                    metrics["spoolers_evicted"] += 1
+                    self.close()
+                    return
+                continue
+            self.current = job
+            try:
+                await self._print(job)
+            except Exception as e:
+                logger.exception(f"Print job {job.id} on {self.printer} failed")
+                job.finish("failed", str(e))
+            finally:
+                self.current = None
+            if job.state == "done" and job.on_complete is not None:
+                try:
+                    await job.on_complete(job)
+                except Exception:
+                    logger.exception(f"Print job {job.id} completion callback failed")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "current": self.current.id if self.current else None,
+            "connected": self.writer is not None and not self.writer.is_closing(),
+            "status": self.status.to_dict() if self.status else None,
+            "status_at": self.status_at.isoformat() if self.status_at else None,
+            "status_supported": self.status_supported,
+            "last_error": self.last_error,
+        }
+
+
+_spoolers: dict = {}  # printer -> PrinterSpooler
+_jobs: OrderedDict = OrderedDict()  # job id -> PrintJob, oldest first
+
+
+def _spooler(printer: str) -> PrinterSpooler:
+    if printer not in _spoolers:
+        _spoolers[printer] = PrinterSpooler(printer)
+    return _spoolers[printer]
+
+
+def submit_print_job(printer: str, zpl: str, labels: int = 1, tenant_id: Optional[str] = None,
+                     meta: Optional[dict] = None, on_complete=None) -> PrintJob:
+    """Queue ZPL for a printer ("host" or "host:port"). Raises PrintQueueFull when the
+    printer already has PRINTER_QUEUE_MAX jobs waiting."""
+    job = PrintJob(printer=printer, zpl=zpl, labels=labels, tenant_id=tenant_id, meta=meta or {},
+                   on_complete=on_complete)
+    try:
+        _spooler(printer).queue.put_nowait(job)
+    except asyncio.QueueFull:
+        metrics["jobs_rejected"] += 1
+        raise PrintQueueFull(f"Print queue for {printer} is full")
+    metrics["jobs_submitted"] += 1
+    _jobs[job.id] = job
+    while len(_jobs) > PRINT_JOB_HISTORY:
+        oldest = next(iter(_jobs.values()))
+        if oldest.finished_at is None:
+            break
+        _jobs.popitem(last=False)
+    return job
+
+
+def get_print_job(job_id: str) -> Optional[PrintJob]:
+    return _jobs.get(job_id)
+
+
+async def printer_status(printer: str) -> dict:
+    """Fresh ~HS status for a printer (through its spooler connection)."""
+    spooler = _spooler(printer)
+    try:
+        status = await spooler.query_status()
+    except (OSError, asyncio.TimeoutError, ValueError) as e:
+        spooler._disconnect()
+        stats = spooler.stats()
+        if spooler.current is None and spooler.queue.empty():
+            spooler.close()  # unreachable and nothing queued: do not keep a worker around for it
+        return {"printer": printer, "online": False, "error": str(e) or "timed out", **stats}
+    return {"printer": printer, "online": True, **spooler.stats(),
+            "status": status.to_dict() if status else None}
+
+
+def spooler_stats() -> dict:
+    return {
+        **{k: metrics[k] for k in ("jobs_submitted", "jobs_done", "jobs_failed", "jobs_rejected",
+                                   "retries", "connects", "status_queries", "spoolers_evicted")},
+        "printers": {printer: s.stats() for printer, s in _spoolers.items()},
+    }
+
+
+async def close_spoolers():
+    pending = sum(s.queue.qsize() + (s.current is not None) for s in _spoolers.values())
+    if pending:
+        logger.warning(f"Shutting down with {pending} print jobs not finished")
+    for s in list(_spoolers.values()):
+        s.close()
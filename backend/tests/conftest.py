@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Backend modules are flat files beside main.py (the Docker image copies them to /app)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,98 @@
+"""Circuit breaker probes that end without an outcome must not wedge the breaker."""
+import asyncio
+
+import pytest
+
+import llm
+from llm import LLMClient, LLMUnavailable, Provider, usage_dict
+
+COOLDOWN = 0.05
+
+
+class FakeProvider(Provider):
+    """mode: "fail" raises a transient error, "hang" never answers, "ok" answers at once."""
+    name = "fake"
+
+    def __init__(self):
+        super().__init__("fake-1")
+        self.mode = "fail"
+
+    async def generate(self, system, prompt, max_output_tokens, temperature):
+        if self.mode == "fail":
+            raise ConnectionError("provider down")
+        if self.mode == "hang":
+            await asyncio.Event().wait()
+        return usage_dict("ok", 1, 1)
+
+    async def stream(self, system, prompt, max_output_tokens, temperature, usage):
+        if self.mode == "fail":
+            raise ConnectionError("provider down")
+        yield "first"
+        if self.mode == "hang":
+            await asyncio.Event().wait()
+        yield "second"
+
+
+@pytest.fixture(autouse=True)
+def fast_breaker(monkeypatch):
+    monkeypatch.setattr(llm, "LLM_RETRIES", 0)
+    monkeypatch.setattr(llm, "LLM_BREAKER_FAILURES", 1)
+    monkeypatch.setattr(llm, "LLM_BREAKER_COOLDOWN", COOLDOWN)
+
+
+async def open_breaker(client: LLMClient):
+    with pytest.raises(LLMUnavailable):
+        await client.generate("system", "prompt")
+    assert client.stats()["breaker"] == "open"
+    await asyncio.sleep(COOLDOWN * 1.5)
+
+
+async def assert_recovers(client: LLMClient):
+    # The abandoned probe re-opened the breaker: rejected now, admitted after the cooldown
+    with pytest.raises(LLMUnavailable):
+        await client.generate("system", "prompt")
+    await asyncio.sleep(COOLDOWN * 1.5)
+    client.provider.mode = "ok"
+    assert (await client.generate("system", "prompt"))["text"] == "ok"
+    assert client.stats()["breaker"] == "closed"
+    assert client.stats()["probes_abandoned"] == 1
+
+
+def test_cancelled_probe_reopens_breaker():
+    async def scenario():
+        client = LLMClient(FakeProvider())
+        await open_breaker(client)
+        client.provider.mode = "hang"
+        probe = asyncio.create_task(client.generate("system", "prompt"))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        await assert_recovers(client)
+
+    asyncio.run(scenario())
+
+
+def test_disconnected_stream_probe_reopens_breaker():
+    async def scenario():
+        client = LLMClient(FakeProvider())
+        await open_breaker(client)
+        client.provider.mode = "hang"
+        chunks = client.stream("system", "prompt", {})
+        assert await chunks.__anext__() == "first"
+        await chunks.aclose()  # the SSE client went away mid-stream
+        await assert_recovers(client)
+
+    asyncio.run(scenario())
+
+
+def test_failed_probe_still_reopens_breaker():
+    async def scenario():
+        client = LLMClient(FakeProvider())
+        await open_breaker(client)
+        with pytest.raises(LLMUnavailable):
+            await client.generate("system", "prompt")  # the probe itself fails
+        assert client.stats()["breaker"] == "open"
+        assert client.stats()["probes_abandoned"] == 0
+
+    asyncio.run(scenario())
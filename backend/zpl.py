@@ -0,0 +1,280 @@
+"""
+ZPL label templates compiled from the printer drivers tool kernel.
+The ```zpl layouts in kernels/tools/printerdrivers.ttc.md (4x6 GHS, 2x1
+secondary container, pipe marker) are parsed once, scaled from 203 dpi to the
+printer's resolution and split into literal chunks and field slots, so a label
+is a single join over pre-built strings. Pictogram slots (^GFA) are filled with
+GHS diamonds encoded once per size as run-length compressed ^GFA graphics, or,
+for multi-label jobs, downloaded to the printer once (~DG) and recalled by name
+(^XG) in every label. Pure Python, no network.
+
+Usage:
+    zpl = render_label(kernel_text, "ghs_primary", 300, fields, ["GHS02", "GHS07"])
+    job = "\\n".join(graphic_downloads(kernel_text, "ghs_primary", 300, codes)
+                     + [render_label(kernel_text, "ghs_primary", 300, f, p, stored=True) for f, p in labels])
+
+Artwork: with Pillow installed and PICTOGRAM_DIR/<code>.png present, the
+pictogram is that image thresholded to 1 bit; otherwise a drawn diamond frame
+with the code printed inside it.
+"""
+import os
+import re
+import string
+import hashlib
+from pathlib import Path
+from functools import lru_cache
+from typing import Optional
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Part of the stored label key: bump when rendering output changes
+ENGINE_VERSION = "1"
+BASE_DPI = 203  # the kernel layouts are in 203 dpi dots
+SUPPORTED_DPI = (203, 300, 600)
+PICTOGRAM_DIR = Path(os.getenv("PICTOGRAM_DIR", "/app/kernels/pictograms"))
+
+# Kernel heading (prefix) -> layout name
+LAYOUT_HEADINGS = {
+    "**GHS 4×6": "ghs_primary",
+    "**二次容器": "secondary",
+    "**管道标志": "pipe_marker",
+}
+
+# Pictogram box edge in 203 dpi dots: full-size slots sit 190 dots apart, small ones 60
+PICTOGRAM_DOTS = {"data": 180, "small": 56}
+
+_TEMPLATE_RE = re.compile(r"^(\*\*.*?)\*\*.*?```zpl\n(.*?)```", re.M | re.S)
+_SLOT_RE = re.compile(r"\^FO(\d+),(\d+)\^GFA,\{picto_(?:(\d+)_)?(data|small)\}\^FS")
+# Commands whose numeric parameters are dot distances: command -> how many leading params scale
+_SCALED = {"^FO": 2, "^A0N,": 2, "^CF0,": 2, "^GB": 3, "^FB": 1}
+_SCALED_RE = re.compile(r"(\^FO|\^A0N,|\^CF0,|\^GB|\^FB)([\d,]+)")
+_QR_RE = re.compile(r"\^BQN,2,(\d+)")
+_QUANTITY_RE = re.compile(r"\^PQ\d+")
+_FIELD_ESCAPE = str.maketrans({"^": " ", "~": " "})
+_formatter = string.Formatter()
+
+
+class TemplateNotFound(Exception):
+    pass
+
+
+@lru_cache(maxsize=8)
+def parse_templates(kernel_text: str) -> dict:
+    """Layout name -> raw ZPL from the kernel's fenced zpl blocks (~~ comment lines dropped)."""
+    templates = {}
+    for heading, body in _TEMPLATE_RE.findall(kernel_text):
+        layout = next((name for prefix, name in LAYOUT_HEADINGS.items() if heading.startswith(prefix)), None)
+        if layout:
+            lines = [line.strip() for line in body.splitlines()]
+            templates[layout] = "\n".join(line for line in lines if line and not line.startswith("~~"))
+    return templates
+
+
+def _scale(value: int, dpi: int) -> int:
+    return round(value * dpi / BASE_DPI)
+
+
+def _scale_line(line: str, dpi: int) -> str:
+    if dpi == BASE_DPI:
+        return line
+
+    def scale_params(match):
+        params = match.group(2).split(",")
+        count = _SCALED[match.group(1)]
+        params[:count] = [str(_scale(int(p), dpi)) if p else p for p in params[:count]]
+        return match.group(1) + ",".join(params)
+
+    line = _SCALED_RE.sub(scale_params, line)
+    return _QR_RE.sub(lambda m: f"^BQN,2,{min(10, max(1, _scale(int(m.group(1)), dpi)))}", line)
+
+
+@lru_cache(maxsize=64)
+def compile_template(kernel_text: str, layout: str, dpi: int) -> tuple:
+    """A layout at one resolution as a tuple of segments, one per template line:
+      ("text", literal)                          -- no fields, always emitted
+      ("fields", ((literal, field), ...))        -- dropped when every field is empty
+      ("picto", index, x, y, size)               -- pictogram slot
+    """
+    template = parse_templates(kernel_text).get(layout)
+    if template is None:
+        raise TemplateNotFound(f"No '{layout}' ZPL template in the printer drivers kernel")
+    if dpi not in SUPPORTED_DPI:
+        raise ValueError(f"Unsupported printer resolution {dpi} dpi")
+    segments = []
+    for line in template.split("\n"):
+        slot = _SLOT_RE.fullmatch(line)
+        if slot:
+            x, y, index, kind = slot.groups()
+            segments.append(("picto", int(index or 1) - 1, _scale(int(x), dpi), _scale(int(y), dpi),
+                             _scale(PICTOGRAM_DOTS[kind], dpi)))
+            continue
+        parts = tuple((literal, name) for literal, name, _, _ in _formatter.parse(_scale_line(line, dpi)))
+        if any(name for _, name in parts):
+            segments.append(("fields", parts))
+        else:
+            segments.append(("text", "".join(literal for literal, _ in parts)))
+    return tuple(segments)
+
+
+# ---------- pictogram graphics ----------
+
+def _diamond(size: int) -> list:
+    """Rows of 1-bit pixels for a GHS diamond frame (border ~1/12 of the box)."""
+    half = (size - 1) / 2
+    border = max(2, size // 12)
+    rows = []
+    for y in range(size):
+        row = []
+        for x in range(size):
+            d = abs(x - half) + abs(y - half)
+            row.append(half - border <= d <= half)
+        rows.append(row)
+    return rows
+
+
+def _artwork(code: str, size: int) -> Optional[list]:
+    path = PICTOGRAM_DIR / f"{code}.png"
+    if Image is None or not path.exists():
+        return None
+    with Image.open(path) as img:
+        img = img.convert("L").resize((size, size))
+        return [[img.getpixel((x, y)) < 128 for x in range(size)] for y in range(size)]
+
+
+def _hex_rows(pixels: list) -> list:
+    rows = []
+    for row in pixels:
+        padded = row + [False] * (-len(row) % 8)
+        data = bytes(
+            sum(1 << (7 - bit) for bit in range(8) if padded[i + bit])
+            for i in range(0, len(padded), 8)
+        )
+        rows.append(data.hex().upper())
+    return rows
+
+
+def _repeat(count: int) -> str:
+    """Zebra repeat count prefix: g..z = 20..400 in steps of 20, G..Y = 1..19."""
+    prefix = ""
+    while count >= 400:
+        prefix += "z"
+        count -= 400
+    if count >= 20:
+        prefix += chr(ord("g") + count // 20 - 1)
+        count %= 20
+    if count:
+        prefix += chr(ord("G") + count - 1)
+    return prefix
+
+
+def compress_rows(rows: list) -> str:
+    """Zebra ASCII compression: ':' repeats the previous row, ',' / '!' fill the rest of a
+    row with 0 / 1, and runs of a hex digit get a repeat-count prefix."""
+    out = []
+    previous = None
+    for row in rows:
+        if row == previous:
+            out.append(":")
+            continue
+        previous = row
+        # Trailing zeros (or Fs) collapse into one fill character
+        stripped, fill = row.rstrip("0"), ","
+        if len(row.rstrip("F")) < len(stripped):
+            stripped, fill = row.rstrip("F"), "!"
+        encoded = []
+        i = 0
+        while i < len(stripped):
+            j = i
+            while j < len(stripped) and stripped[j] == stripped[i]:
+                j += 1
+            run = j - i
+            encoded.append((_repeat(run) if run > 1 else "") + stripped[i])
+            i = j
+        out.append("".join(encoded) + (fill if len(stripped) < len(row) else ""))
+    return "".join(out)
+
+
+@lru_cache(maxsize=256)
+def pictogram_graphic(code: str, size: int) -> tuple:
+    """(total bytes, bytes per row, compressed data, has artwork) for one pictogram at one size."""
+    art = _artwork(code, size)
+    rows = _hex_rows(art or _diamond(size))
+    row_bytes = len(rows[0]) // 2
+    return row_bytes * len(rows), row_bytes, compress_rows(rows), art is not None
+
+
+def graphic_name(code: str, size: int) -> str:
+    """Printer memory name (8 chars max before .GRF), e.g. GHS02 at 180 dots -> G02180."""
+    return f"G{code[-2:]}{size}"
+
+
+@lru_cache(maxsize=256)
+def _pictogram_field(code: str, x: int, y: int, size: int, stored: bool) -> str:
+    total, row_bytes, data, artwork = pictogram_graphic(code, size)
+    if stored:
+        field = f"^FO{x},{y}^XGR:{graphic_name(code, size)}.GRF,1,1^FS"
+    else:
+        field = f"^FO{x},{y}^GFA,{total},{total},{row_bytes},{data}^FS"
+    if not artwork:
+        # No artwork on file: print the code in the middle of the diamond
+        height = max(10, size // 6)
+        field += f"^FO{x + size // 2 - height * 5 // 4},{y + size // 2 - height // 2}^A0N,{height},{height}^FD{code}^FS"
+    return field
+
+
+def graphic_downloads(kernel_text: str, layout: str, dpi: int, codes) -> list:
+    """~DG commands that store the pictograms a stored=True label recalls, one per code and slot size."""
+    sizes = {seg[4] for seg in compile_template(kernel_text, layout, dpi) if seg[0] == "picto"}
+    downloads = []
+    for code in sorted(set(codes)):
+        for size in sorted(sizes):
+            total, row_bytes, data, _ = pictogram_graphic(code, size)
+            downloads.append(f"~DGR:{graphic_name(code, size)}.GRF,{total},{row_bytes},{data}")
+    return downloads
+
+
+# ---------- rendering ----------
+
+def render_label(kernel_text: str, layout: str, dpi: int, fields: dict, pictograms=(),
+                 stored: bool = False) -> str:
+    """Fill a compiled layout. Lines whose fields are all empty are left out, as are
+    pictogram slots beyond the label's pictograms."""
+    values = {k: str(v).translate(_FIELD_ESCAPE) for k, v in fields.items() if v not in (None, "")}
+    out = []
+    for segment in compile_template(kernel_text, layout, dpi):
+        kind = segment[0]
+        if kind == "text":
+            out.append(segment[1])
+        elif kind == "fields":
+            parts = segment[1]
+            if not any(name in values for _, name in parts if name):
+                continue
+            out.append("".join(literal + (values.get(name, "") if name else "") for literal, name in parts))
+        else:
+            _, index, x, y, size = segment
+            if index < len(pictograms):
+                out.append(_pictogram_field(pictograms[index], x, y, size, stored))
+    return "\n".join(out)
+
+
+@lru_cache(maxsize=16)
+def template_version(kernel_text: str, dpi: int) -> str:
+    """Identifies what render_label produces: engine, kernel layouts and resolution."""
+    digest = hashlib.sha1(kernel_text.encode("utf-8")).hexdigest()[:12]
+    return f"{ENGINE_VERSION}.{digest}.{dpi}"
+
+
+def set_quantity(zpl: str, quantity: int) -> str:
+    """Rewrite the ^PQ print quantity of an already rendered label."""
+    return _QUANTITY_RE.sub(f"^PQ{quantity}", zpl)
+
+
+def template_stats() -> dict:
+    return {
+        "compiled_layouts": compile_template.cache_info().currsize,
+        "pictogram_graphics": pictogram_graphic.cache_info().currsize,
+        "pictogram_fields": _pictogram_field.cache_info()._asdict(),
+    }
@@ -47,6 +47,8 @@ CREATE TABLE chemicals (
     has_sds BOOLEAN DEFAULT FALSE,
     sds_revision_date DATE,
     status VARCHAR(30) DEFAULT 'missing_sds',
+    next_status_change DATE,  -- when status next moves (see advance_sds_statuses)
+    latest_sds_document_id UUID,  -- newest sds_documents row, kept by sds_status_trigger (FK below)
     notes TEXT,
     created_at TIMESTAMP DEFAULT NOW(),
     updated_at TIMESTAMP DEFAULT NOW()
@@ -62,11 +64,19 @@ CREATE TABLE sds_documents (
     upload_date TIMESTAMP DEFAULT NOW(),
     extracted_data JSONB,  -- full 16-section extraction
     sections_complete INTEGER DEFAULT 0,  -- count of non-null sections
-    status VARCHAR(30) DEFAULT 'processing',  -- processing, current, expired, incomplete
+    status VARCHAR(30) DEFAULT 'processing',  -- processing, current, expiring_soon, expired, incomplete
+    next_status_change DATE,  -- when status next moves (see advance_sds_statuses)
     uploaded_by UUID REFERENCES users(id),
+    content_hash CHAR(64),  -- sha256 of the uploaded file
     created_at TIMESTAMP DEFAULT NOW()
 );
 
+-- Set from the BEFORE INSERT trigger on sds_documents, i.e. before the document
+-- row exists, so the check waits for commit
+ALTER TABLE chemicals ADD CONSTRAINT chemicals_latest_sds_document_fk
+    FOREIGN KEY (latest_sds_document_id) REFERENCES sds_documents(id)
+    ON DELETE SET NULL DEFERRABLE INITIALLY DEFERRED;
+
 CREATE TABLE sds_sections (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     tenant_id UUID NOT NULL REFERENCES tenants(id),
@@ -84,11 +94,15 @@ CREATE TABLE labels (
     chemical_id UUID NOT NULL REFERENCES chemicals(id),
     label_type VARCHAR(30) NOT NULL DEFAULT 'ghs_primary',  -- ghs_primary, secondary, pipe_marker
     label_size VARCHAR(20) NOT NULL DEFAULT '4x6',
+    sds_document_id UUID REFERENCES sds_documents(id),  -- SDS revision the label was rendered from
+    template_version VARCHAR(40),  -- label data + ZPL layout version (see label_template_version)
     label_data JSONB NOT NULL,  -- structured label content
     zpl_content TEXT,  -- generated ZPL if applicable
     pdf_path VARCHAR(500),
     print_count INTEGER DEFAULT 0,
     last_printed TIMESTAMP,
+    generated_count INTEGER DEFAULT 1,  -- /sds/label requests served by this rendering
+    last_generated TIMESTAMP DEFAULT NOW(),
     created_at TIMESTAMP DEFAULT NOW()
 );
 
@@ -125,6 +139,73 @@ CREATE TABLE token_usage (
     timestamp TIMESTAMP DEFAULT NOW()
 );
 
+-- Async ingestion queue for /sds/upload and /sds/bulk. Workers claim jobs across
+-- tenants, so there is no RLS here -- endpoints filter on tenant_id explicitly.
+CREATE TABLE sds_batches (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    tenant_id UUID NOT NULL REFERENCES tenants(id),
+    created_by UUID REFERENCES users(id),
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',  -- queued, running, done
+    total_files INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT NOW(),
+    finished_at TIMESTAMP
+);
+
+CREATE TABLE sds_jobs (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    tenant_id UUID NOT NULL REFERENCES tenants(id),
+    created_by UUID REFERENCES users(id),
+    batch_id UUID REFERENCES sds_batches(id),  -- null for single uploads
+    file_path VARCHAR(500) NOT NULL,
+    file_name VARCHAR(255) NOT NULL,
+    file_size BIGINT DEFAULT 0,
+    content_hash CHAR(64),  -- sha256 of the file bytes
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',  -- queued, running, done, error, skipped
+    attempts INTEGER DEFAULT 0,
+    result JSONB,  -- same payload the synchronous upload used to return
+    error TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Extraction results keyed by file content, shared across tenants: the same
+-- manufacturer SDS uploaded twice is only sent to the model once. A new model,
+-- prompt or agent kernel changes extraction_version and misses naturally.
+CREATE TABLE sds_extraction_cache (
+    content_hash CHAR(64) NOT NULL,
+    extraction_version VARCHAR(32) NOT NULL,
+    extracted_data JSONB NOT NULL,
+    input_tokens INTEGER DEFAULT 0,  -- cost of the original extraction
+    output_tokens INTEGER DEFAULT 0,
+    hit_count INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT NOW(),
+    last_hit_at TIMESTAMP,
+    PRIMARY KEY (content_hash, extraction_version)
+);
+
+-- Per-tenant registry version, bumped whenever chemicals or sds_documents change.
+-- The API keeps a rendered registry snapshot per tenant and rebuilds it only
+-- when this number moves. Keyed by tenant, so no RLS (like sds_jobs).
+CREATE TABLE tenant_registry_versions (
+    tenant_id UUID PRIMARY KEY REFERENCES tenants(id),
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Dashboard rollups, kept current by statement triggers on chemicals, labels and
+-- token_usage so the dashboard reads one tenant's rows instead of aggregating.
+-- Counters: chemicals, status:<status>, storage:<class>, labels_generated,
+-- labels_printed, and usage_{tokens,cost,requests,cached}:<YYYY-MM>.
+-- Keyed by tenant, so no RLS (like tenant_registry_versions).
+CREATE TABLE tenant_counters (
+    tenant_id UUID NOT NULL REFERENCES tenants(id),
+    counter VARCHAR(80) NOT NULL,
+    value NUMERIC(16,6) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (tenant_id, counter)
+);
+
 -- ============================================================
 -- ROW LEVEL SECURITY
 -- ============================================================
@@ -146,86 +227,364 @@ ALTER TABLE chemical_locations FORCE ROW LEVEL SECURITY;
 ALTER TABLE compliance_events FORCE ROW LEVEL SECURITY;
 ALTER TABLE token_usage FORCE ROW LEVEL SECURITY;
 
+-- Policies compare UUIDs: current_tenant_id() is STABLE, so it is evaluated once
+-- per statement and tenant_id = <value> can use the (tenant_id, ...) indexes,
+-- where tenant_id::text = current_setting(...) had to cast and test every row.
+-- An unset context ('' after a SET LOCAL transaction ends) matches nothing.
+CREATE OR REPLACE FUNCTION current_tenant_id()
+RETURNS UUID AS $$
+    SELECT NULLIF(current_setting('app.current_tenant_id', true), '')::uuid;
+$$ LANGUAGE sql STABLE;
+
 -- Policies
 CREATE POLICY tenant_chemicals ON chemicals
-    FOR ALL USING (tenant_id::text = current_setting('app.current_tenant_id', true));
+    FOR ALL USING (tenant_id = current_tenant_id());
 
 CREATE POLICY tenant_sds_documents ON sds_documents
-    FOR ALL USING (tenant_id::text = current_setting('app.current_tenant_id', true));
+    FOR ALL USING (tenant_id = current_tenant_id());
 
 CREATE POLICY tenant_sds_sections ON sds_sections
-    FOR ALL USING (tenant_id::text = current_setting('app.current_tenant_id', true));
+    FOR ALL USING (tenant_id = current_tenant_id());
 
 CREATE POLICY tenant_labels ON labels
-    FOR ALL USING (tenant_id::text = current_setting('app.current_tenant_id', true));
+    FOR ALL USING (tenant_id = current_tenant_id());
 
 CREATE POLICY tenant_chemical_locations ON chemical_locations
-    FOR ALL USING (tenant_id::text = current_setting('app.current_tenant_id', true));
+    FOR ALL USING (tenant_id = current_tenant_id());
 
 CREATE POLICY tenant_compliance_events ON compliance_events
-    FOR ALL USING (tenant_id::text = current_setting('app.current_tenant_id', true));
+    FOR ALL USING (tenant_id = current_tenant_id());
 
 CREATE POLICY tenant_token_usage ON token_usage
-    FOR ALL USING (tenant_id::text = current_setting('app.current_tenant_id', true));
+    FOR ALL USING (tenant_id = current_tenant_id());
 
 -- ============================================================
 -- AUTO-STATUS TRIGGER
 -- ============================================================
 
+-- SDS expiry (3-year rule): current until revision + 3 years, then expiring_soon
+-- for 90 days, then expired. sds_next_status_change is the date the status next
+-- moves, so the daily job only has to visit rows whose date has come.
+CREATE OR REPLACE FUNCTION sds_status(revision DATE, as_of DATE DEFAULT CURRENT_DATE)
+RETURNS VARCHAR AS $$
+    SELECT CASE
+        WHEN revision IS NULL THEN 'expired'
+        WHEN as_of < (revision + INTERVAL '3 years')::date THEN 'current'
+        WHEN as_of < (revision + INTERVAL '3 years' + INTERVAL '90 days')::date THEN 'expiring_soon'
+        ELSE 'expired'
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION sds_next_status_change(revision DATE, as_of DATE DEFAULT CURRENT_DATE)
+RETURNS DATE AS $$
+    SELECT CASE
+        WHEN revision IS NULL THEN NULL
+        WHEN as_of < (revision + INTERVAL '3 years')::date THEN (revision + INTERVAL '3 years')::date
+        WHEN as_of < (revision + INTERVAL '3 years' + INTERVAL '90 days')::date
+            THEN (revision + INTERVAL '3 years' + INTERVAL '90 days')::date
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
 CREATE OR REPLACE FUNCTION update_chemical_sds_status()
 RETURNS TRIGGER AS $$
+DECLARE
+    -- Is this the chemical's newest document (what the API used to find with
+    -- ORDER BY upload_date DESC LIMIT 1)? Then chemicals.latest_sds_document_id points here.
+    is_latest BOOLEAN := NEW.chemical_id IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM chemicals c JOIN sds_documents d ON d.id = c.latest_sds_document_id
+        WHERE c.id = NEW.chemical_id AND d.id <> NEW.id AND d.upload_date > NEW.upload_date
+    );
 BEGIN
     -- Update chemical status based on latest SDS
     IF NEW.revision_date IS NOT NULL THEN
         UPDATE chemicals SET
             has_sds = true,
             sds_revision_date = NEW.revision_date,
-            status = CASE
-                WHEN NEW.revision_date > CURRENT_DATE - INTERVAL '3 years' THEN 'current'
-                WHEN NEW.revision_date > CURRENT_DATE - INTERVAL '3 years' - INTERVAL '90 days' THEN 'expiring_soon'
-                ELSE 'expired'
-            END,
+            status = sds_status(NEW.revision_date),
+            next_status_change = sds_next_status_change(NEW.revision_date),
+            latest_sds_document_id = CASE WHEN is_latest THEN NEW.id ELSE latest_sds_document_id END,
             updated_at = NOW()
         WHERE id = NEW.chemical_id;
+    ELSIF is_latest THEN
+        UPDATE chemicals SET latest_sds_document_id = NEW.id
+        WHERE id = NEW.chemical_id AND latest_sds_document_id IS DISTINCT FROM NEW.id;
+    END IF;
+
+    -- A document moved to another chemical: re-point the old one at its newest remaining document
+    IF TG_OP = 'UPDATE' AND OLD.chemical_id IS DISTINCT FROM NEW.chemical_id THEN
+        UPDATE chemicals SET latest_sds_document_id = (
+            SELECT id FROM sds_documents WHERE chemical_id = OLD.chemical_id AND id <> NEW.id
+            ORDER BY upload_date DESC LIMIT 1
+        )
+        WHERE id = OLD.chemical_id AND latest_sds_document_id = NEW.id;
     END IF;
 
     -- Set document status
     IF NEW.revision_date IS NOT NULL THEN
-        NEW.status = CASE
-            WHEN NEW.revision_date > CURRENT_DATE - INTERVAL '3 years' THEN 'current'
-            WHEN NEW.revision_date > CURRENT_DATE - INTERVAL '3 years' - INTERVAL '90 days' THEN 'expiring_soon'
-            ELSE 'expired'
-        END;
+        NEW.status = sds_status(NEW.revision_date);
+        NEW.next_status_change = sds_next_status_change(NEW.revision_date);
     END IF;
 
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
 
+-- Only a new document or a changed revision date / chemical re-derives status: the
+-- expiry job's status-only updates must not re-point the chemical at an older document
 CREATE TRIGGER sds_status_trigger
-    BEFORE INSERT OR UPDATE ON sds_documents
+    BEFORE INSERT OR UPDATE OF revision_date, chemical_id ON sds_documents
     FOR EACH ROW EXECUTE FUNCTION update_chemical_sds_status();
 
--- Daily refresh function
+-- Registry version bump: one statement-level trigger per event, since
+-- transition tables cannot be shared across events
+CREATE OR REPLACE FUNCTION bump_registry_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO tenant_registry_versions (tenant_id)
+        SELECT DISTINCT tenant_id FROM old_rows
+        ON CONFLICT (tenant_id) DO UPDATE
+            SET version = tenant_registry_versions.version + 1, updated_at = NOW();
+    ELSE
+        INSERT INTO tenant_registry_versions (tenant_id)
+        SELECT DISTINCT tenant_id FROM new_rows
+        ON CONFLICT (tenant_id) DO UPDATE
+            SET version = tenant_registry_versions.version + 1, updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER chemicals_registry_insert AFTER INSERT ON chemicals
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_registry_version();
+CREATE TRIGGER chemicals_registry_update AFTER UPDATE ON chemicals
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_registry_version();
+CREATE TRIGGER chemicals_registry_delete AFTER DELETE ON chemicals
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_registry_version();
+CREATE TRIGGER sds_documents_registry_insert AFTER INSERT ON sds_documents
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_registry_version();
+CREATE TRIGGER sds_documents_registry_update AFTER UPDATE ON sds_documents
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_registry_version();
+CREATE TRIGGER sds_documents_registry_delete AFTER DELETE ON sds_documents
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_registry_version();
+
+-- Dashboard counters: each trigger nets the statement's transition rows into
+-- (tenant, counter, delta) and upserts them in key order, so concurrent
+-- writers take the counter row locks in the same order.
+CREATE OR REPLACE FUNCTION rollup_chemical_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO tenant_counters (tenant_id, counter, value)
+        SELECT tenant_id, counter, SUM(delta) FROM (
+            SELECT n.tenant_id, k.counter, 1 AS delta FROM new_rows n,
+                LATERAL (VALUES ('chemicals'), ('status:' || COALESCE(n.status, 'none')),
+                                ('storage:' || COALESCE(n.storage_class, 'none'))) k(counter)
+        ) d GROUP BY tenant_id, counter ORDER BY tenant_id, counter
+        ON CONFLICT (tenant_id, counter) DO UPDATE
+            SET value = tenant_counters.value + EXCLUDED.value, updated_at = NOW();
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO tenant_counters (tenant_id, counter, value)
+        SELECT tenant_id, counter, SUM(delta) FROM (
+            SELECT o.tenant_id, k.counter, -1 AS delta FROM old_rows o,
+                LATERAL (VALUES ('chemicals'), ('status:' || COALESCE(o.status, 'none')),
+                                ('storage:' || COALESCE(o.storage_class, 'none'))) k(counter)
+        ) d GROUP BY tenant_id, counter ORDER BY tenant_id, counter
+        ON CONFLICT (tenant_id, counter) DO UPDATE
+            SET value = tenant_counters.value + EXCLUDED.value, updated_at = NOW();
+    ELSE
+        -- Only status and storage class can move; most updates (and the daily
+        -- status refresh, for most rows) net to zero and write nothing
+        INSERT INTO tenant_counters (tenant_id, counter, value)
+        SELECT tenant_id, counter, SUM(delta) FROM (
+            SELECT n.tenant_id, k.counter, 1 AS delta FROM new_rows n,
+                LATERAL (VALUES ('status:' || COALESCE(n.status, 'none')),
+                                ('storage:' || COALESCE(n.storage_class, 'none'))) k(counter)
+            UNION ALL
+            SELECT o.tenant_id, k.counter, -1 FROM old_rows o,
+                LATERAL (VALUES ('status:' || COALESCE(o.status, 'none')),
+                                ('storage:' || COALESCE(o.storage_class, 'none'))) k(counter)
+        ) d GROUP BY tenant_id, counter HAVING SUM(delta) <> 0 ORDER BY tenant_id, counter
+        ON CONFLICT (tenant_id, counter) DO UPDATE
+            SET value = tenant_counters.value + EXCLUDED.value, updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_label_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO tenant_counters (tenant_id, counter, value)
+        SELECT n.tenant_id, k.counter, SUM(k.delta) FROM new_rows n,
+            LATERAL (VALUES ('labels_generated', COALESCE(n.generated_count, 0)),
+                            ('labels_printed', COALESCE(n.print_count, 0))) k(counter, delta)
+        GROUP BY 1, 2 HAVING SUM(k.delta) <> 0 ORDER BY 1, 2
+        ON CONFLICT (tenant_id, counter) DO UPDATE
+            SET value = tenant_counters.value + EXCLUDED.value, updated_at = NOW();
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO tenant_counters (tenant_id, counter, value)
+        SELECT o.tenant_id, k.counter, -SUM(k.delta) FROM old_rows o,
+            LATERAL (VALUES ('labels_generated', COALESCE(o.generated_count, 0)),
+                            ('labels_printed', COALESCE(o.print_count, 0))) k(counter, delta)
+        GROUP BY 1, 2 HAVING SUM(k.delta) <> 0 ORDER BY 1, 2
+        ON CONFLICT (tenant_id, counter) DO UPDATE
+            SET value = tenant_counters.value + EXCLUDED.value, updated_at = NOW();
+    ELSE
+        INSERT INTO tenant_counters (tenant_id, counter, value)
+        SELECT tenant_id, counter, SUM(delta) FROM (
+            SELECT n.tenant_id, k.counter, k.delta FROM new_rows n,
+                LATERAL (VALUES ('labels_generated', COALESCE(n.generated_count, 0)),
+                                ('labels_printed', COALESCE(n.print_count, 0))) k(counter, delta)
+            UNION ALL
+            SELECT o.tenant_id, k.counter, -k.delta FROM old_rows o,
+                LATERAL (VALUES ('labels_generated', COALESCE(o.generated_count, 0)),
+                                ('labels_printed', COALESCE(o.print_count, 0))) k(counter, delta)
+        ) d GROUP BY tenant_id, counter HAVING SUM(delta) <> 0 ORDER BY tenant_id, counter
+        ON CONFLICT (tenant_id, counter) DO UPDATE
+            SET value = tenant_counters.value + EXCLUDED.value, updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- token_usage is append-only; usage counters are per calendar month
+CREATE OR REPLACE FUNCTION rollup_usage_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO tenant_counters (tenant_id, counter, value)
+    SELECT tenant_id, counter, SUM(delta) FROM (
+        SELECT n.tenant_id, k.counter || ':' || to_char(n.timestamp, 'YYYY-MM') AS counter, k.delta FROM new_rows n,
+            LATERAL (VALUES ('usage_tokens', COALESCE(n.input_tokens, 0) + COALESCE(n.output_tokens, 0)),
+                            ('usage_cost', COALESCE(n.cost, 0)),
+                            ('usage_requests', 1),
+                            ('usage_cached', CASE WHEN n.request_type LIKE '%\_cached' THEN 1 ELSE 0 END)) k(counter, delta)
+    ) d GROUP BY tenant_id, counter HAVING SUM(delta) <> 0 ORDER BY tenant_id, counter
+    ON CONFLICT (tenant_id, counter) DO UPDATE
+        SET value = tenant_counters.value + EXCLUDED.value, updated_at = NOW();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER chemicals_counters_insert AFTER INSERT ON chemicals
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_chemical_counters();
+CREATE TRIGGER chemicals_counters_update AFTER UPDATE ON chemicals
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_chemical_counters();
+CREATE TRIGGER chemicals_counters_delete AFTER DELETE ON chemicals
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_chemical_counters();
+CREATE TRIGGER labels_counters_insert AFTER INSERT ON labels
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_label_counters();
+CREATE TRIGGER labels_counters_update AFTER UPDATE ON labels
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_label_counters();
+CREATE TRIGGER labels_counters_delete AFTER DELETE ON labels
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_label_counters();
+CREATE TRIGGER token_usage_counters_insert AFTER INSERT ON token_usage
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_usage_counters();
+
+-- Recompute a tenant's counters from the base tables (backfill, or repair after
+-- bulk maintenance that bypassed the triggers, e.g. TRUNCATE)
+CREATE OR REPLACE FUNCTION rebuild_tenant_counters(tid UUID)
+RETURNS void AS $$
+BEGIN
+    DELETE FROM tenant_counters WHERE tenant_id = tid;
+    INSERT INTO tenant_counters (tenant_id, counter, value)
+    SELECT tid, counter, value FROM (
+        SELECT 'chemicals' AS counter, COUNT(*)::numeric AS value FROM chemicals WHERE tenant_id = tid
+        UNION ALL
+        SELECT 'status:' || COALESCE(status, 'none'), COUNT(*) FROM chemicals WHERE tenant_id = tid GROUP BY status
+        UNION ALL
+        SELECT 'storage:' || COALESCE(storage_class, 'none'), COUNT(*) FROM chemicals WHERE tenant_id = tid GROUP BY storage_class
+        UNION ALL
+        SELECT 'labels_generated', COALESCE(SUM(generated_count), 0) FROM labels WHERE tenant_id = tid
+        UNION ALL
+        SELECT 'labels_printed', COALESCE(SUM(print_count), 0) FROM labels WHERE tenant_id = tid
+        UNION ALL
+        SELECT k.counter || ':' || m.month, k.value FROM (
+            SELECT to_char(timestamp, 'YYYY-MM') AS month,
+                   SUM(COALESCE(input_tokens, 0) + COALESCE(output_tokens, 0)) AS tokens, SUM(COALESCE(cost, 0)) AS cost,
+                   COUNT(*) AS requests, COUNT(*) FILTER (WHERE request_type LIKE '%\_cached') AS cached
+            FROM token_usage WHERE tenant_id = tid GROUP BY 1
+        ) m, LATERAL (VALUES ('usage_tokens', m.tokens::numeric), ('usage_cost', m.cost),
+                             ('usage_requests', m.requests::numeric), ('usage_cached', m.cached::numeric)) k(counter, value)
+    ) c WHERE value <> 0;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Daily expiry step: moves only the documents and chemicals whose
+-- next_status_change has come (via the partial indexes below), records a
+-- compliance event per chemical that changed, and returns the counts. Work is
+-- proportional to the day's transitions, not the table size. Runs as owner so
+-- the scheduler can advance every tenant without RLS context; catches up
+-- missed days on its own since due dates stay due until advanced.
+CREATE OR REPLACE FUNCTION advance_sds_statuses(as_of DATE DEFAULT CURRENT_DATE)
+RETURNS TABLE (documents_changed INTEGER, chemicals_changed INTEGER) AS $$
+DECLARE
+    docs INTEGER;
+    chems INTEGER;
+BEGIN
+    UPDATE sds_documents SET
+        status = sds_status(revision_date, as_of),
+        next_status_change = sds_next_status_change(revision_date, as_of)
+    WHERE next_status_change <= as_of;
+    GET DIAGNOSTICS docs = ROW_COUNT;
+
+    WITH due AS (
+        SELECT id, status FROM chemicals
+        WHERE next_status_change <= as_of
+        FOR UPDATE
+    ), moved AS (
+        UPDATE chemicals c SET
+            status = CASE WHEN c.has_sds THEN sds_status(c.sds_revision_date, as_of) ELSE 'missing_sds' END,
+            next_status_change = CASE WHEN c.has_sds THEN sds_next_status_change(c.sds_revision_date, as_of) END,
+            updated_at = NOW()
+        FROM due
+        WHERE c.id = due.id
+        RETURNING c.tenant_id, c.id, due.status AS old_status, c.status AS new_status, c.sds_revision_date
+    )
+    INSERT INTO compliance_events (tenant_id, chemical_id, event_type, event_data)
+    SELECT tenant_id, id, 'sds_status_changed',
+           jsonb_build_object('from', old_status, 'to', new_status,
+                              'revision_date', sds_revision_date, 'as_of', as_of)
+    FROM moved
+    WHERE old_status IS DISTINCT FROM new_status;
+    GET DIAGNOSTICS chems = ROW_COUNT;
+
+    RETURN QUERY SELECT docs, chems;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Full reconciliation (after bulk imports that bypassed the trigger, or a change
+-- to the expiry rule). Writes only the rows whose status or due date differ.
 CREATE OR REPLACE FUNCTION refresh_sds_statuses()
 RETURNS void AS $$
 BEGIN
     UPDATE sds_documents SET
-        status = CASE
-            WHEN revision_date > CURRENT_DATE - INTERVAL '3 years' THEN 'current'
-            WHEN revision_date > CURRENT_DATE - INTERVAL '3 years' - INTERVAL '90 days' THEN 'expiring_soon'
-            ELSE 'expired'
-        END
-    WHERE revision_date IS NOT NULL;
+        status = sds_status(revision_date),
+        next_status_change = sds_next_status_change(revision_date)
+    WHERE revision_date IS NOT NULL
+      AND (status IS DISTINCT FROM sds_status(revision_date)
+           OR next_status_change IS DISTINCT FROM sds_next_status_change(revision_date));
 
     UPDATE chemicals SET
-        status = CASE
-            WHEN NOT has_sds THEN 'missing_sds'
-            WHEN sds_revision_date > CURRENT_DATE - INTERVAL '3 years' THEN 'current'
-            WHEN sds_revision_date > CURRENT_DATE - INTERVAL '3 years' - INTERVAL '90 days' THEN 'expiring_soon'
-            ELSE 'expired'
-        END,
-        updated_at = NOW();
+        status = CASE WHEN has_sds THEN sds_status(sds_revision_date) ELSE 'missing_sds' END,
+        next_status_change = CASE WHEN has_sds THEN sds_next_status_change(sds_revision_date) END,
+        updated_at = NOW()
+    WHERE status IS DISTINCT FROM CASE WHEN has_sds THEN sds_status(sds_revision_date) ELSE 'missing_sds' END
+       OR next_status_change IS DISTINCT FROM CASE WHEN has_sds THEN sds_next_status_change(sds_revision_date) END;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -240,6 +599,9 @@ GRANT SELECT, INSERT, UPDATE, DELETE ON ALL TABLES IN SCHEMA public TO sds_app;
 GRANT USAGE, SELECT ON ALL SEQUENCES IN SCHEMA public TO sds_app;
 ALTER DEFAULT PRIVILEGES IN SCHEMA public GRANT SELECT, INSERT, UPDATE, DELETE ON TABLES TO sds_app;
 ALTER DEFAULT PRIVILEGES IN SCHEMA public GRANT USAGE, SELECT ON SEQUENCES TO sds_app;
+-- advance_sds_statuses runs as owner (across tenants): only the app may call it
+REVOKE EXECUTE ON FUNCTION advance_sds_statuses(DATE) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION advance_sds_statuses(DATE) TO sds_app;
 
 -- ============================================================
 -- INDEXES
@@ -250,15 +612,31 @@ CREATE INDEX idx_chemicals_cas ON chemicals(tenant_id, cas_number);
 CREATE INDEX idx_chemicals_status ON chemicals(tenant_id, status);
 CREATE INDEX idx_chemicals_location ON chemicals(tenant_id, location);
 CREATE INDEX idx_chemicals_storage ON chemicals(tenant_id, storage_class);
+-- Registry listing order and keyset cursor: (chemical_name, id) within a tenant
+CREATE INDEX idx_chemicals_name ON chemicals(tenant_id, chemical_name, id);
 CREATE INDEX idx_sds_documents_tenant ON sds_documents(tenant_id);
-CREATE INDEX idx_sds_documents_chemical ON sds_documents(chemical_id);
+-- Newest SDS per chemical (trigger bookkeeping, repair) is a single index probe
+CREATE INDEX idx_sds_documents_latest ON sds_documents(chemical_id, upload_date DESC);
+-- Reverse lookup for the latest-SDS pointer (ON DELETE SET NULL, re-pointing)
+CREATE INDEX idx_chemicals_latest_sds ON chemicals(latest_sds_document_id);
 CREATE INDEX idx_sds_sections_doc ON sds_sections(sds_document_id);
 CREATE INDEX idx_labels_chemical ON labels(chemical_id);
 CREATE INDEX idx_labels_tenant ON labels(tenant_id);
+-- One rendering per chemical, SDS revision, label type/size and template version
+CREATE UNIQUE INDEX idx_labels_render_key ON labels(tenant_id, chemical_id, sds_document_id, label_type, label_size, template_version)
+    NULLS NOT DISTINCT;
 CREATE INDEX idx_chemical_locations_tenant ON chemical_locations(tenant_id);
-CREATE INDEX idx_compliance_events_tenant ON compliance_events(tenant_id);
+-- Dashboard activity feed: newest events per tenant
+CREATE INDEX idx_compliance_events_tenant ON compliance_events(tenant_id, created_at DESC);
 CREATE INDEX idx_token_usage_tenant ON token_usage(tenant_id);
 CREATE INDEX idx_users_email ON users(email);
+CREATE INDEX idx_sds_jobs_tenant ON sds_jobs(tenant_id);
+CREATE INDEX idx_sds_jobs_batch ON sds_jobs(batch_id);
+CREATE INDEX idx_sds_jobs_pending ON sds_jobs(created_at) WHERE status IN ('queued', 'running');
+CREATE INDEX idx_sds_documents_hash ON sds_documents(content_hash);
+-- Expiry scheduler: only rows with a pending transition are indexed
+CREATE INDEX idx_chemicals_next_status ON chemicals(next_status_change) WHERE next_status_change IS NOT NULL;
+CREATE INDEX idx_sds_documents_next_status ON sds_documents(next_status_change) WHERE next_status_change IS NOT NULL;
 
 -- ============================================================
 -- SEED DATA
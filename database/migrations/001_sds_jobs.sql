@@ -0,0 +1,30 @@
+-- 001: async ingestion queue for /sds/upload
+--
+-- For databases created from init.sql before this change; init.sql already has it.
+-- Idempotent; deploy.sh applies every file in this directory in order with
+-- ON_ERROR_STOP.
+
+BEGIN;
+
+-- Workers claim jobs across tenants, so there is no RLS here -- endpoints
+-- filter on tenant_id explicitly.
+CREATE TABLE IF NOT EXISTS sds_jobs (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    tenant_id UUID NOT NULL REFERENCES tenants(id),
+    created_by UUID REFERENCES users(id),
+    file_path VARCHAR(500) NOT NULL,
+    file_name VARCHAR(255) NOT NULL,
+    file_size BIGINT DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',  -- queued, running, done, error
+    attempts INTEGER DEFAULT 0,
+    result JSONB,  -- same payload the synchronous upload used to return
+    error TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_sds_jobs_tenant ON sds_jobs(tenant_id);
+CREATE INDEX IF NOT EXISTS idx_sds_jobs_pending ON sds_jobs(created_at) WHERE status IN ('queued', 'running');
+
+COMMIT;
@@ -0,0 +1,24 @@
+-- 002: bulk import batches for /sds/bulk
+--
+-- For databases created from init.sql before this change; init.sql already has it.
+-- Idempotent; deploy.sh applies every file in this directory in order with
+-- ON_ERROR_STOP.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS sds_batches (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    tenant_id UUID NOT NULL REFERENCES tenants(id),
+    created_by UUID REFERENCES users(id),
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',  -- queued, running, done
+    total_files INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT NOW(),
+    finished_at TIMESTAMP
+);
+
+-- null for single uploads; sds_jobs.status also takes 'skipped' now
+ALTER TABLE sds_jobs ADD COLUMN IF NOT EXISTS batch_id UUID REFERENCES sds_batches(id);
+
+CREATE INDEX IF NOT EXISTS idx_sds_jobs_batch ON sds_jobs(batch_id);
+
+COMMIT;
@@ -0,0 +1,27 @@
+-- 003: content hashes and the shared extraction cache
+--
+-- For databases created from init.sql before this change; init.sql already has it.
+-- Idempotent; deploy.sh applies every file in this directory in order with
+-- ON_ERROR_STOP.
+
+BEGIN;
+
+ALTER TABLE sds_documents ADD COLUMN IF NOT EXISTS content_hash CHAR(64);  -- sha256 of the uploaded file
+ALTER TABLE sds_jobs ADD COLUMN IF NOT EXISTS content_hash CHAR(64);  -- sha256 of the file bytes
+
+-- Extraction results keyed by file content, shared across tenants
+CREATE TABLE IF NOT EXISTS sds_extraction_cache (
+    content_hash CHAR(64) NOT NULL,
+    extraction_version VARCHAR(32) NOT NULL,
+    extracted_data JSONB NOT NULL,
+    input_tokens INTEGER DEFAULT 0,  -- cost of the original extraction
+    output_tokens INTEGER DEFAULT 0,
+    hit_count INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT NOW(),
+    last_hit_at TIMESTAMP,
+    PRIMARY KEY (content_hash, extraction_version)
+);
+
+CREATE INDEX IF NOT EXISTS idx_sds_documents_hash ON sds_documents(content_hash);
+
+COMMIT;
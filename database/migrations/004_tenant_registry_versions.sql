@@ -0,0 +1,64 @@
+-- 004: per-tenant registry version and the triggers that bump it
+--
+-- For databases created from init.sql before this change; init.sql already has it.
+-- Idempotent; deploy.sh applies every file in this directory in order with
+-- ON_ERROR_STOP.
+
+BEGIN;
+
+-- Keyed by tenant, so no RLS (like sds_jobs)
+CREATE TABLE IF NOT EXISTS tenant_registry_versions (
+    tenant_id UUID PRIMARY KEY REFERENCES tenants(id),
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Every existing tenant starts at version 1, like the first bump would create
+INSERT INTO tenant_registry_versions (tenant_id)
+SELECT id FROM tenants
+ON CONFLICT (tenant_id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_registry_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO tenant_registry_versions (tenant_id)
+        SELECT DISTINCT tenant_id FROM old_rows
+        ON CONFLICT (tenant_id) DO UPDATE
+            SET version = tenant_registry_versions.version + 1, updated_at = NOW();
+    ELSE
+        INSERT INTO tenant_registry_versions (tenant_id)
+        SELECT DISTINCT tenant_id FROM new_rows
+        ON CONFLICT (tenant_id) DO UPDATE
+            SET version = tenant_registry_versions.version + 1, updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS chemicals_registry_insert ON chemicals;
+CREATE TRIGGER chemicals_registry_insert AFTER INSERT ON chemicals
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_registry_version();
+DROP TRIGGER IF EXISTS chemicals_registry_update ON chemicals;
+CREATE TRIGGER chemicals_registry_update AFTER UPDATE ON chemicals
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_registry_version();
+DROP TRIGGER IF EXISTS chemicals_registry_delete ON chemicals;
+CREATE TRIGGER chemicals_registry_delete AFTER DELETE ON chemicals
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_registry_version();
+DROP TRIGGER IF EXISTS sds_documents_registry_insert ON sds_documents;
+CREATE TRIGGER sds_documents_registry_insert AFTER INSERT ON sds_documents
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_registry_version();
+DROP TRIGGER IF EXISTS sds_documents_registry_update ON sds_documents;
+CREATE TRIGGER sds_documents_registry_update AFTER UPDATE ON sds_documents
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_registry_version();
+DROP TRIGGER IF EXISTS sds_documents_registry_delete ON sds_documents;
+CREATE TRIGGER sds_documents_registry_delete AFTER DELETE ON sds_documents
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_registry_version();
+
+COMMIT;
@@ -0,0 +1,27 @@
+-- 005: stored labels keyed by SDS revision and template version
+--
+-- For databases created from init.sql before this change; init.sql already has it.
+-- Idempotent; deploy.sh applies every file in this directory in order with
+-- ON_ERROR_STOP.
+
+BEGIN;
+
+ALTER TABLE labels ADD COLUMN IF NOT EXISTS sds_document_id UUID REFERENCES sds_documents(id);
+ALTER TABLE labels ADD COLUMN IF NOT EXISTS template_version VARCHAR(40);
+ALTER TABLE labels ADD COLUMN IF NOT EXISTS generated_count INTEGER DEFAULT 1;
+ALTER TABLE labels ADD COLUMN IF NOT EXISTS last_generated TIMESTAMP DEFAULT NOW();
+
+-- Labels rendered before the render key existed would all collide on
+-- (chemical, NULL, type, size, NULL). Give each its own legacy version: it never
+-- matches a current template version, so the next request renders afresh, and
+-- print counts and history stay intact.
+UPDATE labels
+SET template_version = 'legacy-' || replace(id::text, '-', ''),
+    last_generated = created_at
+WHERE template_version IS NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_labels_render_key
+    ON labels(tenant_id, chemical_id, sds_document_id, label_type, label_size, template_version)
+    NULLS NOT DISTINCT;
+
+COMMIT;
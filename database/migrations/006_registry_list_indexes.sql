@@ -0,0 +1,16 @@
+-- 006: indexes behind the keyset-paginated /sds/chemicals
+--
+-- For databases created from init.sql before this change; init.sql already has it.
+-- Idempotent; deploy.sh applies every file in this directory in order with
+-- ON_ERROR_STOP. The index builds lock their tables for writes: on large
+-- installs, run them with CONCURRENTLY first.
+
+BEGIN;
+
+-- Registry listing order and keyset cursor: (chemical_name, id) within a tenant
+CREATE INDEX IF NOT EXISTS idx_chemicals_name ON chemicals(tenant_id, chemical_name, id);
+-- Latest SDS per chemical (ORDER BY upload_date DESC LIMIT 1) is a single index probe
+CREATE INDEX IF NOT EXISTS idx_sds_documents_latest ON sds_documents(chemical_id, upload_date DESC);
+DROP INDEX IF EXISTS idx_sds_documents_chemical;  -- prefix of idx_sds_documents_latest
+
+COMMIT;
@@ -0,0 +1,190 @@
+-- 007: trigger-maintained dashboard rollups
+--
+-- For databases created from init.sql before this change; init.sql already has it.
+-- Idempotent; deploy.sh applies every file in this directory in order with
+-- ON_ERROR_STOP. Creating the triggers locks chemicals, labels and token_usage
+-- against writes until COMMIT, so the backfill below cannot miss a change.
+
+BEGIN;
+
+-- Keyed by tenant, so no RLS (like tenant_registry_versions)
+CREATE TABLE IF NOT EXISTS tenant_counters (
+    tenant_id UUID NOT NULL REFERENCES tenants(id),
+    counter VARCHAR(80) NOT NULL,
+    value NUMERIC(16,6) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (tenant_id, counter)
+);
+
+-- Dashboard counters: each trigger nets the statement's transition rows into
+-- (tenant, counter, delta) and upserts them in key order, so concurrent
+-- writers take the counter row locks in the same order.
+CREATE OR REPLACE FUNCTION rollup_chemical_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO tenant_counters (tenant_id, counter, value)
+        SELECT tenant_id, counter, SUM(delta) FROM (
+            SELECT n.tenant_id, k.counter, 1 AS delta FROM new_rows n,
+                LATERAL (VALUES ('chemicals'), ('status:' || COALESCE(n.status, 'none')),
+                                ('storage:' || COALESCE(n.storage_class, 'none'))) k(counter)
+        ) d GROUP BY tenant_id, counter ORDER BY tenant_id, counter
+        ON CONFLICT (tenant_id, counter) DO UPDATE
+            SET value = tenant_counters.value + EXCLUDED.value, updated_at = NOW();
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO tenant_counters (tenant_id, counter, value)
+        SELECT tenant_id, counter, SUM(delta) FROM (
+            SELECT o.tenant_id, k.counter, -1 AS delta FROM old_rows o,
+                LATERAL (VALUES ('chemicals'), ('status:' || COALESCE(o.status, 'none')),
+                                ('storage:' || COALESCE(o.storage_class, 'none'))) k(counter)
+        ) d GROUP BY tenant_id, counter ORDER BY tenant_id, counter
+        ON CONFLICT (tenant_id, counter) DO UPDATE
+            SET value = tenant_counters.value + EXCLUDED.value, updated_at = NOW();
+    ELSE
+        -- Only status and storage class can move; most updates (and the daily
+        -- status refresh, for most rows) net to zero and write nothing
+        INSERT INTO tenant_counters (tenant_id, counter, value)
+        SELECT tenant_id, counter, SUM(delta) FROM (
+            SELECT n.tenant_id, k.counter, 1 AS delta FROM new_rows n,
+                LATERAL (VALUES ('status:' || COALESCE(n.status, 'none')),
+                                ('storage:' || COALESCE(n.storage_class, 'none'))) k(counter)
+            UNION ALL
+            SELECT o.tenant_id, k.counter, -1 FROM old_rows o,
+                LATERAL (VALUES ('status:' || COALESCE(o.status, 'none')),
+                                ('storage:' || COALESCE(o.storage_class, 'none'))) k(counter)
+        ) d GROUP BY tenant_id, counter HAVING SUM(delta) <> 0 ORDER BY tenant_id, counter
+        ON CONFLICT (tenant_id, counter) DO UPDATE
+            SET value = tenant_counters.value + EXCLUDED.value, updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_label_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO tenant_counters (tenant_id, counter, value)
+        SELECT n.tenant_id, k.counter, SUM(k.delta) FROM new_rows n,
+            LATERAL (VALUES ('labels_generated', COALESCE(n.generated_count, 0)),
+                            ('labels_printed', COALESCE(n.print_count, 0))) k(counter, delta)
+        GROUP BY 1, 2 HAVING SUM(k.delta) <> 0 ORDER BY 1, 2
+        ON CONFLICT (tenant_id, counter) DO UPDATE
+            SET value = tenant_counters.value + EXCLUDED.value, updated_at = NOW();
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO tenant_counters (tenant_id, counter, value)
+        SELECT o.tenant_id, k.counter, -SUM(k.delta) FROM old_rows o,
+            LATERAL (VALUES ('labels_generated', COALESCE(o.generated_count, 0)),
+                            ('labels_printed', COALESCE(o.print_count, 0))) k(counter, delta)
+        GROUP BY 1, 2 HAVING SUM(k.delta) <> 0 ORDER BY 1, 2
+        ON CONFLICT (tenant_id, counter) DO UPDATE
+            SET value = tenant_counters.value + EXCLUDED.value, updated_at = NOW();
+    ELSE
+        INSERT INTO tenant_counters (tenant_id, counter, value)
+        SELECT tenant_id, counter, SUM(delta) FROM (
+            SELECT n.tenant_id, k.counter, k.delta FROM new_rows n,
+                LATERAL (VALUES ('labels_generated', COALESCE(n.generated_count, 0)),
+                                ('labels_printed', COALESCE(n.print_count, 0))) k(counter, delta)
+            UNION ALL
+            SELECT o.tenant_id, k.counter, -k.delta FROM old_rows o,
+                LATERAL (VALUES ('labels_generated', COALESCE(o.generated_count, 0)),
+                                ('labels_printed', COALESCE(o.print_count, 0))) k(counter, delta)
+        ) d GROUP BY tenant_id, counter HAVING SUM(delta) <> 0 ORDER BY tenant_id, counter
+        ON CONFLICT (tenant_id, counter) DO UPDATE
+            SET value = tenant_counters.value + EXCLUDED.value, updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- token_usage is append-only; usage counters are per calendar month
+CREATE OR REPLACE FUNCTION rollup_usage_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO tenant_counters (tenant_id, counter, value)
+    SELECT tenant_id, counter, SUM(delta) FROM (
+        SELECT n.tenant_id, k.counter || ':' || to_char(n.timestamp, 'YYYY-MM') AS counter, k.delta FROM new_rows n,
+            LATERAL (VALUES ('usage_tokens', COALESCE(n.input_tokens, 0) + COALESCE(n.output_tokens, 0)),
+                            ('usage_cost', COALESCE(n.cost, 0)),
+                            ('usage_requests', 1),
+                            ('usage_cached', CASE WHEN n.request_type LIKE '%\_cached' THEN 1 ELSE 0 END)) k(counter, delta)
+    ) d GROUP BY tenant_id, counter HAVING SUM(delta) <> 0 ORDER BY tenant_id, counter
+    ON CONFLICT (tenant_id, counter) DO UPDATE
+        SET value = tenant_counters.value + EXCLUDED.value, updated_at = NOW();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS chemicals_counters_insert ON chemicals;
+CREATE TRIGGER chemicals_counters_insert AFTER INSERT ON chemicals
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_chemical_counters();
+DROP TRIGGER IF EXISTS chemicals_counters_update ON chemicals;
+CREATE TRIGGER chemicals_counters_update AFTER UPDATE ON chemicals
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_chemical_counters();
+DROP TRIGGER IF EXISTS chemicals_counters_delete ON chemicals;
+CREATE TRIGGER chemicals_counters_delete AFTER DELETE ON chemicals
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_chemical_counters();
+DROP TRIGGER IF EXISTS labels_counters_insert ON labels;
+CREATE TRIGGER labels_counters_insert AFTER INSERT ON labels
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_label_counters();
+DROP TRIGGER IF EXISTS labels_counters_update ON labels;
+CREATE TRIGGER labels_counters_update AFTER UPDATE ON labels
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_label_counters();
+DROP TRIGGER IF EXISTS labels_counters_delete ON labels;
+CREATE TRIGGER labels_counters_delete AFTER DELETE ON labels
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_label_counters();
+DROP TRIGGER IF EXISTS token_usage_counters_insert ON token_usage;
+CREATE TRIGGER token_usage_counters_insert AFTER INSERT ON token_usage
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_usage_counters();
+
+-- Recompute a tenant's counters from the base tables (backfill, or repair after
+-- bulk maintenance that bypassed the triggers, e.g. TRUNCATE)
+CREATE OR REPLACE FUNCTION rebuild_tenant_counters(tid UUID)
+RETURNS void AS $$
+BEGIN
+    DELETE FROM tenant_counters WHERE tenant_id = tid;
+    INSERT INTO tenant_counters (tenant_id, counter, value)
+    SELECT tid, counter, value FROM (
+        SELECT 'chemicals' AS counter, COUNT(*)::numeric AS value FROM chemicals WHERE tenant_id = tid
+        UNION ALL
+        SELECT 'status:' || COALESCE(status, 'none'), COUNT(*) FROM chemicals WHERE tenant_id = tid GROUP BY status
+        UNION ALL
+        SELECT 'storage:' || COALESCE(storage_class, 'none'), COUNT(*) FROM chemicals WHERE tenant_id = tid GROUP BY storage_class
+        UNION ALL
+        SELECT 'labels_generated', COALESCE(SUM(generated_count), 0) FROM labels WHERE tenant_id = tid
+        UNION ALL
+        SELECT 'labels_printed', COALESCE(SUM(print_count), 0) FROM labels WHERE tenant_id = tid
+        UNION ALL
+        SELECT k.counter || ':' || m.month, k.value FROM (
+            SELECT to_char(timestamp, 'YYYY-MM') AS month,
+                   SUM(COALESCE(input_tokens, 0) + COALESCE(output_tokens, 0)) AS tokens, SUM(COALESCE(cost, 0)) AS cost,
+                   COUNT(*) AS requests, COUNT(*) FILTER (WHERE request_type LIKE '%\_cached') AS cached
+            FROM token_usage WHERE tenant_id = tid GROUP BY 1
+        ) m, LATERAL (VALUES ('usage_tokens', m.tokens::numeric), ('usage_cost', m.cost),
+                             ('usage_requests', m.requests::numeric), ('usage_cached', m.cached::numeric)) k(counter, value)
+    ) c WHERE value <> 0;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Backfill tenants that have no counters yet (all of them on the first run)
+SELECT rebuild_tenant_counters(t.id) FROM tenants t
+WHERE NOT EXISTS (SELECT 1 FROM tenant_counters c WHERE c.tenant_id = t.id);
+
+-- Dashboard activity feed: newest events per tenant
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_indexes
+                   WHERE indexname = 'idx_compliance_events_tenant' AND indexdef LIKE '%created_at%') THEN
+        DROP INDEX IF EXISTS idx_compliance_events_tenant;
+        CREATE INDEX idx_compliance_events_tenant ON compliance_events(tenant_id, created_at DESC);
+    END IF;
+END $$;
+
+COMMIT;
@@ -0,0 +1,156 @@
+-- 008: incremental SDS expiry (next_status_change + advance_sds_statuses)
+--
+-- For databases created from init.sql before this change; init.sql already has it.
+-- Idempotent; deploy.sh applies every file in this directory in order with
+-- ON_ERROR_STOP. The API's expiry loop calls advance_sds_statuses() hourly.
+
+BEGIN;
+
+ALTER TABLE chemicals ADD COLUMN IF NOT EXISTS next_status_change DATE;  -- when status next moves
+ALTER TABLE sds_documents ADD COLUMN IF NOT EXISTS next_status_change DATE;
+
+-- SDS expiry (3-year rule): current until revision + 3 years, then expiring_soon
+-- for 90 days, then expired. sds_next_status_change is the date the status next
+-- moves, so the daily job only has to visit rows whose date has come.
+CREATE OR REPLACE FUNCTION sds_status(revision DATE, as_of DATE DEFAULT CURRENT_DATE)
+RETURNS VARCHAR AS $$
+    SELECT CASE
+        WHEN revision IS NULL THEN 'expired'
+        WHEN as_of < (revision + INTERVAL '3 years')::date THEN 'current'
+        WHEN as_of < (revision + INTERVAL '3 years' + INTERVAL '90 days')::date THEN 'expiring_soon'
+        ELSE 'expired'
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION sds_next_status_change(revision DATE, as_of DATE DEFAULT CURRENT_DATE)
+RETURNS DATE AS $$
+    SELECT CASE
+        WHEN revision IS NULL THEN NULL
+        WHEN as_of < (revision + INTERVAL '3 years')::date THEN (revision + INTERVAL '3 years')::date
+        WHEN as_of < (revision + INTERVAL '3 years' + INTERVAL '90 days')::date
+            THEN (revision + INTERVAL '3 years' + INTERVAL '90 days')::date
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- 009 replaces this with the version that also maintains chemicals.latest_sds_document_id.
+-- Every deploy re-runs 008 before 009: never put the older body back, even for the moment
+-- between the two, or documents inserted meanwhile leave the pointer stale.
+DO $do$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'update_chemical_sds_status'
+                   AND prosrc LIKE '%latest_sds_document_id%') THEN
+        CREATE OR REPLACE FUNCTION update_chemical_sds_status()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            -- Update chemical status based on latest SDS
+            IF NEW.revision_date IS NOT NULL THEN
+                UPDATE chemicals SET
+                    has_sds = true,
+                    sds_revision_date = NEW.revision_date,
+                    status = sds_status(NEW.revision_date),
+                    next_status_change = sds_next_status_change(NEW.revision_date),
+                    updated_at = NOW()
+                WHERE id = NEW.chemical_id;
+            END IF;
+
+            -- Set document status
+            IF NEW.revision_date IS NOT NULL THEN
+                NEW.status = sds_status(NEW.revision_date);
+                NEW.next_status_change = sds_next_status_change(NEW.revision_date);
+            END IF;
+
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    END IF;
+END $do$;
+
+-- Only a new document or a changed revision date re-derives status: the expiry
+-- job's status-only updates must not re-point the chemical at an older document
+DROP TRIGGER IF EXISTS sds_status_trigger ON sds_documents;
+CREATE TRIGGER sds_status_trigger
+    BEFORE INSERT OR UPDATE OF revision_date, chemical_id ON sds_documents
+    FOR EACH ROW EXECUTE FUNCTION update_chemical_sds_status();
+
+-- Daily expiry step: moves only the documents and chemicals whose
+-- next_status_change has come (via the partial indexes below), records a
+-- compliance event per chemical that changed, and returns the counts. Work is
+-- proportional to the day's transitions, not the table size. Runs as owner so
+-- the scheduler can advance every tenant without RLS context; catches up
+-- missed days on its own since due dates stay due until advanced.
+CREATE OR REPLACE FUNCTION advance_sds_statuses(as_of DATE DEFAULT CURRENT_DATE)
+RETURNS TABLE (documents_changed INTEGER, chemicals_changed INTEGER) AS $$
+DECLARE
+    docs INTEGER;
+    chems INTEGER;
+BEGIN
+    UPDATE sds_documents SET
+        status = sds_status(revision_date, as_of),
+        next_status_change = sds_next_status_change(revision_date, as_of)
+    WHERE next_status_change <= as_of;
+    GET DIAGNOSTICS docs = ROW_COUNT;
+
+    WITH due AS (
+        SELECT id, status FROM chemicals
+        WHERE next_status_change <= as_of
+        FOR UPDATE
+    ), moved AS (
+        UPDATE chemicals c SET
+            status = CASE WHEN c.has_sds THEN sds_status(c.sds_revision_date, as_of) ELSE 'missing_sds' END,
+            next_status_change = CASE WHEN c.has_sds THEN sds_next_status_change(c.sds_revision_date, as_of) END,
+            updated_at = NOW()
+        FROM due
+        WHERE c.id = due.id
+        RETURNING c.tenant_id, c.id, due.status AS old_status, c.status AS new_status, c.sds_revision_date
+    )
+    INSERT INTO compliance_events (tenant_id, chemical_id, event_type, event_data)
+    SELECT tenant_id, id, 'sds_status_changed',
+           jsonb_build_object('from', old_status, 'to', new_status,
+                              'revision_date', sds_revision_date, 'as_of', as_of)
+    FROM moved
+    WHERE old_status IS DISTINCT FROM new_status;
+    GET DIAGNOSTICS chems = ROW_COUNT;
+
+    RETURN QUERY SELECT docs, chems;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Full reconciliation (after bulk imports that bypassed the trigger, or a change
+-- to the expiry rule). Writes only the rows whose status or due date differ.
+CREATE OR REPLACE FUNCTION refresh_sds_statuses()
+RETURNS void AS $$
+BEGIN
+    UPDATE sds_documents SET
+        status = sds_status(revision_date),
+        next_status_change = sds_next_status_change(revision_date)
+    WHERE revision_date IS NOT NULL
+      AND (status IS DISTINCT FROM sds_status(revision_date)
+           OR next_status_change IS DISTINCT FROM sds_next_status_change(revision_date));
+
+    UPDATE chemicals SET
+        status = CASE WHEN has_sds THEN sds_status(sds_revision_date) ELSE 'missing_sds' END,
+        next_status_change = CASE WHEN has_sds THEN sds_next_status_change(sds_revision_date) END,
+        updated_at = NOW()
+    WHERE status IS DISTINCT FROM CASE WHEN has_sds THEN sds_status(sds_revision_date) ELSE 'missing_sds' END
+       OR next_status_change IS DISTINCT FROM CASE WHEN has_sds THEN sds_next_status_change(sds_revision_date) END;
+END;
+$$ LANGUAGE plpgsql;
+
+-- advance_sds_statuses runs as owner (across tenants): only the app may call it
+REVOKE EXECUTE ON FUNCTION advance_sds_statuses(DATE) FROM PUBLIC;
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'sds_app') THEN
+        GRANT EXECUTE ON FUNCTION advance_sds_statuses(DATE) TO sds_app;
+    END IF;
+END $$;
+
+-- Expiry scheduler: only rows with a pending transition are indexed
+CREATE INDEX IF NOT EXISTS idx_chemicals_next_status ON chemicals(next_status_change) WHERE next_status_change IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_sds_documents_next_status ON sds_documents(next_status_change) WHERE next_status_change IS NOT NULL;
+
+-- Backfill the due dates (and any status the old daily refresh had not caught
+-- up on). Writes only rows that differ, so later runs are no-ops.
+SELECT refresh_sds_statuses();
+
+COMMIT;
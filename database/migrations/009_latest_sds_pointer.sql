@@ -0,0 +1,121 @@
+-- 009: latest-SDS pointer on chemicals, UUID RLS predicates
+--
+-- For databases created from init.sql before this change; init.sql already has it.
+-- Idempotent; deploy.sh applies every file in this directory in order with
+-- ON_ERROR_STOP. Builds on 001-008: the trigger below calls sds_status() and
+-- sds_next_status_change() and writes next_status_change (008). The index build
+-- locks chemicals for writes: on large installs, run it with CONCURRENTLY first.
+--
+--   for f in database/migrations/*.sql; do
+--       docker exec -i sds-postgres psql -v ON_ERROR_STOP=1 -U sds_admin -d sds_gp3 < $f
+--   done
+--
+-- Check the resulting plans with scripts/explain_check.py.
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF to_regprocedure('sds_next_status_change(date, date)') IS NULL THEN
+        RAISE EXCEPTION 'apply 001-008 first (sds_next_status_change() is missing)';
+    END IF;
+END $$;
+
+-- ------------------------------------------------------------
+-- chemicals.latest_sds_document_id replaces the per-row
+-- ORDER BY upload_date DESC LIMIT 1 lookups into sds_documents
+-- ------------------------------------------------------------
+
+ALTER TABLE chemicals ADD COLUMN IF NOT EXISTS latest_sds_document_id UUID;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'chemicals_latest_sds_document_fk') THEN
+        ALTER TABLE chemicals ADD CONSTRAINT chemicals_latest_sds_document_fk
+            FOREIGN KEY (latest_sds_document_id) REFERENCES sds_documents(id)
+            ON DELETE SET NULL DEFERRABLE INITIALLY DEFERRED;
+    END IF;
+END $$;
+
+-- The backfill and the trigger's lookups use idx_sds_documents_latest (006)
+CREATE INDEX IF NOT EXISTS idx_chemicals_latest_sds ON chemicals(latest_sds_document_id);
+
+-- Run as the owner/superuser, so RLS does not hide other tenants' rows
+UPDATE chemicals c SET latest_sds_document_id = d.id
+FROM (
+    SELECT DISTINCT ON (chemical_id) chemical_id, id FROM sds_documents
+    WHERE chemical_id IS NOT NULL
+    ORDER BY chemical_id, upload_date DESC
+) d
+WHERE c.id = d.chemical_id AND c.latest_sds_document_id IS DISTINCT FROM d.id;
+
+CREATE OR REPLACE FUNCTION update_chemical_sds_status()
+RETURNS TRIGGER AS $$
+DECLARE
+    -- Is this the chemical's newest document (what the API used to find with
+    -- ORDER BY upload_date DESC LIMIT 1)? Then chemicals.latest_sds_document_id points here.
+    is_latest BOOLEAN := NEW.chemical_id IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM chemicals c JOIN sds_documents d ON d.id = c.latest_sds_document_id
+        WHERE c.id = NEW.chemical_id AND d.id <> NEW.id AND d.upload_date > NEW.upload_date
+    );
+BEGIN
+    -- Update chemical status based on latest SDS
+    IF NEW.revision_date IS NOT NULL THEN
+        UPDATE chemicals SET
+            has_sds = true,
+            sds_revision_date = NEW.revision_date,
+            status = sds_status(NEW.revision_date),
+            next_status_change = sds_next_status_change(NEW.revision_date),
+            latest_sds_document_id = CASE WHEN is_latest THEN NEW.id ELSE latest_sds_document_id END,
+            updated_at = NOW()
+        WHERE id = NEW.chemical_id;
+    ELSIF is_latest THEN
+        UPDATE chemicals SET latest_sds_document_id = NEW.id
+        WHERE id = NEW.chemical_id AND latest_sds_document_id IS DISTINCT FROM NEW.id;
+    END IF;
+
+    -- A document moved to another chemical: re-point the old one at its newest remaining document
+    IF TG_OP = 'UPDATE' AND OLD.chemical_id IS DISTINCT FROM NEW.chemical_id THEN
+        UPDATE chemicals SET latest_sds_document_id = (
+            SELECT id FROM sds_documents WHERE chemical_id = OLD.chemical_id AND id <> NEW.id
+            ORDER BY upload_date DESC LIMIT 1
+        )
+        WHERE id = OLD.chemical_id AND latest_sds_document_id = NEW.id;
+    END IF;
+
+    -- Set document status
+    IF NEW.revision_date IS NOT NULL THEN
+        NEW.status = sds_status(NEW.revision_date);
+        NEW.next_status_change = sds_next_status_change(NEW.revision_date);
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS sds_status_trigger ON sds_documents;
+CREATE TRIGGER sds_status_trigger
+    BEFORE INSERT OR UPDATE OF revision_date, chemical_id ON sds_documents
+    FOR EACH ROW EXECUTE FUNCTION update_chemical_sds_status();
+
+-- ------------------------------------------------------------
+-- RLS: compare UUIDs (indexable) instead of tenant_id::text per row
+-- ------------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION current_tenant_id()
+RETURNS UUID AS $$
+    SELECT NULLIF(current_setting('app.current_tenant_id', true), '')::uuid;
+$$ LANGUAGE sql STABLE;
+
+ALTER POLICY tenant_chemicals ON chemicals USING (tenant_id = current_tenant_id());
+ALTER POLICY tenant_sds_documents ON sds_documents USING (tenant_id = current_tenant_id());
+ALTER POLICY tenant_sds_sections ON sds_sections USING (tenant_id = current_tenant_id());
+ALTER POLICY tenant_labels ON labels USING (tenant_id = current_tenant_id());
+ALTER POLICY tenant_chemical_locations ON chemical_locations USING (tenant_id = current_tenant_id());
+ALTER POLICY tenant_compliance_events ON compliance_events USING (tenant_id = current_tenant_id());
+ALTER POLICY tenant_token_usage ON token_usage USING (tenant_id = current_tenant_id());
+
+COMMIT;
+
+ANALYZE chemicals;
+ANALYZE sds_documents;
@@ -10,6 +10,29 @@ const getHeaders = () => {
 const jsonHeaders = () => ({ ...getHeaders(), 'Content-Type': 'application/json' })
 const fetchOpts = (opts = {}) => ({ credentials: 'include', ...opts })
 
+// POST a JSON body and hand each server-sent event's JSON payload to onEvent as it arrives
+const streamEvents = async (path, body, onEvent) => {
+  const res = await fetch(`${API}${path}`, {
+    method: 'POST', headers: jsonHeaders(), credentials: 'include', body: JSON.stringify(body),
+  })
+  if (!res.ok || !res.body) throw new Error(`Request failed (${res.status})`)
+  const reader = res.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+    let sep
+    while ((sep = buffer.indexOf('\n\n')) !== -1) {
+      const chunk = buffer.slice(0, sep)
+      buffer = buffer.slice(sep + 2)
+      const data = chunk.split('\n').filter(l => l.startsWith('data: ')).map(l => l.slice(6)).join('\n')
+      if (data) onEvent(JSON.parse(data))
+    }
+  }
+}
+
 // ============================================================
 // LOGIN
 // ============================================================
@@ -139,24 +162,63 @@ function Dashboard() {
 // UPLOAD SDS
 // ============================================================
 function UploadPage() {
-  const [file, setFile] = useState(null)
+  const [files, setFiles] = useState([])
   const [loading, setLoading] = useState(false)
   const [result, setResult] = useState(null)
+  const [batch, setBatch] = useState(null)
   const [dragging, setDragging] = useState(false)
 
+  const file = files[0]
+  const isBulk = files.length > 1 || (file && file.name.toLowerCase().endsWith('.zip'))
+
   const handleUpload = async () => {
     if (!file) return
-    setLoading(true); setResult(null)
+    if (isBulk) return handleBulkUpload()
+    setLoading(true); setResult(null); setBatch(null)
     const form = new FormData()
     form.append('file', file)
     try {
       const res = await fetch(`${API}/sds/upload`, { method: 'POST', headers: getHeaders(), credentials: 'include', body: form })
-      setResult(await res.json())
+      const queued = await res.json()
+      if (!res.ok || !queued.job_id) throw new Error(queued.detail || queued.message || 'Upload failed')
+      setResult(await waitForJob(queued.job_id))
+    } catch (err) { setResult({ status: 'error', message: err.message }) }
+    setLoading(false)
+  }
+
+  const waitForJob = async (jobId) => {
+    while (true) {
+      await new Promise(r => setTimeout(r, 2000))
+      const res = await fetch(`${API}/sds/jobs/${jobId}`, { headers: getHeaders(), credentials: 'include' })
+      const job = await res.json()
+      if (!res.ok) throw new Error(job.detail || 'Job lookup failed')
+      if (job.status === 'done' || job.status === 'error') {
+        return job.result || { status: 'error', message: job.error || 'Extraction failed' }
+      }
+    }
+  }
+
+  const handleBulkUpload = async () => {
+    setLoading(true); setResult(null); setBatch(null)
+    const form = new FormData()
+    files.forEach(f => form.append('files', f))
+    try {
+      const res = await fetch(`${API}/sds/bulk`, { method: 'POST', headers: getHeaders(), credentials: 'include', body: form })
+      const queued = await res.json()
+      if (!res.ok || !queued.batch_id) throw new Error(queued.detail || queued.message || 'Upload failed')
+      while (true) {
+        await new Promise(r => setTimeout(r, 3000))
+        const r = await fetch(`${API}/sds/batches/${queued.batch_id}`, { headers: getHeaders(), credentials: 'include' })
+        const progress = await r.json()
+        if (!r.ok) throw new Error(progress.detail || 'Batch lookup failed')
+        setBatch(progress)
+        if (progress.status === 'done') break
+      }
     } catch (err) { setResult({ status: 'error', message: err.message }) }
     setLoading(false)
   }
 
-  const handleDrop = (e) => { e.preventDefault(); setDragging(false); if (e.dataTransfer.files[0]) setFile(e.dataTransfer.files[0]) }
+  const handleDrop = (e) => { e.preventDefault(); setDragging(false); if (e.dataTransfer.files.length) setFiles([...e.dataTransfer.files]) }
 
   return (
     <div>
@@ -166,13 +228,37 @@ function UploadPage() {
         onDragLeave={() => setDragging(false)}
         onDrop={handleDrop}
         onClick={() => document.getElementById('sds-file').click()}>
-        <input id="sds-file" type="file" accept=".pdf,.jpg,.png" style={{ display: 'none' }} onChange={e => setFile(e.target.files[0])} />
-        {file ? <p>{file.name} ({(file.size / 1024).toFixed(0)} KB)</p> : <p>Drop SDS PDF here or click to browse</p>}
+        <input id="sds-file" type="file" accept=".pdf,.jpg,.png,.zip" multiple style={{ display: 'none' }} onChange={e => setFiles([...e.target.files])} />
+        {files.length > 1 ? <p>{files.length} files selected</p>
+          : file ? <p>{file.name} ({(file.size / 1024).toFixed(0)} KB)</p>
+          : <p>Drop SDS PDFs or a ZIP archive here or click to browse</p>}
       </div>
       <button className="btn btn-primary" onClick={handleUpload} disabled={!file || loading}>
         {loading ? 'Processing with AI...' : 'Upload & Extract'}
       </button>
 
+      {batch && (
+        <div className="card" style={{ marginTop: 16 }}>
+          <h3 style={{ marginBottom: 8 }}>
+            Bulk Import: {(batch.counts.done || 0) + (batch.counts.error || 0) + (batch.counts.skipped || 0)}/{batch.total} processed
+          </h3>
+          <p style={{ color: 'var(--text-secondary)', fontSize: 12, marginBottom: 8 }}>
+            {Object.entries(batch.counts).map(([s, n]) => `${s}: ${n}`).join(' | ')}
+          </p>
+          <table>
+            <tbody>
+              {batch.files.map(f => (
+                <tr key={f.job_id}>
+                  <td>{f.file_name}</td>
+                  <td><span className={`badge ${f.status === 'done' ? 'badge-current' : f.status === 'error' || f.status === 'skipped' ? 'badge-expired' : 'badge-warning'}`}>{f.status}</span></td>
+                  <td style={{ fontSize: 12, color: 'var(--text-secondary)' }}>{f.error || ''}</td>
+                </tr>
+              ))}
+            </tbody>
+          </table>
+        </div>
+      )}
+
       {result && (
         <div className="card" style={{ marginTop: 16 }}>
           <h3 style={{ color: result.status === 'success' ? 'var(--success)' : 'var(--danger)', marginBottom: 8 }}>
@@ -220,16 +306,20 @@ function QuestionPage() {
     if (!input.trim() || loading) return
     const q = input.trim()
     setInput('')
-    setMessages(prev => [...prev, { role: 'user', text: q }])
+    setMessages(prev => [...prev, { role: 'user', text: q }, { role: 'agent', text: '' }])
     setLoading(true)
+    // Append streamed text to the last (agent) message
+    const appendAgent = (text) => setMessages(prev => {
+      const last = prev[prev.length - 1]
+      return [...prev.slice(0, -1), { ...last, text: last.text + text }]
+    })
     try {
-      const res = await fetch(`${API}/sds/question`, {
-        method: 'POST', headers: jsonHeaders(), credentials: 'include', body: JSON.stringify({ question: q }),
+      await streamEvents('/sds/question/stream', { question: q }, (ev) => {
+        if (ev.delta) appendAgent(ev.delta)
+        if (ev.error) appendAgent(`\nError: ${ev.error}`)
       })
-      const data = await res.json()
-      setMessages(prev => [...prev, { role: 'agent', text: data.answer || data.message }])
     } catch (err) {
-      setMessages(prev => [...prev, { role: 'agent', text: `Error: ${err.message}` }])
+      appendAgent(`Error: ${err.message}`)
     }
     setLoading(false)
   }
@@ -250,12 +340,12 @@ function QuestionPage() {
               </div>
             </div>
           )}
-          {messages.map((m, i) => (
+          {messages.filter(m => m.text !== '').map((m, i) => (
             <div key={i} className={`chat-message ${m.role}`}>
               <div style={{ whiteSpace: 'pre-wrap' }}>{m.text}</div>
             </div>
           ))}
-          {loading && <div className="chat-message agent" style={{ opacity: 0.6 }}>Thinking...</div>}
+          {loading && messages[messages.length - 1]?.text === '' && <div className="chat-message agent" style={{ opacity: 0.6 }}>Thinking...</div>}
           <div ref={messagesEnd} />
         </div>
         <form className="chat-input" onSubmit={ask}>
@@ -270,15 +360,33 @@ function QuestionPage() {
 // ============================================================
 // CHEMICALS
 // ============================================================
+const CHEMICAL_LIST_FIELDS = 'id,chemical_name,cas_number,signal_word,storage_class,location,critical,status'
+
 function ChemicalsPage() {
   const [chemicals, setChemicals] = useState([])
+  const [total, setTotal] = useState(null)
+  const [nextCursor, setNextCursor] = useState(null)
+  const [filters, setFilters] = useState({ q: '', status: '', storage_class: '', critical: '' })
   const [showAdd, setShowAdd] = useState(false)
   const [form, setForm] = useState({ chemical_name: '', cas_number: '', manufacturer: '', storage_class: 'general_storage', location: '', critical: false })
 
-  const load = () => fetch(`${API}/sds/chemicals`, { headers: getHeaders(), credentials: 'include' })
-    .then(r => r.json()).then(d => setChemicals(d.chemicals || [])).catch(console.error)
+  // Server-side filtering and keyset pages: the first page replaces the table, later pages append
+  const load = (cursor = null) => {
+    const params = new URLSearchParams({ fields: CHEMICAL_LIST_FIELDS, limit: '100' })
+    Object.entries(filters).forEach(([k, v]) => { if (v) params.set(k, v) })
+    if (cursor) params.set('cursor', cursor)
+    return fetch(`${API}/sds/chemicals?${params}`, { headers: getHeaders(), credentials: 'include' })
+      .then(r => r.json()).then(d => {
+        setChemicals(prev => cursor ? [...prev, ...(d.chemicals || [])] : (d.chemicals || []))
+        if (!cursor) setTotal(d.total)
+        setNextCursor(d.next_cursor)
+      }).catch(console.error)
+  }
 
-  useEffect(() => { load() }, [])
+  useEffect(() => {
+    const t = setTimeout(() => load(), 250)
+    return () => clearTimeout(t)
+  }, [filters])
 
   const addChemical = async (e) => {
     e.preventDefault()
@@ -325,6 +433,31 @@ function ChemicalsPage() {
         </form>
       )}
 
+      <div style={{ display: 'flex', gap: 8, marginBottom: 12, alignItems: 'center' }}>
+        <input placeholder="Search name, CAS, manufacturer" value={filters.q} style={{ flex: 2, marginBottom: 0 }}
+          onChange={e => setFilters({ ...filters, q: e.target.value })} />
+        <select value={filters.status} style={{ flex: 1, marginBottom: 0 }} onChange={e => setFilters({ ...filters, status: e.target.value })}>
+          <option value="">All statuses</option>
+          <option value="current">Current</option>
+          <option value="expiring_soon">Expiring soon</option>
+          <option value="expired">Expired</option>
+          <option value="missing_sds">Missing SDS</option>
+        </select>
+        <select value={filters.storage_class} style={{ flex: 1, marginBottom: 0 }} onChange={e => setFilters({ ...filters, storage_class: e.target.value })}>
+          <option value="">All storage</option>
+          <option value="general_storage">General Storage</option>
+          <option value="flammable_cabinet">Flammable Cabinet</option>
+          <option value="corrosive_cabinet">Corrosive Cabinet</option>
+          <option value="oxidizer_cabinet">Oxidizer Cabinet</option>
+          <option value="refrigerated">Refrigerated</option>
+          <option value="ventilated">Ventilated</option>
+        </select>
+        <label style={{ display: 'flex', alignItems: 'center', gap: 6, whiteSpace: 'nowrap' }}>
+          <input type="checkbox" checked={filters.critical === 'true'} onChange={e => setFilters({ ...filters, critical: e.target.checked ? 'true' : '' })} /> High hazard only
+        </label>
+        {total !== null && <span style={{ fontSize: 12, color: 'var(--text-secondary)', whiteSpace: 'nowrap' }}>{total} chemicals</span>}
+      </div>
+
       <div className="card" style={{ overflowX: 'auto' }}>
         <table>
           <thead>
@@ -348,6 +481,11 @@ function ChemicalsPage() {
           </tbody>
         </table>
         {chemicals.length === 0 && <p style={{ padding: 20, textAlign: 'center', color: 'var(--text-secondary)' }}>No chemicals registered. Upload an SDS or add manually.</p>}
+        {nextCursor && (
+          <div style={{ padding: 12, textAlign: 'center' }}>
+            <button className="btn btn-secondary" onClick={() => load(nextCursor)}>Load more</button>
+          </div>
+        )}
       </div>
     </div>
   )
@@ -356,6 +494,8 @@ function ChemicalsPage() {
 // ============================================================
 // LABELS
 // ============================================================
+const LABEL_SIZES = { ghs_primary: '4x6', secondary: '2x1', pipe_marker: '8x1' }
+
 function LabelsPage() {
   const [chemicals, setChemicals] = useState([])
   const [selected, setSelected] = useState('')
@@ -365,9 +505,21 @@ function LabelsPage() {
   const [loading, setLoading] = useState(false)
   const [printing, setPrinting] = useState(false)
 
+  // The picker lists every SDS-backed chemical: follow the keyset pages until next_cursor runs out
   useEffect(() => {
-    fetch(`${API}/sds/chemicals`, { headers: getHeaders(), credentials: 'include' })
-      .then(r => r.json()).then(d => setChemicals((d.chemicals || []).filter(c => c.has_sds)))
+    let cancelled = false
+    const load = (cursor = null) => {
+      const params = new URLSearchParams({ has_sds: 'true', fields: 'id,chemical_name,cas_number', limit: '500' })
+      if (cursor) params.set('cursor', cursor)
+      return fetch(`${API}/sds/chemicals?${params}`, { headers: getHeaders(), credentials: 'include' })
+        .then(r => r.json()).then(d => {
+          if (cancelled) return
+          setChemicals(prev => cursor ? [...prev, ...(d.chemicals || [])] : (d.chemicals || []))
+          if (d.next_cursor) return load(d.next_cursor)
+        }).catch(console.error)
+    }
+    load()
+    return () => { cancelled = true }
   }, [])
 
   const generate = async () => {
@@ -376,13 +528,31 @@ function LabelsPage() {
     try {
       const res = await fetch(`${API}/sds/label`, {
         method: 'POST', headers: jsonHeaders(), credentials: 'include',
-        body: JSON.stringify({ chemical_id: selected, label_type: labelType, label_size: labelType === 'ghs_primary' ? '4x6' : '2x1', quantity }),
+        body: JSON.stringify({ chemical_id: selected, label_type: labelType, label_size: LABEL_SIZES[labelType], quantity }),
       })
       setResult(await res.json())
     } catch (err) { setResult({ status: 'error', message: err.message }) }
     setLoading(false)
   }
 
+  const downloadPdf = async () => {
+    if (!selected) return
+    setPrinting(true)
+    try {
+      const res = await fetch(`${API}/sds/labels/pdf`, {
+        method: 'POST', headers: jsonHeaders(), credentials: 'include',
+        body: JSON.stringify({ chemical_ids: [selected], label_type: labelType, label_size: LABEL_SIZES[labelType], quantity }),
+      })
+      if (!res.ok) throw new Error((await res.json()).detail || 'PDF failed')
+      const blob = await res.blob()
+      const url = URL.createObjectURL(blob)
+      const a = document.createElement('a'); a.href = url
+      a.download = `labels_${labelType}_${new Date().toISOString().split('T')[0]}.pdf`
+      a.click(); URL.revokeObjectURL(url)
+    } catch (err) { alert(err.message) }
+    setPrinting(false)
+  }
+
   const printLabel = async () => {
     if (!selected) return
     setPrinting(true)
@@ -392,7 +562,16 @@ function LabelsPage() {
         body: JSON.stringify({ chemical_id: selected, label_type: labelType, quantity }),
       })
       const data = await res.json()
-      alert(data.message || 'Print sent')
+      if (!res.ok) throw new Error(data.detail || 'Print failed')
+      if (!data.job_id) { alert(data.message || 'Print sent'); setPrinting(false); return }
+      while (true) {
+        await new Promise(r => setTimeout(r, 1000))
+        const jobRes = await fetch(`${API}/sds/print/jobs/${data.job_id}`, { headers: getHeaders(), credentials: 'include' })
+        const job = await jobRes.json()
+        if (!jobRes.ok) throw new Error(job.detail || 'Print job lookup failed')
+        if (job.state === 'done') { alert(`Printed ${job.labels} labels on ${job.printer}`); break }
+        if (job.state === 'failed') { alert(job.error || 'Print failed'); break }
+      }
     } catch (err) { alert(err.message) }
     setPrinting(false)
   }
@@ -430,6 +609,11 @@ function LabelsPage() {
             {printing ? 'Sending...' : 'Print to Zebra'}
           </button>
         )}
+        {result && result.label_data && (
+          <button className="btn btn-secondary" onClick={downloadPdf} disabled={printing} style={{ marginLeft: 8 }}>
+            Download PDF
+          </button>
+        )}
       </div>
 
       {result && result.label_data && (
@@ -536,18 +720,25 @@ function DownloadPage() {
   const download = async (format) => {
     setLoading(true); setTextResult(null)
     try {
-      const res = await fetch(`${API}/sds/download`, {
-        method: 'POST', headers: jsonHeaders(), credentials: 'include',
-        body: JSON.stringify({ evidence_type: evidenceType, format }),
-      })
       if (format === 'pdf') {
+        const res = await fetch(`${API}/sds/download`, {
+          method: 'POST', headers: jsonHeaders(), credentials: 'include',
+          body: JSON.stringify({ evidence_type: evidenceType, format }),
+        })
         const blob = await res.blob()
         const url = URL.createObjectURL(blob)
         const a = document.createElement('a'); a.href = url
         a.download = `sds_evidence_${evidenceType}_${new Date().toISOString().split('T')[0]}.pdf`
         a.click(); URL.revokeObjectURL(url)
       } else {
-        setTextResult(await res.json())
+        setTextResult({ package_description: '' })
+        await streamEvents('/sds/download/stream', { evidence_type: evidenceType, format }, (ev) => {
+          setTextResult(prev => ({
+            ...prev,
+            ...(ev.record_count !== undefined ? { record_count: ev.record_count, generated_at: ev.generated_at } : {}),
+            package_description: prev.package_description + (ev.delta || '') + (ev.error ? `\nError: ${ev.error}` : ''),
+          }))
+        })
       }
     } catch (err) { setTextResult({ status: 'error', message: err.message }) }
     setLoading(false)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Compare /sds/question prompt size and build time: full inventory dump vs BM25 retrieval.
+
+Builds a synthetic registry (chemicals + 16 SDS sections each) in memory and
+renders both context styles for a set of typical questions. Token counts are
+estimated at ~4 characters per token unless --gemini is given, in which case
+both prompts are also sent to the model and wall-clock latency is reported.
+
+Usage:
+    python scripts/bench_qa_context.py                   # 100, 1k, 10k chemicals
+    python scripts/bench_qa_context.py --sizes 500 5000
+    GEMINI_API_KEY=... python scripts/bench_qa_context.py --sizes 100 1000 --gemini
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from retrieval import RegistryIndex  # noqa: E402
+
+QUESTIONS = [
+    "What PPE do I need for acetone?",
+    "Which gloves should be used with sulfuric acid?",
+    "How do I clean up a toluene spill?",
+    "What is the flash point of isopropyl alcohol?",
+    "Which chemicals are stored in Bay 3?",
+    "What first aid applies to sodium hydroxide eye contact?",
+]
+
+BASE_NAMES = [
+    "Acetone", "Sulfuric Acid", "Toluene", "Isopropyl Alcohol", "Sodium Hydroxide",
+    "Methanol", "Xylene", "Hydrochloric Acid", "Ethanol", "Hexane", "Ammonia",
+    "Hydrogen Peroxide", "Nitric Acid", "Mineral Spirits", "Acetic Acid",
+]
+STORAGE = ["flammable", "acids", "bases", "oxidizers", "general_storage"]
+STATUS = ["current", "current", "current", "expiring_soon", "expired", "missing_sds"]
+SECTION_TITLES = [
+    "Identification", "Hazard identification", "Composition", "First-aid measures",
+    "Fire-fighting measures", "Accidental release measures", "Handling and storage",
+    "Exposure controls/personal protection", "Physical and chemical properties",
+    "Stability and reactivity", "Toxicological information", "Ecological information",
+    "Disposal considerations", "Transport information", "Regulatory information", "Other information",
+]
+FILLER = ("avoid contact with skin and eyes use in well ventilated area keep container tightly closed "
+          "wear protective gloves eye protection face protection nitrile neoprene butyl rubber respirator "
+          "flush with water for 15 minutes absorb with inert material ground and bond containers "
+          "flash point boiling point vapor pressure incompatible with strong oxidizers").split()
+
+
+def make_registry(n: int, rng: random.Random):
+    """Snapshot-shaped records (see REGISTRY_COLUMNS in main.py) plus section rows."""
+    records, sections = [], []
+    for i in range(n):
+        base = BASE_NAMES[i % len(BASE_NAMES)]
+        name = base if i < len(BASE_NAMES) else f"{base} Blend {i}"
+        cid = f"chem-{i}"
+        cas = f"{rng.randint(50, 99999)}-{rng.randint(10, 99)}-{rng.randint(0, 9)}"
+        status = rng.choice(STATUS)
+        records.append((
+            name, cas, rng.choice(["Danger", "Warning", None]), rng.choice(["flammable", "corrosive", None]),
+            rng.choice(STORAGE), f"Bay {rng.randint(1, 40)}", status, rng.random() < 0.1,
+            status != "missing_sds", "2023-01-01", "2023-01-01", 16, cid, "ACME Chemical",
+        ))
+        for num, title in enumerate(SECTION_TITLES, 1):
+            words = rng.sample(FILLER, 25) + [base.lower()]
+            sections.append((cid, num, title, " ".join(words)))
+    return records, sections
+
+
+def full_dump(records) -> str:
+    """The pre-retrieval prompt: every chemical in the kernel list and again in the context."""
+    kernel_list = "\n".join(
+        f"  {c[0]}: CAS={c[1] or 'N/A'} | storage={c[4]} | loc={c[5] or 'unassigned'} | status={c[6]} | critical={c[7]}"
+        for c in records)
+    context = "Chemical inventory:\n" + "\n".join(
+        f"- {c[0]} (CAS: {c[1] or 'N/A'}, Signal: {c[2] or 'None'}, Class: {c[3] or 'N/A'}, "
+        f"Storage: {c[4]}, Location: {c[5] or 'unassigned'}, Status: {c[6]}, Critical: {c[7]}, "
+        f"SDS Rev: {c[10] or 'N/A'}, Sections: {c[11] or 0}/16)"
+        for c in records)
+    return kernel_list + "\n" + context + f"\n\nTotal chemicals: {len(records)}"
+
+
+def retrieved(index: RegistryIndex, by_id: dict, question: str, k: int, excerpts: int) -> str:
+    """Mirrors build_qa_context in main.py (minus the aggregate header, which is constant-size)."""
+    hits = index.search(question, k)
+    lines = [f"- {by_id[h.key][0]} (CAS: {by_id[h.key][1]}, Storage: {by_id[h.key][4]}, Status: {by_id[h.key][6]})"
+             for h in hits]
+    parts = [f"[{by_id[key][0]} — Section {num}: {title}]\n{txt}"
+             for key, num, title, txt in index.excerpts(question, [h.key for h in hits], excerpts)]
+    return "\n".join(lines) + "\n" + "\n".join(parts)
+
+
+def est_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+def gemini_latency(prompt: str, question: str) -> float:
+    import google.generativeai as genai
+    genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+    model = genai.GenerativeModel("gemini-2.0-flash")
+    t0 = time.perf_counter()
+    model.generate_content(f"Context:\n{prompt}\n\nQuestion: {question}")
+    return time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    ap.add_argument("--k", type=int, default=8)
+    ap.add_argument("--excerpts", type=int, default=6)
+    ap.add_argument("--gemini", action="store_true", help="also time real model calls (needs GEMINI_API_KEY)")
+    args = ap.parse_args()
+    rng = random.Random(42)
+
+    print(f"{'chemicals':>9} | {'full tokens':>11} | {'rag tokens':>10} | {'full build ms':>13} | "
+          f"{'index build ms':>14} | {'rag query ms':>12}" + (" | full s | rag s" if args.gemini else ""))
+    for n in args.sizes:
+        records, sections = make_registry(n, rng)
+
+        t0 = time.perf_counter()
+        dumps = [full_dump(records) for _ in QUESTIONS]
+        full_ms = (time.perf_counter() - t0) * 1000 / len(QUESTIONS)
+
+        t0 = time.perf_counter()
+        index = RegistryIndex([(c[12], " ".join(str(v) for v in c[:8] if v)) for c in records], sections)
+        build_ms = (time.perf_counter() - t0) * 1000
+        by_id = {c[12]: c for c in records}
+
+        t0 = time.perf_counter()
+        rag = [retrieved(index, by_id, q, args.k, args.excerpts) for q in QUESTIONS]
+        rag_ms = (time.perf_counter() - t0) * 1000 / len(QUESTIONS)
+
+        row = (f"{n:>9} | {statistics.mean(map(est_tokens, dumps)):>11.0f} | {statistics.mean(map(est_tokens, rag)):>10.0f} | "
+               f"{full_ms:>13.1f} | {build_ms:>14.1f} | {rag_ms:>12.2f}")
+        if args.gemini:
+            full_s = gemini_latency(dumps[0], QUESTIONS[0])
+            rag_s = gemini_latency(rag[0], QUESTIONS[0])
+            row += f" | {full_s:>6.2f} | {rag_s:>5.2f}"
+        print(row)
+
+    print("\nIndex build runs once per registry version; rag query ms is the per-question cost.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Measure the local SDS extraction stage (backend/sds_parser.py).
+
+For each PDF -- given on the command line, or synthetic ones generated with
+ReportLab -- reports parse time, peak Python memory, GHS sections found,
+fields parsed without the model, and how much text the model is sent
+(section excerpts) compared to the whole document. Tokens are estimated at
+~4 characters per token.
+
+Usage:
+    python scripts/bench_sds_extract.py                     # synthetic 6, 40 and scanned 50 MB SDSs
+    python scripts/bench_sds_extract.py path/to/*.pdf --section-chars 1500 --brief-chars 400
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from sds_parser import SECTION_TITLES, parse_sds_pdf, section_excerpts  # noqa: E402
+
+BRIEF_SECTIONS = ("11", "12", "13", "15", "16")  # SDS_BRIEF_SECTIONS in main.py
+
+SECTION_BODIES = {
+    "1": ["Product name: Acetone", "Product code: AC-100", "CAS-No.: 67-64-1",
+          "Manufacturer: Example Chemical Co., 100 Main St, Springfield", "Emergency phone: 1-800-424-9300"],
+    "2": ["Classification: Flammable liquids (Category 2), Eye irritation (Category 2A), STOT SE (Category 3)",
+          "Signal word: Danger", "H225 Highly flammable liquid and vapour.", "H319 Causes serious eye irritation.",
+          "H336 May cause drowsiness or dizziness.", "P210 Keep away from heat, hot surfaces, sparks, open flames.",
+          "P233 Keep container tightly closed.", "P305+P351+P338 IF IN EYES: Rinse cautiously with water."],
+    "3": ["Acetone  CAS 67-64-1  >= 99 %"],
+    "16": ["Revision date: 03/15/2024", "Prepared by: Product Safety Department"],
+}
+FILLER = ("avoid contact with skin and eyes use in well ventilated area keep container tightly closed "
+          "wear protective gloves eye protection face protection nitrile butyl rubber respirator flush with "
+          "water for 15 minutes absorb with inert material ground and bond containers see section 8").split()
+
+
+def make_text_sds(path: Path, pages: int, rng: random.Random):
+    """A text-layer SDS with all 16 sections spread over roughly `pages` pages."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(str(path), pagesize=letter)
+    lines_per_page, y = 60, 750
+    per_section = max(4, pages * lines_per_page // 16)
+
+    def emit(line: str):
+        nonlocal y
+        if y < 40:
+            c.showPage()
+            y = 750
+        c.drawString(40, y, line)
+        y -= 12
+
+    for num, title in SECTION_TITLES.items():
+        emit(f"SECTION {num}: {title.upper()}")
+        body = SECTION_BODIES.get(num, [])
+        for line in body:
+            emit(line)
+        for _ in range(per_section - len(body)):
+            emit(" ".join(rng.choice(FILLER) for _ in range(14)))
+    c.save()
+
+
+def make_scanned_sds(path: Path, megabytes: int):
+    """Image-only pages (random pixels, so they do not compress): no text layer."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+    import zlib
+    import struct
+
+    side = 1000
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    c = canvas.Canvas(str(path), pagesize=letter)
+    png_path = path.with_suffix(".png")
+    for _ in range(megabytes):
+        raw = b"".join(b"\x00" + os.urandom(side) for _ in range(side))  # 1 MB grayscale, new per page
+        png_path.write_bytes(b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", side, side, 8, 0, 0, 0, 0))
+                             + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b""))
+        c.drawImage(ImageReader(str(png_path)), 20, 20, 570, 750)
+        c.showPage()
+    c.save()
+    png_path.unlink()
+
+
+def measure(path: Path, section_chars: int, brief_chars: int, max_pages: int):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    parsed = parse_sds_pdf(path, max_pages)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    limits = dict.fromkeys(BRIEF_SECTIONS, brief_chars)
+    sent = sum(len(t) + len(title) + 20 for _, title, t in section_excerpts(parsed.sections, section_chars, limits))
+    return {
+        "file": path.name,
+        "mb": path.stat().st_size / 1e6,
+        "pages": parsed.pages,
+        "ms": elapsed * 1000,
+        "peak_mb": peak / 1e6,
+        "sections": len(parsed.sections),
+        "fields": ",".join(sorted(parsed.fields)) or ("(scanned: model fallback)" if not parsed.text_layer else "-"),
+        "doc_tokens": parsed.text_chars // 4,
+        "sent_tokens": sent // 4 if parsed.sections else min(parsed.text_chars, section_chars * 16) // 4,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("files", nargs="*", type=Path)
+    ap.add_argument("--section-chars", type=int, default=1500, help="per-section cap (SDS_SECTION_CHARS)")
+    ap.add_argument("--brief-chars", type=int, default=400, help="cap for sections 11-13, 15, 16 (SDS_BRIEF_SECTION_CHARS)")
+    ap.add_argument("--max-pages", type=int, default=50, help="SDS_PARSE_MAX_PAGES")
+    ap.add_argument("--scanned-mb", type=int, default=50, help="size of the synthetic scanned SDS")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = args.files
+        if not files:
+            rng = random.Random(7)
+            for pages in (6, 40):
+                make_text_sds(Path(tmp) / f"synthetic_{pages}p.pdf", pages, rng)
+            make_scanned_sds(Path(tmp) / f"scanned_{args.scanned_mb}mb.pdf", args.scanned_mb)
+            files = sorted(Path(tmp).glob("*.pdf"))
+
+        print(f"{'file':>22} | {'MB':>6} | {'pages':>5} | {'parse ms':>8} | {'peak MB':>7} | {'sections':>8} | "
+              f"{'doc tok':>7} | {'sent tok':>8} | parsed locally")
+        for path in files:
+            r = measure(path, args.section_chars, args.brief_chars, args.max_pages)
+            print(f"{r['file'][-22:]:>22} | {r['mb']:>6.1f} | {r['pages']:>5} | {r['ms']:>8.0f} | {r['peak_mb']:>7.1f} | "
+                  f"{r['sections']:>8} | {r['doc_tokens']:>7} | {r['sent_tokens']:>8} | {r['fields']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,21 +9,22 @@ WEB_DIR="/opt/sds-web"
 echo "=== SDS Agent Deploy ==="
 
 # 1. Create directories
-echo "[1/8] Creating directories..."
-ssh $VPS "mkdir -p $REMOTE_DIR/{backend,database,kernels/tools,kernels/tenants,scripts} $WEB_DIR"
+echo "[1/10] Creating directories..."
+ssh $VPS "mkdir -p $REMOTE_DIR/{backend,database/migrations,kernels/tools,kernels/tenants,scripts} $WEB_DIR"
 
 # 2. Copy files
-echo "[2/8] Copying files..."
+echo "[2/10] Copying files..."
 scp docker-compose.yml $VPS:$REMOTE_DIR/
-scp backend/Dockerfile backend/requirements.txt backend/main.py $VPS:$REMOTE_DIR/backend/
+scp backend/Dockerfile backend/requirements.txt backend/main.py backend/retrieval.py backend/sds_parser.py backend/llm.py backend/spooler.py backend/zpl.py backend/pdf_render.py $VPS:$REMOTE_DIR/backend/
 scp database/init.sql $VPS:$REMOTE_DIR/database/
+scp database/migrations/*.sql $VPS:$REMOTE_DIR/database/migrations/
 scp kernels/sds_v1.0.ttc.md $VPS:$REMOTE_DIR/kernels/
 scp kernels/tools/printerdrivers.ttc.md $VPS:$REMOTE_DIR/kernels/tools/
 scp kernels/tenants/bunting-sds.ttc.md $VPS:$REMOTE_DIR/kernels/tenants/
 scp scripts/add-tenant.sh $VPS:$REMOTE_DIR/scripts/
 
 # 3. Create .env if not exists
-echo "[3/8] Checking .env..."
+echo "[3/10] Checking .env..."
 ssh $VPS "test -f $REMOTE_DIR/.env || cat > $REMOTE_DIR/.env << 'ENVEOF'
 DB_PASSWORD=$(openssl rand -hex 16)
 DB_APP_PASSWORD=$(openssl rand -hex 16)
@@ -33,26 +34,34 @@ ENVIRONMENT=production
 ENVEOF"
 echo "  -> Check $REMOTE_DIR/.env and set ANTHROPIC_API_KEY"
 
-# 4. Start containers
-echo "[4/8] Starting containers..."
-ssh $VPS "cd $REMOTE_DIR && docker compose up -d --build"
+# 4. Start postgres only: the API must not serve the new code on the old schema
+echo "[4/10] Starting postgres..."
+ssh $VPS "cd $REMOTE_DIR && docker compose up -d sds-postgres"
 
 # 5. Wait for postgres healthy
-echo "[5/8] Waiting for postgres..."
+echo "[5/10] Waiting for postgres..."
 ssh $VPS "sleep 10"
 
-# 6. Set up restricted DB user
-echo "[6/8] Setting up sds_app DB user..."
+# 6. Apply schema migrations (idempotent; a fresh volume already has them from init.sql)
+echo "[6/10] Applying migrations..."
+ssh $VPS "for f in $REMOTE_DIR/database/migrations/*.sql; do echo \"  -> \$f\"; docker exec -i sds-postgres psql -q -v ON_ERROR_STOP=1 -U sds_admin -d sds_gp3 < \$f; done"
+
+# 7. Build and start the API on the migrated schema
+echo "[7/10] Starting containers..."
+ssh $VPS "cd $REMOTE_DIR && docker compose up -d --build"
+
+# 8. Set up restricted DB user
+echo "[8/10] Setting up sds_app DB user..."
 ssh $VPS "docker exec sds-postgres psql -U sds_admin -d sds_gp3 -c \"DO \\\$\\\$ BEGIN IF NOT EXISTS (SELECT FROM pg_roles WHERE rolname = 'sds_app') THEN EXECUTE 'CREATE ROLE sds_app WITH LOGIN PASSWORD ''' || current_setting('app.db_app_password', true) || ''''; END IF; END \\\$\\\$;\"" || true
 
-# 7. Build frontend
-echo "[7/8] Building frontend..."
+# 9. Build frontend
+echo "[9/10] Building frontend..."
 cd frontend && npm install && npm run build
 scp -r dist/* $VPS:$WEB_DIR/
 cd ..
 
-# 8. Health check
-echo "[8/8] Health check..."
+# 10. Health check
+echo "[10/10] Health check..."
 ssh $VPS "curl -s http://localhost:8201/health"
 
 echo ""
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a Zebra printer on raw TCP (port 9100) for exercising the print spooler.
+
+Accepts ^XA...^XZ formats (honouring ^PQ quantities), "prints" them one label at
+a time at --label-ms each, and answers ~HS with the three host-status strings a
+real printer sends (paper out, pause, formats in buffer, head up, labels
+remaining). Faults can be injected to check the spooler's recovery:
+--drop-every N closes every Nth connection as soon as it is accepted, and
+--paper-out-after N runs out of paper after N labels for --paper-out-seconds.
+
+Usage:
+    python scripts/fake_zebra.py                                  # 127.0.0.1:9100
+    python scripts/fake_zebra.py --port 9101 --label-ms 20 --drop-every 3
+    python scripts/fake_zebra.py --paper-out-after 50 --paper-out-seconds 5
+    python scripts/fake_zebra.py --no-status                      # an older printer without ~HS
+
+Point a tenant's printer_ip (or a request's printer_ip) at 127.0.0.1:<port>.
+"""
+import re
+import time
+import asyncio
+import argparse
+
+FORMAT_RE = re.compile(rb"\^XA(.*?)\^XZ", re.S)
+QUANTITY_RE = re.compile(rb"\^PQ(\d+)")
+
+
+class FakeZebra:
+    def __init__(self, label_ms: float = 50, drop_every: int = 0, paper_out_after: int = 0,
+                 paper_out_seconds: float = 5, status: bool = True):
+        self.label_seconds = label_ms / 1000
+        self.drop_every = drop_every
+        self.paper_out_after = paper_out_after
+        self.paper_out_seconds = paper_out_seconds
+        self.status = status
+        self.formats = []  # label counts of formats waiting to print
+        self.printed = 0
+        self.formats_received = 0
+        self.connections = 0
+        self.dropped = 0
+        self.status_queries = 0
+        self.paper_out = False
+        self.work = asyncio.Event()
+        self.server = None
+        self.printer_task = None
+        self.clients = set()
+
+    @property
+    def labels_remaining(self) -> int:
+        return sum(self.formats)
+
+    def host_status(self) -> bytes:
+        buffered = len(self.formats)
+        return (
+            f"\x02030,{int(self.paper_out)},0,1218,{buffered:03d},{int(buffered >= 999)},0,0,000,0,0,0\x03\r\n"
+            f"\x02001,0,0,0,0,2,4,0,{self.labels_remaining:08d},1,000\x03\r\n"
+            "\x021234,0\x03\r\n"
+        ).encode("ascii")
+
+    async def start(self, host: str = "127.0.0.1", port: int = 9100):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.printer_task = asyncio.create_task(self.run_printer())
+        return self
+
+    async def stop(self):
+        self.printer_task.cancel()
+        self.server.close()
+        for writer in self.clients:
+            writer.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        if self.drop_every and self.connections % self.drop_every == 0:
+            self.dropped += 1
+            writer.close()
+            return
+        self.clients.add(writer)
+        buf = b""
+        try:
+            while chunk := await reader.read(65536):
+                buf += chunk
+                # ~HS is a "tilde" command: answered immediately, even between formats
+                while b"~HS" in buf:
+                    buf = buf.replace(b"~HS", b"", 1)
+                    self.status_queries += 1
+                    if self.status:
+                        writer.write(self.host_status())
+                        await writer.drain()
+                end = 0
+                for match in FORMAT_RE.finditer(buf):
+                    quantity = QUANTITY_RE.search(match.group(1))
+                    self.formats.append(int(quantity.group(1)) if quantity else 1)
+                    self.formats_received += 1
+                    end = match.end()
+                buf = buf[end:]
+                if end:
+                    self.work.set()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def run_printer(self):
+        while True:
+            await self.work.wait()
+            while self.formats:
+                if self.paper_out_after and self.printed == self.paper_out_after:
+                    self.paper_out = True
+                    await asyncio.sleep(self.paper_out_seconds)
+                    self.paper_out = False
+                await asyncio.sleep(self.label_seconds)
+                self.printed += 1
+                self.formats[0] -= 1
+                if self.formats[0] <= 0:
+                    self.formats.pop(0)
+            self.work.clear()
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "dropped": self.dropped,
+            "formats_received": self.formats_received,
+            "labels_printed": self.printed,
+            "labels_remaining": self.labels_remaining,
+            "status_queries": self.status_queries,
+            "paper_out": self.paper_out,
+        }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--label-ms", type=float, default=50, help="time to print one label")
+    parser.add_argument("--drop-every", type=int, default=0, help="close every Nth connection on accept")
+    parser.add_argument("--paper-out-after", type=int, default=0, help="run out of paper after N labels")
+    parser.add_argument("--paper-out-seconds", type=float, default=5)
+    parser.add_argument("--no-status", action="store_true", help="ignore ~HS like printers without host status")
+    parser.add_argument("--stats-every", type=float, default=5, help="seconds between stats lines")
+    args = parser.parse_args()
+
+    printer = await FakeZebra(args.label_ms, args.drop_every, args.paper_out_after, args.paper_out_seconds,
+                              status=not args.no_status).start(args.host, args.port)
+    print(f"Fake Zebra listening on {args.host}:{args.port}")
+    started = time.perf_counter()
+    try:
+        while True:
+            await asyncio.sleep(args.stats_every)
+            stats = printer.stats()
+            print(f"[{time.perf_counter() - started:7.1f}s] " + "  ".join(f"{k}={v}" for k, v in stats.items()))
+    finally:
+        await printer.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
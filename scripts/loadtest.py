@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Concurrent-request load test for the SDS backend.
+
+Logs in once, then keeps --concurrency requests in flight for --duration
+seconds, cycling through a mix of endpoints. Reports throughput and latency
+percentiles per endpoint and overall, so runs before and after a change can
+be compared side by side.
+
+Q&A requests get a unique suffix so the answer cache does not serve them;
+pass --cached to measure cache hits instead. Uploads send a synthetic SDS PDF
+(or --pdf) with a unique trailer so the extraction cache does not serve them;
+the request returns once the job is queued, so watch /sds/metrics for the
+model side.
+
+To load test without paying for (or reaching) the real model, start the
+backend with the stub provider, e.g.
+    LLM_PROVIDER=stub LLM_STUB_LATENCY=0.8 LLM_STUB_TOKEN_MS=5 uvicorn main:app
+
+Usage:
+    python scripts/loadtest.py --url http://localhost:8000 --email a@b.c --password pw
+    python scripts/loadtest.py --token $JWT --concurrency 50 --duration 30 --mix question,dashboard
+    python scripts/loadtest.py --token $JWT --mix upload,question,download --concurrency 20
+"""
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from collections import defaultdict
+from typing import Optional
+
+import httpx
+
+ENDPOINTS = {
+    "health": ("GET", "/health", None),
+    "dashboard": ("GET", "/sds/dashboard", None),
+    "chemicals": ("GET", "/sds/chemicals", None),
+    "compatibility": ("GET", "/sds/compatibility", None),
+    "question": ("POST", "/sds/question", {"question": "What PPE do I need for acetone?"}),
+    "login": ("POST", "/auth/login", None),  # bcrypt verify per request
+    "download": ("POST", "/sds/download", {"evidence_type": "all", "format": "json"}),
+    "download_pdf": ("POST", "/sds/download", {"evidence_type": "all", "format": "pdf"}),
+    "upload": ("POST", "/sds/upload", None),  # multipart; see sample_pdf()
+}
+
+
+def sample_pdf(path: Optional[Path]) -> bytes:
+    """The SDS uploaded by the 'upload' endpoint: --pdf, or a generated 6-page one."""
+    if path:
+        return path.read_bytes()
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from bench_sds_extract import make_text_sds
+    import random
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp) / "sample.pdf"
+        make_text_sds(out, 6, random.Random(1))
+        return out.read_bytes()
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def login(client: httpx.AsyncClient, email: str, password: str) -> str:
+    r = await client.post("/auth/login", json={"email": email, "password": password})
+    r.raise_for_status()
+    return r.json()["token"]
+
+
+async def worker(client, names, args, headers, deadline, results, counter):
+    i = 0
+    while time.perf_counter() < deadline:
+        name = names[i % len(names)]
+        i += 1
+        method, path, body = ENDPOINTS[name]
+        files = None
+        if name == "login":
+            body = {"email": args.email, "password": args.password}
+        elif name == "question" and not args.cached:
+            counter[0] += 1
+            body = {"question": f"{body['question']} (run {counter[0]})"}
+        elif name == "upload":
+            counter[0] += 1
+            trailer = b"" if args.cached else f"\n% loadtest {counter[0]} {time.time()}\n".encode()
+            files = {"file": (f"loadtest_{counter[0]}.pdf", args.pdf_bytes + trailer, "application/pdf")}
+        t0 = time.perf_counter()
+        try:
+            if files:
+                r = await client.request(method, path, files=files, headers=headers)
+            else:
+                r = await client.request(method, path, json=body, headers=headers)
+            ok = r.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        results[name].append((time.perf_counter() - t0, ok))
+
+
+async def run(args) -> None:
+    names = [n.strip() for n in args.mix.split(",") if n.strip()]
+    unknown = [n for n in names if n not in ENDPOINTS]
+    if unknown:
+        raise SystemExit(f"Unknown endpoint(s): {', '.join(unknown)} (choose from {', '.join(ENDPOINTS)})")
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        token = args.token or await login(client, args.email, args.password)
+        headers = {"Authorization": f"Bearer {token}"}
+        results = defaultdict(list)
+        counter = [0]
+
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            worker(client, names[i % len(names):] + names[:i % len(names)], args, headers, deadline, results, counter)
+            for i in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+    print(f"{args.url}  concurrency={args.concurrency}  duration={elapsed:.1f}s  mix={','.join(names)}")
+    print(f"{'endpoint':>14} | {'requests':>8} | {'errors':>6} | {'req/s':>7} | {'p50 ms':>7} | {'p95 ms':>7} | {'p99 ms':>7}")
+    rows = list(results.items()) + [("TOTAL", [x for v in results.values() for x in v])]
+    for name, samples in rows:
+        lat = [s * 1000 for s, ok in samples if ok]
+        errors = sum(1 for _, ok in samples if not ok)
+        print(f"{name:>14} | {len(samples):>8} | {errors:>6} | {len(samples) / elapsed:>7.1f} | "
+              f"{percentile(lat, 50):>7.0f} | {percentile(lat, 95):>7.0f} | {percentile(lat, 99):>7.0f}")
+    if results:
+        all_lat = [s * 1000 for v in results.values() for s, ok in v if ok]
+        if all_lat:
+            print(f"\nmean latency {statistics.mean(all_lat):.0f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default="http://localhost:8000")
+    ap.add_argument("--token", help="bearer token (otherwise --email/--password are used to log in)")
+    ap.add_argument("--email")
+    ap.add_argument("--password")
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--duration", type=float, default=15)
+    ap.add_argument("--timeout", type=float, default=60)
+    ap.add_argument("--mix", default="question,dashboard,chemicals,health",
+                    help=f"comma-separated endpoints: {', '.join(ENDPOINTS)}")
+    ap.add_argument("--cached", action="store_true",
+                    help="repeat the same question / file (answer and extraction cache hits)")
+    ap.add_argument("--pdf", type=Path, help="SDS file for the upload endpoint (default: generated)")
+    args = ap.parse_args()
+    if not args.token and not (args.email and args.password):
+        ap.error("give --token or --email and --password")
+    if "upload" in args.mix:
+        args.pdf_bytes = sample_pdf(args.pdf)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()